@@ -0,0 +1,101 @@
+"""
+Микро-бенчмарк вычисления хешей файлов.
+
+Сравнивает прежнюю реализацию calculate_file_hash (чтение по 4 КБ через
+iter/lambda) с hash_file (readinto в крупный буфер и mmap) по группам
+размеров файлов. Файлы создаются во временной директории и читаются из
+кеша страниц, поэтому измеряются накладные расходы Python и хеш-функции,
+а не скорость диска.
+
+Запуск из корня репозитория:
+    python -m benchmarks.hash_benchmark [--dir /mnt/target] [--algorithm sha256] [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.migration.hash_engine import hash_file  # noqa: E402
+
+# Группы размеров: (размер файла, количество файлов)
+BUCKETS = [
+    (4 * 1024, 2000),
+    (64 * 1024, 500),
+    (1024 * 1024, 100),
+    (16 * 1024 * 1024, 8),
+    (256 * 1024 * 1024, 1),
+]
+
+
+def legacy_hash(path, algorithm):
+    """Прежняя реализация calculate_file_hash."""
+    hash_func = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_func.update(chunk)
+    return hash_func.hexdigest()
+
+
+def make_files(directory, size, count):
+    paths = []
+    block = os.urandom(min(size, 1024 * 1024))
+    for i in range(count):
+        path = os.path.join(directory, f"{size}_{i}.bin")
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+
+def measure(func, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк вычисления хешей файлов")
+    parser.add_argument('--dir', default=None, help='Директория для тестовых файлов (по умолчанию временная)')
+    parser.add_argument('--algorithm', default='sha256', help='Алгоритм хеширования')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов (берётся лучший результат)')
+    parser.add_argument('--buffer-size', type=int, default=4 * 1024 * 1024, help='Размер буфера hash_file')
+    args = parser.parse_args()
+
+    variants = [
+        ("legacy 4 KB", lambda path: legacy_hash(path, args.algorithm)),
+        (f"readinto {args.buffer_size // 1024} KB",
+         lambda path: hash_file(path, args.algorithm, buffer_size=args.buffer_size)),
+        ("mmap", lambda path: hash_file(path, args.algorithm, buffer_size=args.buffer_size,
+                                        use_mmap=True, mmap_min_size=1)),
+    ]
+
+    print(f"{'Размер':>10} {'Файлов':>7} " + " ".join(f"{name:>18}" for name, _ in variants))
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for size, count in BUCKETS:
+            paths = make_files(directory, size, count)
+            total_mb = size * count / (1024 * 1024)
+            results = []
+            for _, func in variants:
+                elapsed = measure(func, paths, args.repeat)
+                results.append(f"{total_mb / elapsed:>13.1f} MB/s")
+            label = f"{size // 1024} KB" if size < 1024 * 1024 else f"{size // (1024 * 1024)} MB"
+            print(f"{label:>10} {count:>7} " + " ".join(f"{r:>18}" for r in results))
+            for path in paths:
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
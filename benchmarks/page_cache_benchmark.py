@@ -0,0 +1,168 @@
+"""
+Бенчмарк влияния подсказок posix_fadvise на кеш страниц при копировании.
+
+Набор файлов копируется с проверкой хеша целевого файла в трёх режимах:
+без подсказок, с подсказками (SEQUENTIAL/WILLNEED для источника, DONTNEED
+для проверенных файлов) и с подсказками и упреждающим чтением следующего
+файла. Для каждого режима выводятся:
+    - время и скорость;
+    - доля страниц целевых файлов в кеше перед проверкой (попадания проверки в кеш);
+    - доля начала следующего файла в кеше к началу его копирования
+      (попадания упреждающего чтения);
+    - доля страниц источников и целей, оставшихся в кеше после копирования;
+    - прирост Cached из /proc/meminfo и RSS процесса.
+
+Резидентность страниц определяется через mincore (ctypes, только Linux).
+Перед каждым режимом страницы источников вытесняются из кеша.
+
+Запуск из корня репозитория:
+    python -m benchmarks.page_cache_benchmark [--dir /mnt/target] [--size-mb 512] [--files 8]
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import mmap
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.migration.copy_engine import copy_with_hash  # noqa: E402
+from src.migration.hash_engine import hash_file  # noqa: E402
+from src.migration.page_cache import drop_file_cache, prefetch_file  # noqa: E402
+
+PAGE_SIZE = mmap.PAGESIZE
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+
+
+def resident_fraction(path, length=None):
+    """
+    :param path: Путь к файлу
+    :param length: Проверяемый объём от начала файла (по умолчанию весь файл)
+    :return: Доля страниц файла, находящихся в кеше страниц
+    """
+    size = os.path.getsize(path)
+    length = size if length is None else min(length, size)
+    if length == 0:
+        return 1.0
+    with open(path, 'rb') as f:
+        # Частное отображение доступно для записи, поэтому ctypes может получить его адрес
+        mapped = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_COPY)
+        try:
+            pages = (length + PAGE_SIZE - 1) // PAGE_SIZE
+            vec = (ctypes.c_ubyte * pages)()
+            anchor = ctypes.c_char.from_buffer(mapped)
+            try:
+                if _libc.mincore(ctypes.addressof(anchor), length, vec) != 0:
+                    raise OSError(ctypes.get_errno(), "mincore")
+            finally:
+                del anchor
+            return sum(v & 1 for v in vec) / pages
+        finally:
+            mapped.close()
+
+
+def meminfo_cached():
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('Cached:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def make_files(directory, size, count):
+    paths = []
+    block = os.urandom(1024 * 1024)
+    for i in range(count):
+        path = os.path.join(directory, f"src_{i}.bin")
+        with open(path, 'wb') as f:
+            for _ in range(size // len(block)):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+
+def run_variant(sources, target_dir, hints, prefetch, readahead, prefetch_bytes):
+    for path in sources:
+        drop_file_cache(path, sync=True)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.makedirs(target_dir)
+
+    cached_before = meminfo_cached()
+    verify_hits, prefetch_hits = [], []
+    targets = []
+    start = time.perf_counter()
+    for index, source in enumerate(sources):
+        if prefetch and index > 0:
+            prefetch_hits.append(resident_fraction(source, prefetch_bytes))
+        if prefetch and index + 1 < len(sources):
+            prefetch_file(sources[index + 1], prefetch_bytes)
+
+        target = os.path.join(target_dir, os.path.basename(source))
+        digest, _ = copy_with_hash(source, target, readahead=readahead if hints else None)
+        verify_hits.append(resident_fraction(target))
+        if hash_file(target, 'sha256')['sha256'] != digest:
+            raise RuntimeError(f"Хеш не совпал: {target}")
+        if hints:
+            drop_file_cache(target, sync=True)
+            drop_file_cache(source)
+        targets.append(target)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'elapsed': elapsed,
+        'verify_hit': sum(verify_hits) / len(verify_hits),
+        'prefetch_hit': sum(prefetch_hits) / len(prefetch_hits) if prefetch_hits else None,
+        'source_resident': sum(resident_fraction(p) for p in sources) / len(sources),
+        'target_resident': sum(resident_fraction(p) for p in targets) / len(targets),
+        'cached_delta': meminfo_cached() - cached_before,
+        'rss': current_rss(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подсказок кеша страниц при копировании")
+    parser.add_argument('--dir', default=None, help='Директория для тестовых файлов (по умолчанию временная)')
+    parser.add_argument('--size-mb', type=int, default=512, help='Общий объём файлов в МБ')
+    parser.add_argument('--files', type=int, default=8, help='Количество файлов')
+    parser.add_argument('--readahead', type=int, default=32 * 1024 * 1024, help='Объём WILLNEED для источника')
+    parser.add_argument('--prefetch-bytes', type=int, default=8 * 1024 * 1024,
+                        help='Объём упреждающего чтения следующего файла')
+    args = parser.parse_args()
+
+    variants = [
+        ("без подсказок", False, False),
+        ("fadvise", True, False),
+        ("fadvise + prefetch", True, True),
+    ]
+    size = max(1, args.size_mb // args.files) * 1024 * 1024
+
+    print(f"{'Режим':>20} {'MB/s':>8} {'Проверка в кеше':>16} {'Prefetch':>9} "
+          f"{'Источник':>9} {'Цель':>7} {'Δ Cached, MB':>13} {'RSS, MB':>8}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        sources = make_files(directory, size, args.files)
+        target_dir = os.path.join(directory, 'target')
+        for name, hints, prefetch in variants:
+            r = run_variant(sources, target_dir, hints, prefetch, args.readahead, args.prefetch_bytes)
+            prefetch_hit = f"{r['prefetch_hit']:.0%}" if r['prefetch_hit'] is not None else "-"
+            print(f"{name:>20} {size * args.files / (1024 * 1024) / r['elapsed']:>8.1f} "
+                  f"{r['verify_hit']:>16.0%} {prefetch_hit:>9} {r['source_resident']:>9.0%} "
+                  f"{r['target_resident']:>7.0%} {r['cached_delta'] / (1024 * 1024):>13.1f} "
+                  f"{r['rss'] / (1024 * 1024):>8.1f}")
+    print(f"Пиковый RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import logging
+import collections
 import shutil
 import datetime
 import threading
@@ -17,7 +18,10 @@ from src.shortcuts_printers.shortcuts_manager import process_user_shortcuts
 from src.shortcuts_printers.shortcut_creator import create_shortcuts
 from src.shortcuts_printers.printer_connector import connect_printers
 from src.migration.direct_migration import direct_migrate, resume_direct_migration
-from src.migration.state_tracker import load_state, update_global_state, update_user_state, cleanup_old_state_files
+from src.migration.error_budget import ErrorBudgetExceeded
+from src.migration.hash_index import migrate_hash_db
+from src.migration.state_tracker import get_state, update_global_state, update_user_state, cleanup_old_state_files, flush_state
+from src.migration.state_tracker import pause_state_replication, resume_state_replication
 from src.structure.structure_normalizer import get_users_from_host_dir, format_username_for_linux, set_permissions, copy_skel
 from src.config.config_loader import fill_placeholders
 from src.metrics_monitoring.report import generate_report
@@ -56,6 +60,26 @@ def heartbeat_thread(stop_event, interval=30):
         update_global_state(last_heartbeat=datetime.datetime.now().isoformat())
         time.sleep(interval)
 
+def remount_source(data_source_type, config):
+    """
+    Перемонтирует источник данных после прерывания копирования по бюджету ошибок.
+
+    :param data_source_type: Тип источника ('network' или 'usb')
+    :param config: Конфигурация
+    :return: Путь к исходной папке с директориями пользователей
+    """
+    logger.info("Перемонтирование источника данных после массовых ошибок копирования...")
+    if data_source_type == 'network':
+        # Состояние хранится на том же хранилище: пока оно отмонтировано, запись приостановлена
+        flush_state(network_timeout=config.get("STATE_REPLICATION_CLOSE_TIMEOUT", 15))
+        pause_state_replication(timeout=config.get("STATE_REPLICATION_CLOSE_TIMEOUT", 15))
+        umount_dfs()
+        mount_point = mount_dfs()
+        resume_state_replication()
+        return os.path.join(mount_point, config["SOURCE_FOLDER"].lstrip('/'))
+    umount_usb(config)
+    return mount_usb(config)
+
 def main():
     """
     Основная функция для выполнения миграции данных с сетевого хранилища на локальную машину.
@@ -76,6 +100,8 @@ def main():
                         help="Зашифровать только поле 'password' (#PWD).")
     parser.add_argument("--config-yaml", default="src/config/settings.yaml",
                         help="Путь к конфигурационному файлу (по умолчанию src/config/settings.yaml).")
+    parser.add_argument("--migrate-hash-db", nargs="*", metavar="DB",
+                        help="Привести базы хешей к каноническим ключам путей (по умолчанию DATABASE_PATH) и выйти.")
 
     args = parser.parse_args()
 
@@ -92,6 +118,14 @@ def main():
 
     # 4. Иначе - обычный сценарий миграции
     config = load_config(args.config_yaml)
+
+    # Однократное приведение баз хешей к каноническим ключам
+    if args.migrate_hash_db is not None:
+        for db_path in args.migrate_hash_db or [config["DATABASE_PATH"]]:
+            migrate_hash_db(db_path, network_prefix=config.get("HASH_DB_NETWORK_PREFIX"))
+        logger.info("Приведение баз хешей завершено. Выход.")
+        sys.exit(0)
+
     heartbeat = Heartbeat()
     heartbeat.send_heartbeat("started", "global")
     try:
@@ -157,7 +191,7 @@ def main():
         # Получение списка пользователей из исходной папки
         users = get_users_from_host_dir(source_folder, config["EXCLUDE_DIRS"])
         # Получение статуса миграции пользователей
-        state = load_state()
+        state = get_state()
         # Получаем количество пользователей для вычисления процентов миграции
         total_users = len(users)
         users_completed = 0
@@ -177,8 +211,13 @@ def main():
         hb_thread.start()
         
 
+        # Пользователи, копирование которых прервано по бюджету ошибок, повторяются в конце очереди
+        pending_users = collections.deque(users)
+        budget_retries = {}
+
         try:
-            for user in users:
+            while pending_users:
+                user = pending_users.popleft()
                 if graceful_exit:
                     logger.info("Получен сигнал завершения. Прерываем миграцию.")
                     update_global_state(status="interrupted")
@@ -352,6 +391,34 @@ def main():
                         data_volume=f"{report_data['target_size'] / (1024 * 1024):.2f} MB",
                         eta="Рассчитывается..."
                     )
+                except ErrorBudgetExceeded as e:
+                    attempts = budget_retries.get(linux_user, 0) + 1
+                    budget_retries[linux_user] = attempts
+                    handle_migration_error(
+                        MigrationErrorCodes.NETWORK_001 if data_source_type == 'network' else MigrationErrorCodes.USER_003,
+                        details=f"Копирование прервано по бюджету ошибок: {e.category}, {e.reason}",
+                        context={"user": linux_user, "attempt": attempts}
+                    )
+                    if attempts > config.get("ERROR_BUDGET_MAX_RETRIES", 2):
+                        logger.error(f"Копирование пользователя {linux_user} прервано {attempts} раз(а), повторов больше не будет")
+                        update_user_state(linux_user, "failed")
+                    else:
+                        logger.warning(f"Пользователь {linux_user} перенесён в очередь повтора (попытка {attempts})")
+                        # user к этому моменту заменён именем Linux: в очередь возвращается имя директории источника
+                        pending_users.append(os.path.basename(user_dir))
+
+                    try:
+                        source_folder = remount_source(data_source_type, config)
+                    except Exception as mount_error:
+                        handle_migration_error(
+                            MigrationErrorCodes.MOUNT_001 if data_source_type == 'network' else MigrationErrorCodes.MOUNT_002,
+                            details="Не удалось перемонтировать источник после массовых ошибок копирования",
+                            exception=mount_error,
+                            context={"user": linux_user}
+                        )
+                        raise
+                    # Повтор продолжит копирование по журналу (статус пользователя - in_progress)
+                    state = get_state()
                 except Exception as e:
                     logger.exception(f"Ошибка при миграции данных для пользователя {linux_user}: {e}")
                     update_global_state(status="failed", last_update=datetime.datetime.now().isoformat(),
@@ -397,8 +464,12 @@ def main():
             # Останавливаем heartbeat
             stop_heartbeat.set()
             hb_thread.join()
+            # Итоговое состояние отправляется на сетевое хранилище до его отмонтирования
+            flush_state(network_timeout=config.get("STATE_REPLICATION_CLOSE_TIMEOUT", 15))
 
             if data_source_type == 'network':
+                # После отмонтирования состояние на хранилище не пишется (в том числе при выходе)
+                pause_state_replication(timeout=config.get("STATE_REPLICATION_CLOSE_TIMEOUT", 15))
                 umount_dfs()
                 logger.info("Сетевое хранилище отмонтировано.")
             elif data_source_type == 'usb':
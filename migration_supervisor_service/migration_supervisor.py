@@ -13,6 +13,7 @@ import subprocess
 import logging
 import datetime
 import errno
+import sqlite3
 from pathlib import Path
 
 # =============================================================================
@@ -23,6 +24,8 @@ VENV_PATH = "/opt/migration/venv"
 
 # ИСПРАВЛЕНО: Используем специальный файл для чтения супервизором
 SUPERVISOR_READ_FILE = "/var/lib/migration-service/supervisor_state.json"
+# База состояния миграции (SQLite WAL), основной источник; JSON-файлы - для прежних версий
+STATE_DB_FILE = "/var/lib/migration-service/state.db"
 SERVICE_STATE_FILE = "/var/lib/migration-service/state.json"
 LOG_FILE = "/var/log/migration-supervisor/migration-supervisor.log"
 PID_FILE = "/var/run/migration-supervisor.pid"
@@ -77,6 +80,43 @@ def safe_read_json_file(file_path, timeout=FILE_READ_TIMEOUT):
     
     return None
 
+def read_state_db(db_path=STATE_DB_FILE, timeout=FILE_READ_TIMEOUT):
+    """
+    Читает состояние для супервизора из базы состояния (только чтение, не мешает записи).
+    """
+    if not os.path.exists(db_path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=timeout)
+    except sqlite3.Error:
+        return None
+    try:
+        if conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone() is None:
+            return None
+        global_state = {
+            key: json.loads(value) for key, value in conn.execute(
+                "SELECT key, value FROM global_state WHERE key IN ('status', 'last_heartbeat', 'current_user', 'last_error')"
+            )
+        }
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM users GROUP BY status"))
+    except (sqlite3.Error, ValueError):
+        return None
+    finally:
+        conn.close()
+
+    total_users = sum(counts.values())
+    users_completed = counts.get("success", 0) + counts.get("completed_with_error", 0)
+    last_error = global_state.get("last_error")
+    return {
+        "supervisor_timestamp": datetime.datetime.now().isoformat(),
+        "status": global_state.get("status", "unknown"),
+        "last_heartbeat": global_state.get("last_heartbeat"),
+        "current_user": global_state.get("current_user"),
+        "users_in_progress": counts.get("in_progress", 0),
+        "progress_percent": (users_completed / total_users * 100) if total_users > 0 else 0,
+        "last_error": last_error.get("code") if isinstance(last_error, dict) else None
+    }
+
 class MigrationSupervisor:
     def __init__(self):
         self.running = False
@@ -128,7 +168,12 @@ class MigrationSupervisor:
         """
         ИСПРАВЛЕНО: Читаем состояние из специального файла для супервизора.
         """
-        # Приоритет: сначала специальный файл для супервизора
+        # Приоритет: база состояния
+        data = read_state_db()
+        if data is not None:
+            return data
+        
+        # Файл для супервизора (прежние версии миграции)
         data = safe_read_json_file(SUPERVISOR_READ_FILE)
         if data is not None:
             return data
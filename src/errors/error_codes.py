@@ -6,6 +6,7 @@
 """
 
 import logging
+import threading
 from enum import Enum
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
@@ -218,10 +219,13 @@ class ErrorHandler:
     def __init__(self, update_state_callback=None):
         self.update_state_callback = update_state_callback
         self.error_stats = {category.value: 0 for category in ErrorCategory}
+        # Обработчик может вызываться из нескольких рабочих потоков
+        self._stats_lock = threading.Lock()
         
     def handle_error(self, error_code: ErrorCode, details: str = "", 
                     exception: Optional[Exception] = None, 
-                    context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                    context: Optional[Dict[str, Any]] = None,
+                    with_traceback: bool = True, log: bool = True) -> Dict[str, Any]:
         """
         Обрабатывает ошибку с логированием и обновлением состояния
         
@@ -230,6 +234,8 @@ class ErrorHandler:
             details: Дополнительные детали ошибки
             exception: Исключение Python (если есть)
             context: Контекст ошибки (пользователь, файл и т.д.)
+            with_traceback: Включать traceback исключения (его форматирование дорогое)
+            log: Записывать ошибку в лог
             
         Returns:
             Структурированная информация об ошибке
@@ -250,15 +256,18 @@ class ErrorHandler:
         if exception:
             error_info["exception"] = {
                 "type": type(exception).__name__,
-                "message": str(exception),
-                "traceback": self._get_traceback_string(exception)
+                "message": str(exception)
             }
+            if with_traceback:
+                error_info["exception"]["traceback"] = self._get_traceback_string(exception)
         
         # Логируем ошибку
-        self._log_error(error_info)
+        if log:
+            self._log_error(error_info)
         
         # Обновляем статистику
-        self.error_stats[error_code.category.value] += 1
+        with self._stats_lock:
+            self.error_stats[error_code.category.value] += 1
         
         # Обновляем состояние миграции (если задан callback)
         if self.update_state_callback:
@@ -299,11 +308,13 @@ class ErrorHandler:
     
     def get_error_summary(self) -> Dict[str, Any]:
         """Возвращает сводку по ошибкам"""
-        total_errors = sum(self.error_stats.values())
+        with self._stats_lock:
+            error_stats = self.error_stats.copy()
+        total_errors = sum(error_stats.values())
         return {
             "total_errors": total_errors,
-            "by_category": self.error_stats.copy(),
-            "most_frequent": max(self.error_stats.items(), key=lambda x: x[1]) if total_errors > 0 else None
+            "by_category": error_stats,
+            "most_frequent": max(error_stats.items(), key=lambda x: x[1]) if total_errors > 0 else None
         }
 
 
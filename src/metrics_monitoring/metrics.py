@@ -7,6 +7,7 @@
     - track_file_failed: Увеличивает счетчик неудачных миграций файлов.
     - track_migration_time: Отмечает время завершения миграции.
     - update_migration_speed: Обновляет метрику скорости миграции.
+    - track_concurrency: Публикует решение контроллера параллельности копирования.
     - start_metrics_server: Запускает HTTP сервер для экспорта метрик Prometheus.
 """
 import os
@@ -21,6 +22,10 @@ FILES_MIGRATED = Counter('files_migrated', 'Количество успешно
 FILES_FAILED = Counter('files_failed', 'Количество файлов, которые не удалось мигрировать')
 MIGRATION_TIME = Summary('migration_time', 'Время миграции')
 CURRENT_SPEED = Gauge('current_migration_speed', 'Текущая скорость миграции в файлах в секунду')
+COPY_CONCURRENCY = Gauge('copy_concurrency_limit', 'Текущий предел параллельности копирования', ['lane'])
+COPY_THROUGHPUT_BYTES = Gauge('copy_throughput_bytes', 'Скорость копирования в байтах в секунду', ['lane'])
+COPY_THROUGHPUT_FILES = Gauge('copy_throughput_files', 'Скорость копирования в файлах в секунду', ['lane'])
+CONCURRENCY_DECISIONS = Counter('copy_concurrency_decisions', 'Решения контроллера параллельности', ['lane', 'decision'])
 
 def start_metrics_server(port=8000):
     """
@@ -66,3 +71,18 @@ def track_migration_time(start_time):
     :param start_time: Время начала миграции.
     """
     MIGRATION_TIME.observe(time.time() - start_time)
+
+def track_concurrency(lane, limit, bytes_per_sec, files_per_sec, decision):
+    """
+    Публикует решение контроллера параллельности копирования.
+
+    :param lane: Имя полосы копирования (контроллера).
+    :param limit: Новый предел параллельности.
+    :param bytes_per_sec: Скорость копирования за окно измерения, байт/с.
+    :param files_per_sec: Скорость копирования за окно измерения, файлов/с.
+    :param decision: Решение контроллера ('increase', 'decrease', 'hold').
+    """
+    COPY_CONCURRENCY.labels(lane=lane).set(limit)
+    COPY_THROUGHPUT_BYTES.labels(lane=lane).set(bytes_per_sec)
+    COPY_THROUGHPUT_FILES.labels(lane=lane).set(files_per_sec)
+    CONCURRENCY_DECISIONS.labels(lane=lane, decision=decision).inc()
@@ -0,0 +1,183 @@
+"""
+Модуль адаптивного управления параллельностью копирования.
+
+Количество потоков, одновременно копирующих файлы, подбирается во время работы
+по наблюдаемой пропускной способности (AIMD): пока все слоты заняты и скорость
+не падает, предел увеличивается на единицу; если за очередное окно упали и
+байты/с, и файлы/с, предел уменьшается в несколько раз. Так параллельность
+сама растёт на CIFS с большой задержкой и мелкими файлами и сама снижается,
+когда лишние потоки начинают мешать друг другу (например, на USB HDD).
+
+Рабочие потоки запускаются в количестве max_limit, а контроллер пропускает
+к копированию не больше limit из них одновременно.
+
+Классы:
+    - ConcurrencyController: Семафор с изменяемым пределом и AIMD-регулированием.
+    - DeviceLimiter: Ограничение числа одновременных операций на каждом устройстве.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Решения контроллера по итогам окна измерений
+DECISION_INCREASE = "increase"
+DECISION_DECREASE = "decrease"
+DECISION_HOLD = "hold"
+
+
+class ConcurrencyController:
+    """Ограничитель параллельности с аддитивным увеличением и мультипликативным уменьшением"""
+
+    def __init__(self, initial=2, min_limit=1, max_limit=16, interval=2.0, decrease_factor=0.5,
+                 tolerance=0.1, name="copy", on_adjust=None, clock=time.monotonic):
+        """
+        :param initial: Начальный предел параллельности
+        :param min_limit: Минимальный предел
+        :param max_limit: Максимальный предел (равен количеству рабочих потоков)
+        :param interval: Длительность окна измерения пропускной способности в секундах
+        :param decrease_factor: Множитель предела при падении скорости
+        :param tolerance: Относительное падение скорости, которое считается шумом
+        :param name: Имя контроллера (для логов и метрик)
+        :param on_adjust: Функция (name, limit, bytes_per_sec, files_per_sec, decision),
+                          вызываемая по итогам каждого окна
+        :param clock: Источник времени (для тестов)
+        """
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = self._clamp(initial)
+        self.interval = interval
+        self.decrease_factor = decrease_factor
+        self.tolerance = tolerance
+        self.name = name
+        self.on_adjust = on_adjust
+        self.clock = clock
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._window_start = clock()
+        self._window_bytes = 0
+        self._window_files = 0
+        # Были ли заняты все слоты в течение окна: без этого увеличивать предел бессмысленно
+        self._saturated = False
+        self._previous_rates = None
+
+    def _clamp(self, value):
+        return max(self.min_limit, min(self.max_limit, int(value)))
+
+    @property
+    def active(self):
+        with self._cond:
+            return self._active
+
+    def acquire(self):
+        """Ожидает свободный слот копирования."""
+        with self._cond:
+            while self._active >= self.limit:
+                self._saturated = True
+                self._cond.wait()
+            self._active += 1
+            if self._active >= self.limit:
+                self._saturated = True
+
+    def release(self, nbytes=0):
+        """
+        Освобождает слот и учитывает результат копирования.
+
+        :param nbytes: Количество скопированных байт (0 для неудачного копирования)
+        """
+        sample = None
+        with self._cond:
+            self._active -= 1
+            self._window_bytes += nbytes
+            self._window_files += 1
+
+            now = self.clock()
+            if now - self._window_start >= self.interval:
+                sample = self._adjust(now)
+            self._cond.notify_all()
+
+        if sample is not None and self.on_adjust is not None:
+            try:
+                self.on_adjust(self.name, *sample)
+            except Exception as e:
+                logger.warning(f"Ошибка при публикации решения контроллера {self.name}: {e}")
+
+    def _adjust(self, now):
+        """Закрывает окно измерения и пересчитывает предел. Вызывается под блокировкой."""
+        elapsed = max(now - self._window_start, 1e-6)
+        bytes_rate = self._window_bytes / elapsed
+        files_rate = self._window_files / elapsed
+        previous = self._previous_rates
+
+        if previous is not None and \
+                bytes_rate < previous[0] * (1 - self.tolerance) and \
+                files_rate < previous[1] * (1 - self.tolerance):
+            decision = DECISION_DECREASE
+            new_limit = self._clamp(self.limit * self.decrease_factor)
+        elif self._saturated:
+            decision = DECISION_INCREASE
+            new_limit = self._clamp(self.limit + 1)
+        else:
+            decision = DECISION_HOLD
+            new_limit = self.limit
+
+        if new_limit != self.limit:
+            logger.info(
+                f"Контроллер {self.name}: предел параллельности {self.limit} -> {new_limit} "
+                f"({bytes_rate / (1024 * 1024):.2f} MB/s, {files_rate:.1f} файлов/с)"
+            )
+        else:
+            logger.debug(
+                f"Контроллер {self.name}: предел {self.limit} без изменений ({decision}, "
+                f"{bytes_rate / (1024 * 1024):.2f} MB/s, {files_rate:.1f} файлов/с)"
+            )
+        self.limit = new_limit
+
+        self._previous_rates = (bytes_rate, files_rate)
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_files = 0
+        self._saturated = self._active >= self.limit
+        return new_limit, bytes_rate, files_rate, decision
+
+
+class DeviceLimiter:
+    """Семафоры по st_dev: не больше per_device одновременных операций на одном устройстве"""
+
+    def __init__(self, per_device=4):
+        """
+        :param per_device: Максимальное количество одновременных операций на одном устройстве
+        """
+        self.per_device = max(1, int(per_device))
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, dev):
+        with self._lock:
+            semaphore = self._semaphores.get(dev)
+            if semaphore is None:
+                semaphore = self._semaphores[dev] = threading.BoundedSemaphore(self.per_device)
+            return semaphore
+
+    @contextmanager
+    def hold(self, *devices):
+        """
+        Занимает слот на каждом из устройств на время блока with.
+        Слоты занимаются в порядке номеров устройств, поэтому потоки не блокируют друг друга.
+
+        :param devices: Номера устройств (st_dev); None и повторы пропускаются
+        """
+        semaphores = [self._semaphore(dev) for dev in sorted({dev for dev in devices if dev is not None})]
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                semaphore.acquire()
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
@@ -0,0 +1,575 @@
+"""
+Модуль копирования файлов с одновременным вычислением хеша.
+
+Данные читаются из источника один раз: каждый прочитанный блок сначала
+передаётся в хеш-функцию, затем записывается в целевой файл. Чтение выполняется
+через readinto в переиспользуемый буфер потока, без создания новых объектов
+bytes на каждый блок.
+
+Если хеш по потоку не нужен, копирование выполняется ядром без передачи данных
+через буферы Python: os.copy_file_range (в том числе серверное копирование CIFS
+внутри одной шары), затем os.sendfile и только затем цикл в пространстве
+пользователя. Перед копированием ядру можно сообщить о последовательном
+чтении источника (readahead, см. page_cache). Механизм выбирается для каждой пары
+устройств (источник, цель), результат кешируется. Отказ механизма на отдельном
+файле (например, EPERM или EINVAL из-за свойств самого файла) копирует этот
+файл следующим механизмом; более предпочтительный механизм исключается для
+пары - и при первой проверке, и после выбора - только после нескольких отказов
+подряд. Принудительно заданный механизм на выбор для пары не влияет.
+
+Очень крупные файлы копируются несколькими потоками pread/pwrite: одного
+TCP-потока CIFS не хватает, чтобы загрузить канал. Когда крупные файлы
+копируются одновременно несколькими рабочими потоками, общий бюджет
+(ParallelCopyBudget) ограничивает суммарное количество потоков чтения и объём
+прочитанных, но ещё не обработанных блоков.
+
+Функции:
+    - get_thread_buffer: Возвращает переиспользуемый буфер текущего потока.
+    - copy_with_hash: Копирует файл и возвращает хеш переданных данных.
+    - kernel_copy: Копирует содержимое файла средствами ядра с автоматическим выбором механизма.
+    - copy2_kernel: Аналог shutil.copy2 на основе kernel_copy (для shutil.move/copytree).
+    - get_backend_for: Возвращает выбранный механизм для пары устройств.
+    - parallel_copy: Копирует крупный файл несколькими потоками (pread/pwrite) с хешем по порядку блоков.
+
+Классы:
+    - ParallelCopyBudget: Общий лимит потоков и памяти блоков для одновременных parallel_copy.
+"""
+
+import collections
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+from src.migration.page_cache import advise_source
+
+logger = logging.getLogger(__name__)
+
+# Механизмы копирования в порядке предпочтения
+BACKEND_COPY_FILE_RANGE = "copy_file_range"
+BACKEND_SENDFILE = "sendfile"
+BACKEND_USERSPACE = "userspace"
+BACKENDS = (BACKEND_COPY_FILE_RANGE, BACKEND_SENDFILE, BACKEND_USERSPACE)
+
+# Ошибки, означающие, что механизм не поддерживается для данной пары файловых систем
+_UNSUPPORTED_ERRNOS = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM
+}
+
+# Максимальный объём одного системного вызова копирования (1 ГБ)
+_MAX_KERNEL_CHUNK = 1024 * 1024 * 1024
+
+# Результаты проверки механизмов: {(st_dev источника, st_dev цели): механизм}
+_backend_cache = {}
+_backend_lock = threading.Lock()
+# Отказы выбранного механизма подряд: {(пара устройств, механизм): количество}
+_backend_failures = collections.Counter()
+
+# Количество отказов выбранного механизма подряд, после которого пара переходит на следующий
+BACKEND_DOWNGRADE_AFTER = 3
+
+# Размер буфера копирования по умолчанию (1 МБ)
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Буферы рабочих потоков: выделяются один раз и переиспользуются для всех файлов
+_thread_buffers = threading.local()
+
+
+def get_thread_buffer(size=DEFAULT_BUFFER_SIZE):
+    """
+    Возвращает memoryview переиспользуемого буфера текущего потока.
+
+    :param size: Требуемый размер буфера в байтах
+    :return: memoryview длиной size
+    """
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None or len(buffer) != size:
+        buffer = bytearray(size)
+        _thread_buffers.buffer = buffer
+        _thread_buffers.view = memoryview(buffer)
+    return _thread_buffers.view
+
+
+def copy_with_hash(source_file, target_file, algorithm='sha256', buffer_size=DEFAULT_BUFFER_SIZE, readahead=None):
+    """
+    Копирует файл, вычисляя хеш по потоку копируемых данных, и переносит
+    метаданные (как shutil.copy2).
+
+    :param source_file: Исходный файл
+    :param target_file: Целевой файл
+    :param algorithm: Алгоритм хеширования ('sha256', 'md5', и т.д.)
+    :param buffer_size: Размер буфера чтения в байтах
+    :param readahead: Объём начала источника для WILLNEED вместе с SEQUENTIAL (None - без подсказок)
+    :return: (hexdigest, количество скопированных байт)
+    :raises OSError: Ошибки чтения источника или записи в целевой файл
+    :raises ValueError: Неподдерживаемый алгоритм хеширования
+    """
+    hash_func = hashlib.new(algorithm)
+    view = get_thread_buffer(buffer_size)
+    copied = 0
+
+    with open(source_file, 'rb', buffering=0) as src, open(target_file, 'wb', buffering=0) as dst:
+        if readahead is not None:
+            advise_source(src.fileno(), readahead)
+        while True:
+            read = src.readinto(view)
+            if not read:
+                break
+            chunk = view[:read]
+            hash_func.update(chunk)
+            # Небуферизованная запись может быть частичной
+            written = 0
+            while written < read:
+                written += dst.write(chunk[written:])
+            copied += read
+
+    shutil.copystat(source_file, target_file)
+    return hash_func.hexdigest(), copied
+
+
+class _BackendUnsupported(Exception):
+    """Механизм копирования не поддерживается для данной пары файлов"""
+
+
+def _copy_file_range_loop(src_fd, dst_fd, size):
+    copied = 0
+    while True:
+        try:
+            sent = os.copy_file_range(src_fd, dst_fd, _MAX_KERNEL_CHUNK)
+        except OSError as e:
+            if copied == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+                raise _BackendUnsupported(e)
+            raise
+        if sent == 0:
+            # Некоторые файловые системы (procfs, sysfs) возвращают 0 вместо ошибки
+            if copied == 0 and size > 0:
+                raise _BackendUnsupported("copy_file_range вернул 0 байт")
+            return copied
+        copied += sent
+
+
+def _sendfile_loop(src_fd, dst_fd, size):
+    copied = 0
+    while True:
+        try:
+            sent = os.sendfile(dst_fd, src_fd, None, _MAX_KERNEL_CHUNK)
+        except OSError as e:
+            if copied == 0 and e.errno in _UNSUPPORTED_ERRNOS:
+                raise _BackendUnsupported(e)
+            raise
+        if sent == 0:
+            if copied == 0 and size > 0:
+                raise _BackendUnsupported("sendfile вернул 0 байт")
+            return copied
+        copied += sent
+
+
+def _userspace_loop(src_fd, dst_fd, size, buffer_size=DEFAULT_BUFFER_SIZE):
+    view = get_thread_buffer(buffer_size)
+    copied = 0
+    while True:
+        read = os.readv(src_fd, [view])
+        if not read:
+            return copied
+        written = 0
+        while written < read:
+            written += os.write(dst_fd, view[written:read])
+        copied += read
+
+
+_BACKEND_FUNCS = {
+    BACKEND_COPY_FILE_RANGE: _copy_file_range_loop,
+    BACKEND_SENDFILE: _sendfile_loop,
+    BACKEND_USERSPACE: _userspace_loop,
+}
+
+
+def get_backend_for(src_dev, dst_dev):
+    """
+    Возвращает механизм копирования, выбранный для пары устройств.
+
+    :param src_dev: st_dev источника
+    :param dst_dev: st_dev цели
+    :return: Имя механизма или None, если пара ещё не проверялась
+    """
+    with _backend_lock:
+        return _backend_cache.get((src_dev, dst_dev))
+
+
+def _backend_available(backend):
+    return backend == BACKEND_USERSPACE or hasattr(os, backend)
+
+
+def _remember_backend(key, backend, cached):
+    """
+    Обновляет выбор механизма для пары устройств после успешного копирования.
+    Механизм запоминается, только если каждый более предпочтительный механизм,
+    пропущенный этим файлом, не сработал BACKEND_DOWNGRADE_AFTER раз подряд.
+
+    :param key: Пара устройств (st_dev источника, st_dev цели)
+    :param backend: Механизм, которым скопирован файл
+    :param cached: Механизм, выбранный для пары до копирования (None - пара ещё не проверена)
+    """
+    start = cached or BACKENDS[0]
+    skipped = [
+        candidate for candidate in BACKENDS[BACKENDS.index(start):BACKENDS.index(backend)]
+        if _backend_available(candidate)
+    ]
+    with _backend_lock:
+        _backend_failures.pop((key, backend), None)
+        if any(_backend_failures[(key, candidate)] < BACKEND_DOWNGRADE_AFTER for candidate in skipped):
+            # Отказ мог быть вызван самим файлом: выбор для пары пока не меняется
+            return
+        if _backend_cache.get(key) != cached or cached == backend:
+            return
+        for candidate in skipped:
+            _backend_failures.pop((key, candidate), None)
+        _backend_cache[key] = backend
+        if skipped:
+            logger.info(
+                f"Механизм {', '.join(skipped)} не сработал {BACKEND_DOWNGRADE_AFTER} раз(а) подряд, "
+                f"для пары устройств {key} выбран механизм копирования: {backend}"
+            )
+        else:
+            logger.info(f"Для пары устройств {key} выбран механизм копирования: {backend}")
+
+
+def kernel_copy(source_file, target_file, preferred=None, readahead=None):
+    """
+    Копирует содержимое файла средствами ядра. Механизмы пробуются по порядку
+    (copy_file_range -> sendfile -> userspace), начиная с выбранного для пары
+    устройств. Если механизм не сработал на первых байтах файла, файл копируется
+    следующим механизмом, а механизм исключается для пары только после
+    BACKEND_DOWNGRADE_AFTER таких отказов подряд. Принудительный механизм
+    (preferred) выбор для пары не читает и не изменяет.
+
+    :param source_file: Исходный файл
+    :param target_file: Целевой файл
+    :param preferred: Принудительный механизм ('copy_file_range', 'sendfile', 'userspace')
+                      или None/'auto' для автоматического выбора
+    :param readahead: Объём начала источника для WILLNEED вместе с SEQUENTIAL (None - без подсказок)
+    :return: (имя механизма, количество скопированных байт)
+    :raises OSError: Ошибки чтения источника или записи в целевой файл
+    """
+    with open(source_file, 'rb', buffering=0) as src, open(target_file, 'wb', buffering=0) as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        if readahead is not None:
+            advise_source(src_fd, readahead)
+        src_stat = os.fstat(src_fd)
+        key = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+
+        cached = None
+        forced = bool(preferred) and preferred != "auto"
+        if forced:
+            candidates = BACKENDS[BACKENDS.index(preferred):]
+        else:
+            with _backend_lock:
+                cached = _backend_cache.get(key)
+            candidates = BACKENDS[BACKENDS.index(cached):] if cached else BACKENDS
+
+        for backend in candidates:
+            if not _backend_available(backend):
+                continue
+            try:
+                copied = _BACKEND_FUNCS[backend](src_fd, dst_fd, src_stat.st_size)
+            except _BackendUnsupported as e:
+                logger.debug(f"Механизм {backend} не поддерживается для устройств {key}: {e}")
+                if not forced:
+                    with _backend_lock:
+                        _backend_failures[(key, backend)] += 1
+                # Ничего не записано: позиции файлов в начале, пробуем следующий механизм
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                continue
+
+            if not forced:
+                _remember_backend(key, backend, cached)
+            return backend, copied
+
+    # Недостижимо: userspace поддерживается всегда
+    raise OSError(f"Не удалось скопировать {source_file}: нет доступного механизма копирования")
+
+
+def copy2_kernel(src, dst, *, follow_symlinks=True, preferred=None, readahead=None):
+    """
+    Аналог shutil.copy2 на основе kernel_copy. Подходит как copy_function
+    для shutil.move и shutil.copytree.
+
+    :param src: Исходный файл
+    :param dst: Целевой файл или директория
+    :param follow_symlinks: Как в shutil.copy2
+    :param preferred: Принудительный механизм копирования (см. kernel_copy)
+    :param readahead: Подсказки ядру для источника (см. kernel_copy)
+    :return: Путь к целевому файлу
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if not follow_symlinks and os.path.islink(src):
+        return shutil.copy2(src, dst, follow_symlinks=False)
+    kernel_copy(src, dst, preferred=preferred, readahead=readahead)
+    shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+    return dst
+
+
+class ParallelCopyBudget:
+    """Общий для всех одновременных parallel_copy лимит потоков чтения и памяти блоков"""
+
+    def __init__(self, max_bytes=0, max_streams=0):
+        """
+        :param max_bytes: Суммарный объём блоков в памяти в байтах (0 - без ограничения)
+        :param max_streams: Суммарное количество потоков чтения (0 - без ограничения)
+        """
+        self.max_bytes = max(0, int(max_bytes or 0))
+        self.max_streams = max(0, int(max_streams or 0))
+        self.bytes_in_use = 0
+        self.streams_in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire_streams(self, count):
+        """
+        Выделяет потоки чтения; ждёт, пока освободится хотя бы один.
+
+        :param count: Требуемое количество потоков
+        :return: Выделенное количество потоков (от 1 до count)
+        """
+        with self._cond:
+            if self.max_streams:
+                while self.streams_in_use >= self.max_streams:
+                    self._cond.wait()
+                count = min(count, self.max_streams - self.streams_in_use)
+            self.streams_in_use += count
+            return count
+
+    def release_streams(self, count):
+        """
+        :param count: Количество освобождаемых потоков чтения
+        """
+        with self._cond:
+            self.streams_in_use -= count
+            self._cond.notify_all()
+
+    def chunk_cost(self, chunk_size):
+        """
+        :param chunk_size: Размер блока в байтах
+        :return: Объём, резервируемый под один блок (не больше всего бюджета)
+        """
+        return min(chunk_size, self.max_bytes) if self.max_bytes else chunk_size
+
+    def acquire_bytes(self, size, stop):
+        """
+        Резервирует память под блок.
+
+        :param size: Объём в байтах (не больше chunk_cost)
+        :param stop: threading.Event, при установке которого ожидание прекращается
+        :return: True, если память выделена; False, если ожидание прервано
+        """
+        with self._cond:
+            while self.max_bytes and self.bytes_in_use + size > self.max_bytes:
+                if stop.is_set():
+                    return False
+                self._cond.wait(timeout=0.5)
+            if stop.is_set():
+                return False
+            self.bytes_in_use += size
+            return True
+
+    def release_bytes(self, size):
+        """
+        :param size: Объём освобождаемой памяти в байтах
+        """
+        with self._cond:
+            self.bytes_in_use -= size
+            self._cond.notify_all()
+
+
+def _preallocate(fd, size):
+    """Резервирует место под целевой файл (или хотя бы задаёт его размер)."""
+    if size <= 0:
+        return
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+    os.ftruncate(fd, size)
+
+
+def parallel_copy(source_file, target_file, algorithm=None, streams=4, chunk_size=8 * 1024 * 1024,
+                  window=None, start_offset=0, hash_func=None, on_checkpoint=None,
+                  checkpoint_interval=256 * 1024 * 1024, readahead=None, budget=None):
+    """
+    Копирует крупный файл несколькими параллельными потоками чтения.
+
+    Файл делится на блоки chunk_size; потоки забирают блоки по порядку, читают их
+    через os.pread и записывают через os.pwrite в заранее выделенный целевой файл.
+    Если задан algorithm, блоки передаются в хеш-функцию строго в порядке смещений
+    (с окном ожидания не более window блоков), поэтому результат совпадает с хешем,
+    вычисленным при последовательном чтении, и сравним с хешами из базы данных.
+    Общий budget ограничивает потоки и память блоков всех одновременных копирований:
+    память под блок резервируется до выбора его номера, поэтому очередной блок для
+    хеширования всегда уже прочитан или читается, и копирования не блокируют друг друга.
+
+    :param source_file: Исходный файл
+    :param target_file: Целевой файл
+    :param algorithm: Алгоритм хеширования или None, если хеш не нужен
+    :param streams: Количество потоков чтения
+    :param chunk_size: Размер блока в байтах
+    :param window: Максимальное количество прочитанных, но ещё не хешированных блоков
+                   (по умолчанию streams * 2)
+    :param start_offset: Смещение, с которого продолжается прерванное копирование
+                         (кратно chunk_size; данные до него уже есть в целевом файле)
+    :param hash_func: Объект хеш-функции, уже содержащий хеш данных до start_offset
+                      (используется вместо algorithm)
+    :param on_checkpoint: Функция (offset, hash_copy), вызываемая каждые checkpoint_interval
+                          байт непрерывно записанного и хешированного начала файла
+                          (после fdatasync целевого файла)
+    :param checkpoint_interval: Интервал контрольных точек в байтах
+    :param readahead: Объём источника от start_offset для WILLNEED вместе с SEQUENTIAL (None - без подсказок)
+    :param budget: ParallelCopyBudget, общий для одновременных копирований (None - без общего лимита)
+    :return: (hexdigest или None, количество скопированных байт без учёта start_offset)
+    :raises OSError: Ошибки чтения источника или записи в целевой файл
+    """
+    streams = max(1, int(streams))
+    chunk_size = max(1, int(chunk_size))
+    if start_offset % chunk_size:
+        raise ValueError(f"Смещение {start_offset} не кратно размеру блока {chunk_size}")
+    if hash_func is None and algorithm:
+        hash_func = hashlib.new(algorithm)
+    slots = threading.BoundedSemaphore(max(streams, int(window or streams * 2)))
+
+    src_fd = os.open(source_file, os.O_RDONLY)
+    try:
+        if readahead is not None:
+            # Потоки читают блоки почти по порядку: упреждающее чтение ядра по-прежнему полезно
+            advise_source(src_fd, readahead, offset=start_offset)
+        # При продолжении копирования уже записанное начало файла не обрезаем
+        flags = os.O_WRONLY | os.O_CREAT | (0 if start_offset else os.O_TRUNC)
+        dst_fd = os.open(target_file, flags, 0o644)
+        try:
+            size = os.fstat(src_fd).st_size
+            _preallocate(dst_fd, size)
+            chunks = (size + chunk_size - 1) // chunk_size
+            first_chunk = start_offset // chunk_size
+
+            state_lock = threading.Lock()
+            hash_cond = threading.Condition(state_lock)
+            state = {
+                "next_chunk": first_chunk, "next_hash": first_chunk, "copied": 0, "error": None,
+                "checkpoint": start_offset
+            }
+            pending = {}
+            stop = threading.Event()
+            cost = budget.chunk_cost(chunk_size) if budget is not None else 0
+            # Блоки, память под которые взята из общего бюджета: при ошибке возвращаются после остановки потоков
+            held = {"chunks": 0}
+            held_lock = threading.Lock()
+
+            def take_slot():
+                # Ожидание с таймаутом: при ошибке в другом потоке окно может не освободиться
+                while not stop.is_set():
+                    if slots.acquire(timeout=0.5):
+                        if budget is None:
+                            return True
+                        if budget.acquire_bytes(cost, stop):
+                            with held_lock:
+                                held["chunks"] += 1
+                            return True
+                        slots.release()
+                        return False
+                return False
+
+            def release_slot():
+                slots.release()
+                if budget is not None:
+                    with held_lock:
+                        held["chunks"] -= 1
+                    budget.release_bytes(cost)
+
+            def copy_chunks():
+                try:
+                    while take_slot():
+                        with state_lock:
+                            index = state["next_chunk"]
+                            state["next_chunk"] += 1
+                        if index >= chunks:
+                            release_slot()
+                            return
+
+                        offset = index * chunk_size
+                        length = min(chunk_size, size - offset)
+                        parts = []
+                        read = 0
+                        while read < length:
+                            data = os.pread(src_fd, length - read, offset + read)
+                            if not data:
+                                raise OSError(errno.EIO, f"Файл изменился во время копирования: {source_file}")
+                            parts.append(data)
+                            read += len(data)
+                        data = parts[0] if len(parts) == 1 else b"".join(parts)
+
+                        view = memoryview(data)
+                        written = 0
+                        while written < length:
+                            written += os.pwrite(dst_fd, view[written:], offset + written)
+
+                        with state_lock:
+                            state["copied"] += length
+                        if hash_func is None:
+                            release_slot()
+                            continue
+
+                        # Хешируем все блоки, для которых подошла очередь
+                        checkpoint = None
+                        with hash_cond:
+                            pending[index] = data
+                            while state["next_hash"] in pending:
+                                hash_func.update(pending.pop(state["next_hash"]))
+                                state["next_hash"] += 1
+                                release_slot()
+                            hashed = min(state["next_hash"] * chunk_size, size)
+                            if on_checkpoint is not None and hashed < size and \
+                                    hashed - state["checkpoint"] >= checkpoint_interval:
+                                state["checkpoint"] = hashed
+                                checkpoint = (hashed, hash_func.copy())
+
+                        if checkpoint is not None:
+                            # Контрольная точка фиксируется только после сброса данных на диск
+                            os.fdatasync(dst_fd)
+                            on_checkpoint(*checkpoint)
+                except Exception as e:
+                    with state_lock:
+                        if state["error"] is None:
+                            state["error"] = e
+                    stop.set()
+
+            streams = min(streams, max(1, chunks - first_chunk))
+            if budget is not None:
+                streams = budget.acquire_streams(streams)
+            try:
+                threads = [
+                    threading.Thread(target=copy_chunks, name=f"range-copy-{i}", daemon=True)
+                    for i in range(streams)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                if budget is not None:
+                    budget.release_bytes(held["chunks"] * cost)
+                    budget.release_streams(streams)
+
+            if state["error"] is not None:
+                raise state["error"]
+            copied = state["copied"]
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    shutil.copystat(source_file, target_file)
+    return (hash_func.hexdigest() if hash_func is not None else None), copied
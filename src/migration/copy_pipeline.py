@@ -0,0 +1,154 @@
+"""
+Модуль потокового конвейера «сканирование -> копирование».
+
+Сканер обходит исходное дерево в отдельном потоке и складывает найденные файлы
+в ограниченную очередь, рабочие потоки начинают копирование сразу после
+обнаружения первого файла. В каждый момент времени в памяти находится не более
+queue_size заданий, поэтому расход памяти не зависит от размера дерева.
+
+Классы:
+    - CopyPipeline: Конвейер «сканер -> ограниченная очередь -> рабочие потоки».
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Маркер завершения очереди для рабочих потоков
+_STOP = object()
+
+
+class CopyPipeline:
+    """Конвейер со сканером-производителем и пулом рабочих потоков"""
+
+    def __init__(self, producer, worker, max_workers=2, queue_size=1000, name="copy",
+                 controller=None, size_of=None):
+        """
+        :param producer: Функция без аргументов, возвращающая итератор заданий
+        :param worker: Функция обработки одного задания, возвращает True при успехе
+        :param max_workers: Количество рабочих потоков
+        :param queue_size: Максимальное количество заданий в очереди
+        :param name: Имя конвейера (для логов и имён потоков)
+        :param controller: ConcurrencyController, ограничивающий число одновременно
+                           выполняемых заданий (None - без ограничения)
+        :param size_of: Функция, возвращающая размер задания в байтах (для контроллера)
+        """
+        self.producer = producer
+        self.worker = worker
+        self.controller = controller
+        self.size_of = size_of
+        self.max_workers = max(1, int(max_workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.name = name
+
+        self.stop_event = threading.Event()
+        self.producer_error = None
+        self.produced = 0
+        self.processed = 0
+        self.failed = 0
+        self._counters_lock = threading.Lock()
+
+    def cancel(self):
+        """Останавливает сканер и отбрасывает задания, оставшиеся в очереди."""
+        self.stop_event.set()
+
+    @property
+    def cancelled(self):
+        return self.stop_event.is_set()
+
+    def _put(self, item):
+        """Кладёт элемент в очередь, периодически проверяя флаг отмены."""
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for item in self.producer():
+                if not self._put(item):
+                    break
+                with self._counters_lock:
+                    self.produced += 1
+        except Exception as e:
+            # Ошибку сканера пробрасываем в вызывающий поток после остановки рабочих
+            self.producer_error = e
+            logger.error(f"Ошибка сканера конвейера {self.name}: {e}")
+        finally:
+            # Сигнал завершения для каждого рабочего потока. Кладём без учёта
+            # отмены: рабочие потоки продолжают разбирать очередь до маркера.
+            for _ in range(self.max_workers):
+                self.queue.put(_STOP)
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            if self.stop_event.is_set():
+                # Конвейер отменён: задания из очереди не выполняем
+                continue
+            self._process(item, self.controller)
+
+    def _process(self, item, controller=None):
+        """Выполняет одно задание (в пределах слота контроллера) и обновляет счётчики."""
+        if controller is not None:
+            controller.acquire()
+        ok = False
+        try:
+            ok = self.worker(item)
+        except Exception as e:
+            logger.error(f"Необработанная ошибка в рабочем потоке конвейера {self.name}: {e}")
+            ok = False
+        finally:
+            if controller is not None:
+                nbytes = self.size_of(item) if self.size_of is not None else 0
+                controller.release(nbytes if ok else 0)
+
+        with self._counters_lock:
+            self.processed += 1
+            if not ok:
+                self.failed += 1
+
+    def _create_workers(self):
+        """Создаёт (не запуская) рабочие потоки конвейера."""
+        return [
+            threading.Thread(target=self._consume, name=f"{self.name}-worker-{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+
+    def run(self):
+        """
+        Запускает конвейер и ожидает его завершения.
+
+        :return: True, если все задания обработаны успешно, иначе False
+        :raises: Исключение сканера, если обход дерева завершился ошибкой
+        """
+        producer_thread = threading.Thread(
+            target=self._produce, name=f"{self.name}-scanner", daemon=True
+        )
+        workers = self._create_workers()
+
+        producer_thread.start()
+        for thread in workers:
+            thread.start()
+
+        producer_thread.join()
+        for thread in workers:
+            thread.join()
+
+        logger.info(
+            f"Конвейер {self.name} завершён: найдено {self.produced}, "
+            f"обработано {self.processed}, ошибок {self.failed}"
+            + (" (отменён)" if self.cancelled else "")
+        )
+
+        if self.producer_error is not None:
+            raise self.producer_error
+
+        return self.failed == 0 and not self.cancelled
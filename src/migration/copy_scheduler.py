@@ -0,0 +1,184 @@
+"""
+Модуль планировщика копирования с раздельными очередями для крупных и мелких файлов.
+
+Крупные файлы (не меньше порога) попадают в отдельную полосу со своим пулом
+потоков и выдаются в порядке убывания размера: самый длинный файл начинает
+копироваться первым, и в конце миграции не остаётся одинокого потока,
+докачивающего большой PST после того, как все остальные освободились.
+
+Мелкие файлы группируются в пакеты по количеству и объёму и передаются
+рабочим потокам целиком, поэтому накладные расходы на одно задание очереди
+делятся на весь пакет.
+
+Если задана функция prefetch, она вызывается для следующего файла полосы
+(следующий файл пакета или вершина кучи крупных файлов) перед обработкой
+текущего, чтобы чтение следующего файла началось заранее.
+
+Классы:
+    - DualLaneScheduler: Конвейер «сканер -> полосы крупных/мелких файлов -> рабочие потоки».
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+
+from src.migration.copy_pipeline import CopyPipeline, _STOP
+
+logger = logging.getLogger(__name__)
+
+# Порог крупного файла по умолчанию (64 МБ)
+DEFAULT_LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+
+class DualLaneScheduler(CopyPipeline):
+    """Конвейер с полосой крупных файлов (по убыванию размера) и пакетной полосой мелких"""
+
+    def __init__(self, producer, worker, size_of, large_threshold=DEFAULT_LARGE_FILE_THRESHOLD,
+                 large_workers=2, small_workers=2, batch_size=64, batch_bytes=8 * 1024 * 1024,
+                 queue_size=1000, name="copy", controller=None, large_controller=None, prefetch=None):
+        """
+        :param producer: Функция без аргументов, возвращающая итератор заданий
+        :param worker: Функция обработки одного задания, возвращает True при успехе
+        :param size_of: Функция, возвращающая размер задания в байтах
+        :param large_threshold: Размер, начиная с которого файл считается крупным
+        :param large_workers: Количество потоков полосы крупных файлов
+        :param small_workers: Количество потоков полосы мелких файлов
+        :param batch_size: Максимальное количество файлов в пакете мелких файлов
+        :param batch_bytes: Максимальный объём пакета мелких файлов в байтах
+        :param queue_size: Максимальное количество заданий, ожидающих в каждой полосе
+        :param name: Имя конвейера (для логов и имён потоков)
+        :param controller: ConcurrencyController полосы мелких файлов
+        :param large_controller: ConcurrencyController полосы крупных файлов
+        :param prefetch: Функция, вызываемая для следующего задания полосы перед обработкой
+                         текущего (None - без упреждающего чтения)
+        """
+        self.batch_size = max(1, int(batch_size))
+        self.batch_bytes = max(1, int(batch_bytes))
+        # Очередь базового конвейера хранит пакеты, а не отдельные файлы
+        super().__init__(
+            producer, worker,
+            max_workers=small_workers,
+            queue_size=max(1, int(queue_size) // self.batch_size),
+            name=name,
+            controller=controller,
+            size_of=size_of
+        )
+        self.large_controller = large_controller
+        self.prefetch = prefetch
+        self.large_threshold = int(large_threshold)
+        self.large_workers = max(1, int(large_workers))
+        self.large_capacity = max(1, int(queue_size))
+
+        # Куча (-размер, порядковый номер, задание): сверху самый крупный файл
+        self._large_heap = []
+        self._large_cond = threading.Condition()
+        self._large_done = False
+        self._seq = itertools.count()
+
+        self.large_files = 0
+        self.small_files = 0
+        self.small_batches = 0
+
+    def cancel(self):
+        """Останавливает сканер и отбрасывает задания, оставшиеся в обеих полосах."""
+        super().cancel()
+        with self._large_cond:
+            self._large_cond.notify_all()
+
+    def _put_large(self, item, size):
+        """Кладёт крупный файл в кучу, ожидая свободного места."""
+        with self._large_cond:
+            while len(self._large_heap) >= self.large_capacity and not self.stop_event.is_set():
+                self._large_cond.wait(timeout=0.5)
+            if self.stop_event.is_set():
+                return False
+            heapq.heappush(self._large_heap, (-size, next(self._seq), item))
+            self._large_cond.notify_all()
+        return True
+
+    def _produce(self):
+        batch = []
+        batch_bytes = 0
+        try:
+            for item in self.producer():
+                size = self.size_of(item)
+                if size >= self.large_threshold:
+                    if not self._put_large(item, size):
+                        break
+                    self.large_files += 1
+                else:
+                    batch.append(item)
+                    batch_bytes += size
+                    self.small_files += 1
+                    if len(batch) >= self.batch_size or batch_bytes >= self.batch_bytes:
+                        if not self._put(batch):
+                            break
+                        self.small_batches += 1
+                        batch, batch_bytes = [], 0
+
+                with self._counters_lock:
+                    self.produced += 1
+
+            # Неполный последний пакет
+            if batch and not self.stop_event.is_set() and self._put(batch):
+                self.small_batches += 1
+        except Exception as e:
+            # Ошибку сканера пробрасываем в вызывающий поток после остановки рабочих
+            self.producer_error = e
+            logger.error(f"Ошибка сканера конвейера {self.name}: {e}")
+        finally:
+            with self._large_cond:
+                self._large_done = True
+                self._large_cond.notify_all()
+            for _ in range(self.max_workers):
+                self.queue.put(_STOP)
+            logger.info(
+                f"Сканер конвейера {self.name}: крупных файлов {self.large_files}, "
+                f"мелких {self.small_files} в {self.small_batches} пакетах"
+            )
+
+    def _consume(self):
+        while True:
+            batch = self.queue.get()
+            if batch is _STOP:
+                break
+            for index, item in enumerate(batch):
+                if self.stop_event.is_set():
+                    # Конвейер отменён: оставшиеся файлы пакета не копируем
+                    break
+                if self.prefetch is not None and index + 1 < len(batch):
+                    self._prefetch(batch[index + 1])
+                self._process(item, self.controller)
+
+    def _consume_large(self):
+        while True:
+            with self._large_cond:
+                while not self._large_heap and not self._large_done:
+                    self._large_cond.wait()
+                if not self._large_heap:
+                    return
+                _, _, item = heapq.heappop(self._large_heap)
+                next_item = self._large_heap[0][2] if self._large_heap and self.prefetch is not None else None
+                self._large_cond.notify_all()
+
+            if self.stop_event.is_set():
+                continue
+            if next_item is not None:
+                self._prefetch(next_item)
+            self._process(item, self.large_controller)
+
+    def _prefetch(self, item):
+        try:
+            self.prefetch(item)
+        except Exception as e:
+            # Упреждающее чтение - только оптимизация, на копирование не влияет
+            logger.debug(f"Ошибка упреждающего чтения в конвейере {self.name}: {e}")
+
+    def _create_workers(self):
+        workers = super()._create_workers()
+        workers.extend(
+            threading.Thread(target=self._consume_large, name=f"{self.name}-large-{i}", daemon=True)
+            for i in range(self.large_workers)
+        )
+        return workers
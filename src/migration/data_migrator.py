@@ -24,6 +24,7 @@ from src.shortcuts_printers.shortcut_creator import create_shortcuts
 from src.shortcuts_printers.printer_connector import connect_printers
 from src.config.config_loader import load_config
 from src.notify.notify import send_status
+from src.migration.copy_engine import copy2_kernel
 
 setup_logger()
 logger = logging.getLogger(__name__)
@@ -210,7 +211,8 @@ def move_user_data(temp_user_dir, final_target_dir):
             for item in items:
                 s = os.path.join(temp_user_dir, item)
                 d = os.path.join(final_target_dir, item)
-                shutil.move(s, d)
+                # При перемещении между файловыми системами данные копирует ядро
+                shutil.move(s, d, copy_function=copy2_kernel)
             logger.info(f'Данные из {temp_user_dir} перемещены в {final_target_dir}.')
             # Удаляем пустую временную директорию
             os.rmdir(temp_user_dir)
@@ -0,0 +1,98 @@
+"""
+Модуль компактного хранения ожидаемых хешей файлов.
+
+Хеши хранятся не строками в словаре, а двоичными дайджестами в одном
+непрерывном буфере. Путь файла заменяется 64-битным ключом (blake2b от
+канонического ключа пути), ключи лежат в отсортированном массиве, поиск -
+двоичный по массиву. На одну запись приходится 8 байт ключа и размер
+дайджеста (32 байта для sha256) вместо сотен байт на строки и элемент
+словаря.
+
+Совпадение 64-битных ключей разных путей маловероятно (порядка 1e-6 для
+десятков миллионов записей) и проявляется как несовпадение хеша при
+проверке, а не как пропуск ошибки.
+
+Классы:
+    - DigestStore: Отсортированный массив 64-битных ключей путей с буфером дайджестов.
+"""
+
+import hashlib
+from array import array
+from bisect import bisect_left
+
+
+def path_key64(key):
+    """
+    :param key: Канонический ключ пути
+    :return: Знаковое 64-битное целое (совместимо с INTEGER SQLite)
+    """
+    digest = hashlib.blake2b(key.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+class DigestStore:
+    """Ожидаемые хеши: отсортированные 64-битные ключи путей и непрерывный буфер дайджестов"""
+
+    def __init__(self):
+        self._keys = array('q')
+        self._digests = bytearray()
+        self.digest_size = None
+        # Значения, которые не являются hex-дайджестом общей длины (хранятся строками)
+        self._other = {}
+
+    @classmethod
+    def from_sorted(cls, rows):
+        """
+        :param rows: Итератор (path_key64, hex-дайджест), отсортированный по ключу;
+                     при повторе ключа остаётся последнее значение
+        :return: DigestStore
+        """
+        store = cls()
+        for key, hex_digest in rows:
+            store.append(key, hex_digest)
+        return store
+
+    def append(self, key, hex_digest):
+        """
+        Добавляет запись в конец хранилища. Ключи должны поступать по возрастанию.
+
+        :param key: path_key64 пути
+        :param hex_digest: Хеш в шестнадцатеричном виде
+        """
+        try:
+            digest = bytes.fromhex(hex_digest)
+        except (TypeError, ValueError):
+            digest = None
+        if digest is not None and self.digest_size is None:
+            self.digest_size = len(digest)
+        if digest is None or len(digest) != self.digest_size:
+            self._other[key] = hex_digest
+            return
+
+        if self._keys and self._keys[-1] == key:
+            self._digests[-self.digest_size:] = digest
+            return
+        if self._keys and self._keys[-1] > key:
+            raise ValueError("Ключи DigestStore должны добавляться по возрастанию")
+        self._keys.append(key)
+        self._digests += digest
+
+    def get(self, key, default=None):
+        """
+        :param key: Канонический ключ пути
+        :return: Хеш в шестнадцатеричном виде или default
+        """
+        key = path_key64(key)
+        index = bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            start = index * self.digest_size
+            return self._digests[start:start + self.digest_size].hex()
+        return self._other.get(key, default)
+
+    @property
+    def nbytes(self):
+        """Объём памяти массивов ключей и дайджестов в байтах."""
+        return self._keys.itemsize * len(self._keys) + len(self._digests)
+
+    def __len__(self):
+        return len(self._keys) + len(self._other)
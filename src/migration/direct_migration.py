@@ -1,33 +1,47 @@
 """
 Модуль для прямой миграции данных из исходной директории в целевую
 с параллельным копированием файлов и проверкой целостности.
+Сканирование и копирование выполняются потоково: рабочие потоки начинают копирование
+сразу после обнаружения первого файла, очередь между ними ограничена.
 Реализует раздельный подход: сначала копирование, затем проверка целостности, 
 и только после этого переименование директорий.
 """
 
 import os
 import shutil
-import concurrent.futures
 import logging
 import threading
 import sys
 import fnmatch
+import json
+import sqlite3
 import time
-from collections import defaultdict
 
 from src.config.config_loader import load_config
 from src.migration.data_migrator import shorten_filename
 from src.migration.integrity_checker import (
     calculate_file_hash, 
+    calculate_target_hash,
     compare_file_sizes, 
     compare_file_metadata,
     convert_win_path_to_linux,
-    load_hashes_from_db,
+    tiered_check,
     verify_hash_with_retry
 )
 from src.notify.notify import send_status
 from src.errors.error_codes import MigrationErrorCodes
-from src.migration.state_tracker import handle_migration_error
+from src.migration.state_tracker import handle_migration_error, update_user_progress, get_error_aggregator
+from src.migration.copy_scheduler import DEFAULT_LARGE_FILE_THRESHOLD, DualLaneScheduler
+from src.migration.concurrency_controller import ConcurrencyController
+from src.metrics_monitoring.metrics import track_concurrency
+from src.migration.tree_walker import stat_record, walk_tree
+from src.migration.copy_engine import DEFAULT_BUFFER_SIZE, ParallelCopyBudget, copy2_kernel, copy_with_hash
+from src.migration.partial_copy import PartialCopyJournal, resumable_copy
+from src.migration.migration_journal import MigrationJournal
+from src.migration.scan_manifest import ScanManifest
+from src.migration.hash_index import HashIndex
+from src.migration.page_cache import drop_file_cache, prefetch_file
+from src.migration.error_budget import DEFAULT_CATEGORIES, ErrorBudget, ErrorBudgetExceeded
 
 logger = logging.getLogger(__name__)
 config = load_config()
@@ -36,14 +50,25 @@ config = load_config()
 dest_filenames = {}
 dest_filenames_lock = threading.Lock()
 
-# Словарь для отслеживания состояния миграции каждого пользователя
-migration_state = defaultdict(dict)
-migration_state_lock = threading.Lock()
+# Журналы миграции пользователей (скопированные и проверенные файлы)
+migration_journals = {}
+migration_journals_lock = threading.Lock()
 
-# Предварительно загруженные хеши из базы данных
-preloaded_hashes = {}
+# Журнал незавершённых копирований крупных файлов (для продолжения с места остановки)
+partial_copy_journal = PartialCopyJournal(
+    config.get("PARTIAL_COPY_JOURNAL_DIR", "/var/lib/migration-service/partial")
+)
+
+# Общий лимит потоков и памяти параллельного копирования крупных файлов во всех рабочих потоках
+parallel_copy_budget = ParallelCopyBudget(
+    max_bytes=config.get("PARALLEL_COPY_MEMORY_BUDGET", 256 * 1024 * 1024),
+    max_streams=config.get("PARALLEL_COPY_MAX_STREAMS", 16)
+)
+
+# Предварительно загруженные хеши текущего пользователя из базы данных (UserHashes)
+preloaded_hashes = None
 
-def direct_copy_file(source_file, target_file, source_dir, target_dir, username=None, report_data=None, lock=None, no_mapping=True):
+def direct_copy_file(source_file, target_file, source_dir, target_dir, username=None, report_data=None, lock=None, no_mapping=True, source_record=None):
     """
     Копирует файл напрямую в целевую директорию и выполняет проверку целостности.
     
@@ -55,12 +80,18 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
     :param report_data: Словарь отчета
     :param lock: Блокировка для многопоточного доступа к отчету
     :param no_mapping: Флаг указывающий, что копирование идет без преобразования имен (исходная структура)
+    :param source_record: FileRecord исходного файла, полученный при сканировании (исключает повторный stat)
     :return: (bool, str) - (успех копирования, сообщение об ошибке)
     """
     copied_size = 0
     error_message = None
     
     try:
+        if source_record is None:
+            source_record = stat_record(source_file, os.path.relpath(source_file, source_dir))
+            if source_record is None:
+                raise FileNotFoundError(f"Исходный файл не найден: {source_file}")
+
         target_dir_path = os.path.dirname(target_file)
         target_basename = os.path.basename(target_file)
         
@@ -90,13 +121,59 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
                 return False, f"Ошибка создания директории: {e}"
             
         
-        # Проверяем, нужно ли копировать файл
-        if not os.path.exists(target_file_short) or os.path.getmtime(source_file) > os.path.getmtime(target_file_short):
+        # Проверяем, нужно ли копировать файл (один stat целевого файла вместо exists + getmtime)
+        # Незавершённое копирование крупного файла оставляет целевой файл с новым mtime,
+        # поэтому такой файл определяется по журналу, а не по времени модификации
+        existing_record = stat_record(target_file_short)
+        if existing_record is None or source_record.mtime_ns > existing_record.mtime_ns \
+                or partial_copy_journal.exists(target_file_short):
             # Засекаем время копирования
             start_copy_time = time.time()
+            stream_hash = None
+            
+            check_method = config.get("INTEGRITY_CHECK_METHOD", "size")
+            # В режиме tiered файлы, хешируемые при проверке целиком, тоже копируются с хешированием потока
+            hash_mode = check_method == 'hash' or (
+                check_method == 'tiered'
+                and source_record.size < config.get("TIERED_FULL_HASH_THRESHOLD", 64 * 1024 * 1024)
+            )
+            # Подсказки ядру: источник читается последовательно, начало - заранее
+            readahead = config.get("PAGE_CACHE_READAHEAD", 32 * 1024 * 1024) \
+                if config.get("PAGE_CACHE_HINTS", True) else None
             
             try:
-                shutil.copy2(source_file, target_file_short)
+                if source_record.size >= config.get("PARALLEL_COPY_THRESHOLD", 1024 * 1024 * 1024):
+                    # Очень крупный файл: несколько параллельных потоков чтения по диапазонам,
+                    # с контрольными точками для продолжения после перезапуска
+                    range_hash, _, _ = resumable_copy(
+                        source_file,
+                        target_file_short,
+                        source_record,
+                        partial_copy_journal,
+                        algorithm=config.get("HASH_ALGORITHM", "sha256"),
+                        streams=config.get("PARALLEL_COPY_STREAMS", 4),
+                        chunk_size=config.get("PARALLEL_COPY_CHUNK_SIZE", 8 * 1024 * 1024),
+                        checkpoint_interval=config.get("PARTIAL_COPY_CHECKPOINT_INTERVAL", 256 * 1024 * 1024),
+                        readahead=readahead,
+                        budget=parallel_copy_budget
+                    )
+                    if check_method in ('hash', 'tiered'):
+                        stream_hash = range_hash
+                elif hash_mode:
+                    # Хеш вычисляется по потоку копирования: источник читается по сети один раз
+                    stream_hash, _ = copy_with_hash(
+                        source_file,
+                        target_file_short,
+                        algorithm=config.get("HASH_ALGORITHM", "sha256"),
+                        buffer_size=config.get("COPY_BUFFER_SIZE", DEFAULT_BUFFER_SIZE),
+                        readahead=readahead
+                    )
+                else:
+                    # Хеш по потоку не нужен: копирует ядро (copy_file_range/sendfile)
+                    copy2_kernel(
+                        source_file, target_file_short,
+                        preferred=config.get("COPY_BACKEND", "auto"), readahead=readahead
+                    )
             except PermissionError as e:
                 handle_migration_error(
                     MigrationErrorCodes.TARGET_003,
@@ -111,7 +188,7 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
                         MigrationErrorCodes.TARGET_002,
                         details=f"Недостаточно места для копирования файла: {os.path.basename(source_file)}",
                         exception=e,
-                        context={"user": username, "source_file": source_file, "file_size": os.path.getsize(source_file)}
+                        context={"user": username, "source_file": source_file, "file_size": source_record.size}
                     )
                 elif "File name too long" in str(e):
                     handle_migration_error(
@@ -140,11 +217,16 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
             end_copy_time = time.time()
             
             file_copy_time = end_copy_time - start_copy_time
-            file_size = os.path.getsize(target_file_short)
+            # Единственный stat локального целевого файла после копирования
+            target_record = stat_record(target_file_short)
+            file_size = target_record.size if target_record is not None else 0
             copied_size += file_size
             
             # Проверка целостности с использованием выбранного метода
-            integrity_ok = verify_file_integrity(source_file, target_file_short, source_dir, target_dir, username)
+            integrity_ok = verify_file_integrity(
+                source_file, target_file_short, source_dir, target_dir, username,
+                source_record=source_record, target_record=target_record, source_hash=stream_hash
+            )
             
             if not integrity_ok:
                 error_message = f"Ошибка целостности файла: {target_file_short}"
@@ -161,6 +243,15 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
                         report_data['discrepancies'].append(f"Несовпадение целостности: {target_file_short}")
                 return False, error_message
             
+            if readahead is not None:
+                # Проверенные данные больше не читаются: освобождаем кеш страниц для других процессов.
+                # Грязные страницы не вытесняются, поэтому крупные файлы сначала сбрасываются на диск;
+                # источник (лишнее открытие по сети) - только для крупных файлов
+                large_file = file_size >= config.get("LARGE_FILE_THRESHOLD", DEFAULT_LARGE_FILE_THRESHOLD)
+                drop_file_cache(target_file_short, sync=large_file)
+                if large_file:
+                    drop_file_cache(source_file)
+            
             # Обновляем данные отчета
             if report_data is not None and lock:
                 with lock:
@@ -200,21 +291,29 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
                             data_volume=f"{report_data['target_size'] / (1024 * 1024):.2f} MB / {report_data['total_size'] / (1024 * 1024):.2f} MB",
                             eta=eta
                         )
+                        update_user_progress(
+                            username,
+                            files_done=report_data['files_copied'],
+                            files_total=report_data['total_files'],
+                            bytes_done=report_data['target_size'],
+                            bytes_total=report_data['total_size'],
+                            eta=eta
+                        )
             
             # Сохраняем информацию о скопированном файле для возможности восстановления
-            with migration_state_lock:
-                migration_state[username][source_file] = {
-                    'target_file': target_file_short,
-                    'size': file_size,
-                    'timestamp': time.time(),
-                    'verified': True
-                }
+            get_migration_journal(username).record(
+                source_file, target_file_short, file_size, source_record.mtime_ns, verified=True
+            )
             
             logger.info(f'Файл успешно скопирован и проверен: {source_file} -> {target_file_short}')
             return True, None
             
         else:
             logger.info(f'Пропущен файл {source_file}, целевой файл наиболее актуален')
+            # Пропущенный файл тоже фиксируется в журнале: иначе при продолжении он снова считается ожидающим
+            get_migration_journal(username).record(
+                source_file, target_file_short, existing_record.size, source_record.mtime_ns, verified=True
+            )
             if report_data is not None and lock:
                 with lock:
                     report_data['skipped_files'].append(source_file)
@@ -247,7 +346,65 @@ def direct_copy_file(source_file, target_file, source_dir, target_dir, username=
         return False, error_message
 
 
-def verify_file_integrity(source_file, target_file, source_dir, target_dir, username=None):
+def verify_stream_hash(source_file, target_file, stream_hash, expected_hash, username=None, source_record=None, target_record=None):
+    """
+    Проверяет файл, скопированный с хешированием потока (copy_with_hash).
+    Исходный файл повторно не читается: хеш переданных данных сравнивается
+    с хешем из базы данных и с хешем, прочитанным с целевого диска. Если хеш
+    из базы совпал, целевой файл перечитывается только при VERIFY_TARGET_READBACK;
+    если хеша в базе нет, целевой файл перечитывается всегда.
+    
+    :param source_file: Исходный файл
+    :param target_file: Целевой файл
+    :param stream_hash: Хеш данных, вычисленный при копировании
+    :param expected_hash: Хеш из базы данных или None
+    :param username: Имя пользователя
+    :param source_record: FileRecord исходного файла (на момент сканирования)
+    :param target_record: FileRecord целевого файла после копирования
+    :return: True если целостность подтверждена, False в противном случае
+    """
+    algorithm = config.get("HASH_ALGORITHM", "sha256")
+
+    # Данные, прочитанные из источника, должны совпадать с эталоном из базы
+    if expected_hash and stream_hash.lower() != expected_hash.lower():
+        logger.error(f"Хеш скопированных данных не совпадает с базой для файла {source_file}: "
+                     f"ожидается {expected_hash}, получено {stream_hash}")
+        return False
+
+    # Файл мог измениться между сканированием и копированием
+    if source_record is not None and target_record is not None and source_record.size != target_record.size:
+        logger.error(f"Размер файла {target_file} ({target_record.size}) не совпадает "
+                     f"с размером источника при сканировании ({source_record.size})")
+        return False
+
+    # Без хеша из базы сравнение с целевым файлом - единственная проверка содержимого
+    if expected_hash and not config.get("VERIFY_TARGET_READBACK", False):
+        return True
+
+    # Независимое чтение целевого файла с диска (VERIFY_READBACK_MODE), а не из кеша страниц
+    try:
+        target_hash = calculate_target_hash(target_file, algorithm=algorithm)
+    except Exception as e:
+        handle_migration_error(
+            MigrationErrorCodes.VERIFY_002,
+            details=f"Ошибка при вычислении хеша файла: {os.path.basename(target_file)}",
+            exception=e,
+            context={"user": username, "target_file": target_file}
+        )
+        return False
+
+    if not target_hash:
+        handle_migration_error(
+            MigrationErrorCodes.VERIFY_002,
+            details=f"Не удалось вычислить хеш для файла: {os.path.basename(target_file)}",
+            context={"user": username, "target_file": target_file, "algorithm": algorithm}
+        )
+        return False
+
+    return target_hash.lower() == stream_hash.lower()
+
+
+def verify_file_integrity(source_file, target_file, source_dir, target_dir, username=None, source_record=None, target_record=None, source_hash=None):
     """
     Проверяет целостность скопированного файла в зависимости от метода проверки.
     
@@ -256,84 +413,62 @@ def verify_file_integrity(source_file, target_file, source_dir, target_dir, user
     :param source_dir: Корневая исходная директория
     :param target_dir: Корневая целевая директория
     :param username: Имя пользователя
+    :param source_record: FileRecord исходного файла (если уже известен)
+    :param target_record: FileRecord целевого файла (если уже известен)
+    :param source_hash: Хеш данных, вычисленный при копировании (исходный файл повторно не читается)
     :return: True если целостность подтверждена, False в противном случае
     """
     integrity_check_method = config.get("INTEGRITY_CHECK_METHOD", "size")
     
     try:
         if integrity_check_method == 'hash':
-            # Проверяем, есть ли предзагруженные хеши
+            expected_hash = None
+
+            # Проверяем, есть ли предзагруженные хеши пользователя
             if preloaded_hashes:
-                # Получаем относительный путь от исходной директории
-                rel_path = os.path.relpath(source_file, source_dir)
-                rel_path = rel_path.replace('\\', '/')
-                
-                # Получаем "чистое" имя пользователя без доменной части
-                clean_username = username.split('@')[0] if username and '@' in username else username
-                
-                # Пытаемся найти хеш в базе данных по разным вариантам пути
-                expected_hash = None
-                expected_hash_paths = [
-                    rel_path,
-                    f"{clean_username}/{rel_path}",
-                    #f"{clean_username}\\{rel_path.replace('/', '\\')}",
-                    clean_username + "\\" + rel_path.replace('/', '\\'),
-                    os.path.basename(rel_path)
-                ]
-                
-                # Если путь содержит Desktop, добавляем варианты с Desktop
-                if 'Desktop' in rel_path:
-                    # Извлекаем часть пути после Desktop
-                    if '/Desktop/' in rel_path:
-                        desktop_path = rel_path.split('/Desktop/', 1)[1]
-                        expected_hash_paths.extend([
-                            f"Desktop/{desktop_path}",
-                            f"{clean_username}/Desktop/{desktop_path}"
-                        ])
-                    elif '\\Desktop\\' in rel_path:
-                        desktop_path = rel_path.split('\\Desktop\\', 1)[1]
-                        expected_hash_paths.extend([
-                            f"Desktop\\{desktop_path}",
-                            f"{clean_username}\\Desktop\\{desktop_path}"
-                        ])
-                
-                # Ищем хеш во всех вариантах путей
-                for path in expected_hash_paths:
-                    if path in preloaded_hashes:
-                        expected_hash = preloaded_hashes[path]
-                        logger.debug(f"Найден хеш для пути: {path}")
-                        break
-                
+                # Один поиск по каноническому ключу пути относительно исходной директории
+                rel_path = source_record.rel_path if source_record is not None else os.path.relpath(source_file, source_dir)
+                expected_hash = preloaded_hashes.lookup(rel_path)
                 if expected_hash:
-                    # Вычисляем хеш целевого файла и сравниваем с ожидаемым (игнорируя регистр)
-                    #target_hash = calculate_file_hash(target_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
-                    #return target_hash and expected_hash and target_hash.lower() == expected_hash.lower()
-                    # Вычисляем хеш целевого файла и сравниваем с ожидаемым
-                    try:
-                        target_hash = calculate_file_hash(target_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
-                        if target_hash and expected_hash:
-                            return target_hash.lower() == expected_hash.lower()
-                        else:
-                            handle_migration_error(
-                                MigrationErrorCodes.VERIFY_002,
-                                details=f"Не удалось вычислить хеш для файла: {os.path.basename(target_file)}",
-                                context={"user": username, "target_file": target_file, "algorithm": config.get("HASH_ALGORITHM", "sha256")}
-                            )
-                            return False
-                    except Exception as e:
+                    logger.debug(f"Найден хеш для пути: {rel_path}")
+
+            if source_hash is not None:
+                # Файл скопирован с хешированием потока: сверяем хеш переданных данных
+                return verify_stream_hash(
+                    source_file, target_file, source_hash, expected_hash, username,
+                    source_record=source_record, target_record=target_record
+                )
+
+            if expected_hash:
+                # Вычисляем хеш целевого файла и сравниваем с ожидаемым (игнорируя регистр)
+                #target_hash = calculate_file_hash(target_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
+                #return target_hash and expected_hash and target_hash.lower() == expected_hash.lower()
+                # Вычисляем хеш целевого файла и сравниваем с ожидаемым
+                try:
+                    target_hash = calculate_target_hash(target_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
+                    if target_hash and expected_hash:
+                        return target_hash.lower() == expected_hash.lower()
+                    else:
                         handle_migration_error(
                             MigrationErrorCodes.VERIFY_002,
-                            details=f"Ошибка при вычислении хеша файла: {os.path.basename(target_file)}",
-                            exception=e,
-                            context={"user": username, "target_file": target_file}
+                            details=f"Не удалось вычислить хеш для файла: {os.path.basename(target_file)}",
+                            context={"user": username, "target_file": target_file, "algorithm": config.get("HASH_ALGORITHM", "sha256")}
                         )
                         return False
-                    
+                except Exception as e:
+                    handle_migration_error(
+                        MigrationErrorCodes.VERIFY_002,
+                        details=f"Ошибка при вычислении хеша файла: {os.path.basename(target_file)}",
+                        exception=e,
+                        context={"user": username, "target_file": target_file}
+                    )
+                    return False
+                
 
             # Если нет предзагруженных хешей или хеш не найден, вычисляем хеши напрямую (СУЩЕСТВУЮЩИЙ КОД)
             try:
                 source_hash = calculate_file_hash(source_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
-                target_hash = calculate_file_hash(target_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
+                target_hash = calculate_target_hash(target_file, algorithm=config.get("HASH_ALGORITHM", "sha256"))
                 
                 if source_hash is None or target_hash is None:
                     handle_migration_error(
@@ -357,7 +492,7 @@ def verify_file_integrity(source_file, target_file, source_dir, target_dir, user
             
         elif integrity_check_method == 'size':
             try:
-                return compare_file_sizes(source_file, target_file)
+                return compare_file_sizes(source_file, target_file, source_record, target_record)
             except Exception as e:
                 handle_migration_error(
                     MigrationErrorCodes.VERIFY_003,
@@ -367,9 +502,30 @@ def verify_file_integrity(source_file, target_file, source_dir, target_dir, user
                 )
                 return False
             
+        elif integrity_check_method == 'tiered':
+            try:
+                rel_path = source_record.rel_path if source_record is not None else os.path.relpath(source_file, source_dir)
+                expected_hash = preloaded_hashes.lookup(rel_path) if preloaded_hashes else None
+                ok, error_msg = tiered_check(
+                    source_file, target_file, source_record, target_record,
+                    expected_hash=expected_hash, seed=rel_path, reference_hash=source_hash,
+                    readback=True
+                )
+                if not ok:
+                    logger.error(f"{error_msg}: {source_file} и {target_file}")
+                return ok
+            except Exception as e:
+                handle_migration_error(
+                    MigrationErrorCodes.VERIFY_002,
+                    details=f"Ошибка при многоуровневой проверке файла",
+                    exception=e,
+                    context={"user": username, "source_file": source_file, "target_file": target_file}
+                )
+                return False
+            
         elif integrity_check_method == 'metadata':
             try:
-                return compare_file_metadata(source_file, target_file)
+                return compare_file_metadata(source_file, target_file, source_record, target_record)
             except Exception as e:
                 handle_migration_error(
                     MigrationErrorCodes.VERIFY_002,
@@ -537,7 +693,101 @@ def rename_directories(target_dir, folder_mapping, desktop_rename, username=None
         return False
 
 
-def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None, username=None, report_data=None):
+def _destination_dir(rel_dir, target_dir, username):
+    """
+    Определяет целевую директорию для относительного пути исходной директории.
+
+    :param rel_dir: Путь директории относительно исходной ('' для корня)
+    :param target_dir: Целевая директория
+    :param username: Имя пользователя
+    :return: Путь к целевой директории
+    """
+    parts = rel_dir.split(os.sep) if rel_dir else []
+
+    # Для BrowserData используем специальную обработку
+    if 'BrowserData' in parts:
+        browser_subpath = parts[parts.index('BrowserData') + 1:]
+        if 'chrome' in browser_subpath:
+            return os.path.join("/home", username, ".config/google-chrome/Default", *browser_subpath[browser_subpath.index('chrome') + 1:])
+        elif 'yandex' in browser_subpath:
+            return os.path.join("/home", username, ".config/yandex-browser/Default", *browser_subpath[browser_subpath.index('yandex') + 1:])
+
+    # Обычный путь - сохраняем структуру как есть
+    return os.path.join(target_dir, rel_dir)
+
+
+def iter_files_to_copy(source_dir, target_dir, exclude_dirs, exclude_files, username=None, report_data=None, lock=None,
+                       dir_cache=None):
+    """
+    Обходит исходную директорию и по одному возвращает файлы для копирования.
+    Итоговые объём и количество файлов накапливаются в report_data по мере обхода.
+    Для каждого файла выполняется один stat, его результат передаётся дальше в FileRecord.
+
+    :param source_dir: Исходная директория
+    :param target_dir: Целевая директория
+    :param exclude_dirs: Список исключаемых директорий (относительно source_dir)
+    :param exclude_files: Список шаблонов исключаемых файлов
+    :param username: Имя пользователя
+    :param report_data: Словарь для отчета
+    :param lock: Блокировка для многопоточного доступа к отчету
+    :param dir_cache: Кеш директорий для walk_tree (ManifestScan)
+    :return: Генератор кортежей (FileRecord, dest_file)
+    """
+    lock = lock or threading.Lock()
+    exclude_dirs = set(exclude_dirs)
+
+    def skip_dir(rel_dir, name):
+        return os.path.normpath(os.path.join(rel_dir, name)) in exclude_dirs
+
+    def skip_file(rel_dir, name):
+        # Пропускаем скрытые файлы
+        if name.startswith('.'):
+            logger.info(f"Скрытый файл {name} исключён из копирования.")
+            if report_data is not None:
+                with lock:
+                    report_data['skipped_files'].append(os.path.join(source_dir, rel_dir, name))
+            return True
+
+        # Проверяем исключения по шаблону
+        for pattern in exclude_files or []:
+            if fnmatch.fnmatch(name, pattern):
+                logger.info(f"Файл {name} исключён из копирования по шаблону {pattern}.")
+                if report_data is not None:
+                    with lock:
+                        report_data['skipped_files'].append(os.path.join(source_dir, rel_dir, name))
+                return True
+        return False
+
+    def on_error(path, error):
+        handle_migration_error(
+            MigrationErrorCodes.SOURCE_003,
+            details=f"Ошибка при получении информации о файле: {os.path.basename(path)}",
+            exception=error,
+            context={"user": username, "source_file": path}
+        )
+
+    current_rel_dir = None
+    dest_dir = None
+
+    for record in walk_tree(source_dir, skip_dir=skip_dir, skip_file=skip_file, on_error=on_error,
+                            dir_cache=dir_cache):
+        rel_dir = os.path.dirname(record.rel_path)
+        if rel_dir != current_rel_dir:
+            # ФАЗА 1: Копируем с сохранением ОРИГИНАЛЬНОЙ структуры
+            current_rel_dir = rel_dir
+            dest_dir = _destination_dir(rel_dir, target_dir, username)
+
+        # Итоги обновляем до выдачи файла: рабочие потоки считают прогресс от них
+        if report_data is not None:
+            with lock:
+                report_data['total_size'] += record.size
+                report_data['total_files'] += 1
+
+        yield record, os.path.join(dest_dir, os.path.basename(record.rel_path))
+
+
+def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None, username=None, report_data=None,
+                   resume_manifest=None):
     """
     Выполняет прямую миграцию данных из source_dir в target_dir с раздельным процессом:
     1. Копирование с проверкой целостности (сохраняя оригинальную структуру)
@@ -549,7 +799,10 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
     :param exclude_files: Список файлов для исключения
     :param username: Имя пользователя
     :param report_data: Словарь для отчета
+    :param resume_manifest: Завершённый ScanManifest: вместо сканирования копируются только
+                            файлы манифеста, отсутствующие в журнале миграции
     :return: True если миграция успешна, иначе False
+    :raises ErrorBudgetExceeded: Копирование прервано по бюджету ошибок (источник недоступен)
     """
     global preloaded_hashes
     
@@ -579,8 +832,8 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
             'end_time': None
         }
     
-    # Предварительно загружаем хеши из базы данных, если метод проверки 'hash'
-    if config.get("INTEGRITY_CHECK_METHOD") == 'hash' and config.get("DATABASE_PATH"):
+    # Предварительно загружаем хеши из базы данных, если метод проверки 'hash' или 'tiered'
+    if config.get("INTEGRITY_CHECK_METHOD") in ('hash', 'tiered') and config.get("DATABASE_PATH"):
         logger.info("Загрузка хешей из базы данных...")
         send_status(
             progress=0,
@@ -592,10 +845,8 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
         )
         
         try:
-            # Загружаем хеши из базы данных
-            # Примечание: в этом случае target_dir и network_path не используются для преобразования путей
-            # так как мы сохраняем оригинальную структуру
-            preloaded_hashes = load_hashes_from_db(config["DATABASE_PATH"], "", username)
+            # Загружаем хеши только текущего пользователя через локальный индекс базы
+            preloaded_hashes = get_hash_index().for_user(username)
             
             if preloaded_hashes:
                 logger.info(f"Загружено {len(preloaded_hashes)} хешей из базы данных")
@@ -608,7 +859,7 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
                 exception=e
             )
             logger.error(f"Ошибка при загрузке хешей из базы данных: {e}")
-            preloaded_hashes = {}
+            preloaded_hashes = None
     
     # Преобразуем пути исключаемых директорий в относительные
     exclude_dirs = [os.path.normpath(os.path.relpath(os.path.join(source_dir, excl), source_dir)) for excl in exclude_dirs]
@@ -617,99 +868,126 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
     try:
         os.makedirs(target_dir, exist_ok=True)
         
-        # Собираем список файлов для копирования
-        files_to_copy = []
-        total_size = 0
-        
-        # Отправляем статус сканирования
+        # Итоги сканирования накапливаются по мере обхода дерева (при возобновлении - из манифеста)
+        if report_data is not None:
+            report_data['total_size'] = 0
+            report_data['total_files'] = 0
+            if resume_manifest is not None:
+                report_data['total_files'], report_data['total_size'] = resume_manifest.summary()
+
+        # Отправляем статус начала сканирования и копирования
         send_status(
             progress=0,
-            status="Сканирование исходной директории",
+            status="Сканирование и копирование с сохранением исходной структуры",
             user=username,
-            stage="Сканирование",
+            stage="Копирование",
             data_volume="Не определено",
             eta="Рассчитывается..."
         )
-        try:
-            for root, dirs, files in os.walk(source_dir, topdown=True):
-                # Относительный путь от исходной директории
-                rel_path = os.path.normpath(os.path.relpath(root, source_dir))
-                
-                # Исключение директорий
-                dirs[:] = [d for d in dirs if os.path.normpath(os.path.join(rel_path, d)) not in exclude_dirs]
-                
-                # ФАЗА 1: Копируем с сохранением ОРИГИНАЛЬНОЙ структуры
-                # Для BrowserData используем специальную обработку
-                if 'BrowserData' in rel_path.split(os.sep):
-                    browser_index = rel_path.split(os.sep).index('BrowserData')
-                    browser_subpath = rel_path.split(os.sep)[browser_index + 1:]
-                    if 'chrome' in browser_subpath:
-                        dest_dir = os.path.join("/home", username, ".config/google-chrome/Default", *browser_subpath[browser_subpath.index('chrome') + 1:])
-                    elif 'yandex' in browser_subpath:
-                        dest_dir = os.path.join("/home", username, ".config/yandex-browser/Default", *browser_subpath[browser_subpath.index('yandex') + 1:])
-                    else:
-                        dest_dir = os.path.join(target_dir, rel_path)
-                else:
-                    # Обычный путь - сохраняем структуру как есть
-                    dest_dir = os.path.join(target_dir, rel_path)
-                
-                # Обработка файлов
-                for file in files:
-                    # Пропускаем скрытые файлы
-                    if file.startswith('.'):
-                        logger.info(f"Скрытый файл {file} исключён из копирования.")
-                        if report_data is not None:
-                            report_data['skipped_files'].append(os.path.join(root, file))
-                        continue
-                    
-                    # Проверяем исключения по шаблону
-                    exclude_file = False
-                    if exclude_files:
-                        for pattern in exclude_files:
-                            if fnmatch.fnmatch(file, pattern):
-                                exclude_file = True
-                                logger.info(f"Файл {file} исключён из копирования по шаблону {pattern}.")
-                                if report_data is not None:
-                                    report_data['skipped_files'].append(os.path.join(root, file))
-                                break
-                    
-                    if exclude_file:
-                        continue
-                    
-                    # Добавляем файл в список для копирования
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.join(dest_dir, file)
-                    
-                    try:
-                        file_size = os.path.getsize(source_file)
-                        total_size += file_size
-                        
-                        # Время модификации для сортировки
-                        mtime = os.path.getmtime(source_file)
-                        
-                        files_to_copy.append((mtime, source_file, dest_file, file_size))
-                    except FileNotFoundError as e:
-                            # *** НОВОЕ: Код ошибки для недоступного файла ***
-                        handle_migration_error(
-                            MigrationErrorCodes.SOURCE_003,
-                            details=f"Файл недоступен во время сканирования: {file}",
-                            exception=e,
-                            context={"user": username, "source_file": source_file}
-                        )
-                        continue
-                    except Exception as e:
-                            # *** НОВОЕ: Общий код ошибки для сканирования ***
-                        handle_migration_error(
-                            MigrationErrorCodes.SOURCE_003,
-                            details=f"Ошибка при получении информации о файле: {file}",
-                            exception=e,
-                            context={"user": username, "source_file": source_file}
-                        )
-                        logger.error(f"Ошибка при получении информации о файле {source_file}: {e}")
-                        continue
 
+        # ФАЗА 1: Потоковое копирование с проверкой целостности (сохраняя оригинальную структуру).
+        # Сканер и рабочие потоки работают одновременно, очередь между ними ограничена.
+        lock = threading.Lock()
+
+        # Бюджет ошибок: при массовых ошибках источника конвейер отменяется, а не перебирает все файлы
+        budget = None
+        if config.get("ERROR_BUDGET_ENABLED", True):
+            budget = ErrorBudget(
+                sample_size=config.get("ERROR_BUDGET_SAMPLE_SIZE", 100),
+                min_failures=config.get("ERROR_BUDGET_MIN_FAILURES", 20),
+                max_ratio=config.get("ERROR_BUDGET_MAX_RATIO", 0.5),
+                window=config.get("ERROR_BUDGET_WINDOW", 60),
+                max_rate=config.get("ERROR_BUDGET_MAX_RATE", 5),
+                categories=config.get("ERROR_BUDGET_CATEGORIES", DEFAULT_CATEGORIES),
+                on_trip=lambda category, reason: pipeline.cancel(),
+                name=f"copy-{username}"
+            )
+
+        def copy_worker(item):
+            record, dest_file = item
+            result, _ = direct_copy_file(
+                record.path,
+                dest_file,
+                source_dir,
+                target_dir,
+                username,
+                report_data,
+                lock,
+                True,  # no_mapping=True - копируем без преобразования имен
+                source_record=record
+            )
+            if result and budget is not None:
+                budget.record_success()
+            return result
+
+        prefetch = None
+        if config.get("COPY_PREFETCH_NEXT", False):
+            # Пока копируется текущий файл, ядро заранее читает начало следующего
+            prefetch_bytes = config.get("COPY_PREFETCH_BYTES", 8 * 1024 * 1024)
+            prefetch = lambda item: prefetch_file(item[0].path, prefetch_bytes)
+
+        large_workers = config.get("LARGE_FILE_WORKERS", 2)
+        small_workers = config.get("SMALL_FILE_WORKERS") or os.cpu_count() or 2
+        controller = large_controller = None
+        if config.get("ADAPTIVE_CONCURRENCY", False):
+            # Потоков запускается по максимуму, одновременно работают только разрешённые контроллером
+            max_limit = config.get("ADAPTIVE_CONCURRENCY_MAX_WORKERS", 16)
+            interval = config.get("ADAPTIVE_CONCURRENCY_INTERVAL", 2.0)
+            controller = ConcurrencyController(
+                initial=small_workers, max_limit=max_limit, interval=interval,
+                name="small", on_adjust=track_concurrency
+            )
+            large_controller = ConcurrencyController(
+                initial=large_workers, max_limit=max_limit, interval=interval,
+                name="large", on_adjust=track_concurrency
+            )
+            large_workers = large_controller.max_limit
+            small_workers = controller.max_limit
+
+        # Крупные файлы копируются в своей полосе по убыванию размера, мелкие - пакетами
+        if resume_manifest is not None:
+            journal_path = get_migration_journal(username).path
+            producer = lambda: resume_manifest.pending(journal_path)
+        else:
+            # Результаты сканирования сохраняются в манифест для быстрого возобновления;
+            # предыдущий манифест избавляет от повторного чтения неизменённых директорий
+            scan = get_scan_manifest(username).begin_scan(
+                source_dir, target_dir,
+                filters=json.dumps([sorted(exclude_dirs), list(exclude_files)], ensure_ascii=False),
+                reuse=config.get("SCAN_MANIFEST_REUSE", True)
+            )
+            producer = lambda: scan.record(
+                iter_files_to_copy(
+                    source_dir, target_dir, exclude_dirs, exclude_files,
+                    username=username, report_data=report_data, lock=lock, dir_cache=scan
+                )
+            )
+
+        pipeline = DualLaneScheduler(
+            producer=producer,
+            worker=copy_worker,
+            size_of=lambda item: item[0].size,
+            large_threshold=config.get("LARGE_FILE_THRESHOLD", DEFAULT_LARGE_FILE_THRESHOLD),
+            large_workers=large_workers,
+            small_workers=small_workers,
+            batch_size=config.get("SMALL_FILE_BATCH_SIZE", 64),
+            batch_bytes=config.get("SMALL_FILE_BATCH_BYTES", 8 * 1024 * 1024),
+            queue_size=config.get("SCAN_QUEUE_SIZE", 1000),
+            name=f"copy-{username}",
+            controller=controller,
+            large_controller=large_controller,
+            prefetch=prefetch
+        )
+
+        unsubscribe = None
+        if budget is not None:
+            unsubscribe = get_error_aggregator().subscribe(
+                lambda error_info: budget.record_failure(error_info["category"])
+                if error_info.get("context", {}).get("user") == username else None
+            )
+        try:
+            copy_success = pipeline.run()
         except PermissionError as e:
-            # *** НОВОЕ: Код ошибки для доступа к исходной директории ***
             handle_migration_error(
                 MigrationErrorCodes.SOURCE_001,
                 details=f"Нет прав для чтения исходной директории",
@@ -718,7 +996,6 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
             )
             return False
         except Exception as e:
-            # *** НОВОЕ: Общий код ошибки для сканирования ***
             handle_migration_error(
                 MigrationErrorCodes.SOURCE_003,
                 details=f"Ошибка при сканировании исходной директории",
@@ -726,18 +1003,25 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
                 context={"user": username, "source_dir": source_dir}
             )
             return False
-    
-        
-        # Сортируем файлы по времени модификации (самые новые первые)
-        files_to_copy.sort(reverse=True, key=lambda x: x[0])
-        
-        # Обновляем отчет
-        total_files = len(files_to_copy)
-        if report_data is not None:
-            report_data['total_size'] = total_size
-            report_data['total_files'] = total_files
-        
-        if total_files == 0:
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+
+        if budget is not None and budget.tripped is not None:
+            # Скопированные файлы остаются в журнале: повтор продолжит с места остановки
+            save_migration_state(username)
+            category, reason = budget.tripped
+            send_status(
+                progress=0,
+                status=f"Копирование прервано: массовые ошибки {category} ({reason})",
+                user=username,
+                stage="Ожидание повтора",
+                data_volume=f"{report_data.get('target_size', 0) / (1024 * 1024):.2f} MB",
+                eta="Неизвестно"
+            )
+            raise ErrorBudgetExceeded(username, category, reason)
+
+        if pipeline.produced == 0:
             logger.warning("Нет файлов для копирования.")
             send_status(
                 progress=100,
@@ -749,53 +1033,6 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
             )
             return True
         
-        # Отправляем начальный статус
-        send_status(
-            progress=0,
-            status="Начало копирования с сохранением исходной структуры",
-            user=username,
-            stage="Копирование",
-            data_volume=f"{total_size / (1024 * 1024):.2f} MB",
-            eta="Рассчитывается..."
-        )
-        
-        # ФАЗА 1: Многопоточное копирование с проверкой целостности (сохраняя оригинальную структуру)
-        lock = threading.Lock()
-        copy_success = True
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 2) as executor:
-            futures = []
-            
-            for _, source_file, dest_file, _ in files_to_copy:
-                future = executor.submit(
-                    direct_copy_file, 
-                    source_file, 
-                    dest_file, 
-                    source_dir, 
-                    target_dir,
-                    username,
-                    report_data, 
-                    lock,
-                    True  # no_mapping=True - копируем без преобразования имен
-                )
-                futures.append(future)
-            
-            # Ожидание завершения и обработка результатов
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    result, error = future.result()
-                    if not result:
-                        copy_success = False
-                except Exception as e:
-                    handle_migration_error(
-                        MigrationErrorCodes.SYSTEM_003,
-                        details=f"Ошибка при обработке результата многопоточного копирования",
-                        exception=e,
-                        context={"user": username}
-                    )
-                    logger.error(f"Ошибка при обработке результата: {e}")
-                    copy_success = False
-        
         # Сохраняем состояние миграции в файл
         save_migration_state(username)
         
@@ -860,6 +1097,8 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
             logger.warning(f"Копирование завершено с ошибками для пользователя {username}, переименование не выполнено")
             return False
             
+    except ErrorBudgetExceeded:
+        raise
     except Exception as e:
         handle_migration_error(
             MigrationErrorCodes.SYSTEM_003,
@@ -881,33 +1120,66 @@ def direct_migrate(source_dir, target_dir, exclude_dirs=None, exclude_files=None
         return False
 
 
+def get_migration_journal(username):
+    """
+    Возвращает открытый журнал миграции пользователя, открывая его при первом обращении.
+    
+    :param username: Имя пользователя
+    :return: MigrationJournal
+    """
+    with migration_journals_lock:
+        journal = migration_journals.get(username)
+        if journal is None:
+            journal_dir = config.get("JOURNAL_DIRECTORY", "/var/lib/migration-service/journal")
+            journal = MigrationJournal(
+                os.path.join(journal_dir, f"migration_journal_{username}.db"),
+                batch_size=config.get("JOURNAL_BATCH_SIZE", 500),
+                flush_interval=config.get("JOURNAL_FLUSH_INTERVAL", 1.0)
+            )
+            migration_journals[username] = journal
+        return journal
+
+
+def get_hash_index():
+    """
+    :return: HashIndex базы хешей из конфигурации (индекс хранится в директории журналов)
+    """
+    return HashIndex.for_database(
+        config["DATABASE_PATH"],
+        config.get("JOURNAL_DIRECTORY", "/var/lib/migration-service/journal"),
+        network_prefix=config.get("HASH_DB_NETWORK_PREFIX")
+    )
+
+
+def get_scan_manifest(username):
+    """
+    Возвращает манифест сканирования пользователя.
+    
+    :param username: Имя пользователя
+    :return: ScanManifest
+    """
+    return ScanManifest.for_user(config.get("JOURNAL_DIRECTORY", "/var/lib/migration-service/journal"), username)
+
+
 def save_migration_state(username):
     """
-    Сохраняет состояние миграции в файл.
+    Фиксирует оставшиеся записи журнала миграции и закрывает журнал.
+    Записи о файлах сохраняются по мере копирования, здесь дописывается последний пакет.
     
     :param username: Имя пользователя
     """
+    with migration_journals_lock:
+        journal = migration_journals.pop(username, None)
+    if journal is None:
+        return
+    
     try:
-        # Формируем путь к файлу состояния
-        state_dir = os.path.dirname(config.get("STATE_FILE", "/var/lib/migration_state"))
-        os.makedirs(state_dir, exist_ok=True)
-        
-        state_file = os.path.join(state_dir, f"migration_state_{username}.json")
-        
-        import json
-        with open(state_file, 'w') as f:
-            json.dump(migration_state.get(username, {}), f, indent=2)
-            
-        logger.info(f"Состояние миграции пользователя {username} сохранено в {state_file}")
-    except PermissionError as e:
-        handle_migration_error(
-            MigrationErrorCodes.TARGET_003,
-            details=f"Нет прав для сохранения состояния миграции",
-            exception=e,
-            context={"user": username, "state_file": state_file}
-        )
-    except OSError as e:
-        if "No space left" in str(e):
+        journal.close()
+        if journal.error is not None:
+            raise journal.error
+        logger.info(f"Журнал миграции пользователя {username} сохранен в {journal.path}")
+    except sqlite3.OperationalError as e:
+        if "disk is full" in str(e) or "No space left" in str(e):
             handle_migration_error(
                 MigrationErrorCodes.TARGET_002,
                 details=f"Недостаточно места для сохранения состояния миграции",
@@ -919,7 +1191,7 @@ def save_migration_state(username):
                 MigrationErrorCodes.SYSTEM_002,
                 details=f"Системная ошибка при сохранении состояния миграции",
                 exception=e,
-                context={"user": username, "state_file": state_file}
+                context={"user": username, "state_file": journal.path}
             )
     except Exception as e:
         handle_migration_error(
@@ -933,41 +1205,47 @@ def save_migration_state(username):
 
 def load_migration_state(username):
     """
-    Загружает состояние миграции из файла.
+    Открывает журнал миграции пользователя и возвращает итоги по проверенным файлам.
+    Состояние прежнего формата (migration_state_{username}.json) переносится в журнал.
     
     :param username: Имя пользователя
-    :return: Словарь с состоянием миграции
+    :return: (количество проверенных файлов, их суммарный размер) или None, если журнал пуст
     """
     try:
-        state_dir = os.path.dirname(config.get("STATE_FILE", "/var/lib/migration_state"))
-        state_file = os.path.join(state_dir, f"migration_state_{username}.json")
+        journal = get_migration_journal(username)
+        files, size = journal.summary()
         
-        if not os.path.exists(state_file):
-            logger.info(f"Файл состояния миграции {state_file} не найден")
-            return {}
+        if files == 0:
+            state_dir = os.path.dirname(config.get("STATE_FILE", "/var/lib/migration_state"))
+            legacy_file = os.path.join(state_dir, f"migration_state_{username}.json")
+            if os.path.exists(legacy_file):
+                with open(legacy_file, 'r') as f:
+                    imported = journal.import_entries(json.load(f))
+                logger.info(f"Перенесено {imported} записей из {legacy_file} в журнал миграции")
+                files, size = journal.summary()
         
-        import json
-        with open(state_file, 'r') as f:
-            state = json.load(f)
-            
-        logger.info(f"Состояние миграции пользователя {username} загружено из {state_file}")
-        return state
+        if files == 0:
+            logger.info(f"Журнал миграции пользователя {username} пуст")
+            return None
+        
+        logger.info(f"Журнал миграции пользователя {username} загружен из {journal.path}")
+        return files, size
     except PermissionError as e:
         handle_migration_error(
             MigrationErrorCodes.SOURCE_001,
             details=f"Нет прав для чтения файла состояния миграции",
             exception=e,
-            context={"user": username, "state_file": state_file}
+            context={"user": username}
         )
-        return {}
-    except json.JSONDecodeError as e:
+        return None
+    except (sqlite3.DatabaseError, ValueError) as e:
         handle_migration_error(
             MigrationErrorCodes.SOURCE_003,
             details=f"Файл состояния миграции поврежден",
             exception=e,
-            context={"user": username, "state_file": state_file}
+            context={"user": username}
         )
-        return {}
+        return None
     except Exception as e:
         handle_migration_error(
             MigrationErrorCodes.SOURCE_003,
@@ -976,7 +1254,7 @@ def load_migration_state(username):
             context={"user": username}
         )
         logger.error(f"Ошибка при загрузке состояния миграции: {e}")
-        return {}
+        return None
 
 
 def resume_direct_migration(source_dir, target_dir, username, report_data=None):
@@ -989,23 +1267,18 @@ def resume_direct_migration(source_dir, target_dir, username, report_data=None):
     :param report_data: Словарь для отчета
     :return: True если миграция успешно возобновлена, иначе False
     """
-    global migration_state
-    
     logger.info(f"Возобновление прерванной миграции для пользователя {username}")
     
-    # Загружаем состояние миграции
-    user_state = load_migration_state(username)
+    # Загружаем итоги журнала миграции
+    journal_summary = load_migration_state(username)
     
-    if not user_state:
+    if not journal_summary:
         logger.info(f"Состояние миграции для пользователя {username} не найдено, выполняем полную миграцию")
         return direct_migrate(source_dir, target_dir, exclude_dirs=config.get("EXCLUDE_DIRS", []), 
                               exclude_files=config.get("EXCLUDE_FILES", []), username=username, report_data=report_data)
     
-    # Обновляем глобальное состояние
-    with migration_state_lock:
-        migration_state[username] = user_state
-    
-    logger.info(f"Найдена информация о {len(user_state)} ранее скопированных файлах")
+    verified_files, copied_size = journal_summary
+    logger.info(f"Найдена информация о {verified_files} ранее скопированных файлах")
     
     # Инициализируем данные отчета, если необходимо
     if report_data is None:
@@ -1028,15 +1301,9 @@ def resume_direct_migration(source_dir, target_dir, username, report_data=None):
             'end_time': None
         }
     
-    # Подсчитываем уже скопированные файлы для отчета
-    copied_size = 0
-    for source_path, info in user_state.items():
-        if info.get('verified', False):
-            report_data['files_copied'] += 1
-            report_data['files_verified'] += 1
-            file_size = info.get('size', 0)
-            copied_size += file_size
-    
+    # Уже скопированные файлы для отчета
+    report_data['files_copied'] += verified_files
+    report_data['files_verified'] += verified_files
     report_data['target_size'] = copied_size
     logger.info(f"Уже скопировано: {report_data['files_copied']} файлов, {copied_size / (1024*1024):.2f} MB")
     
@@ -1063,6 +1330,24 @@ def resume_direct_migration(source_dir, target_dir, username, report_data=None):
             )
             return True
         else:
+            # Сверяем манифест сканирования с журналом: копируем только недостающие файлы
+            manifest = get_scan_manifest(username)
+            if manifest.is_complete(source_dir, target_dir, max_age=config.get("SCAN_MANIFEST_MAX_AGE")):
+                pending_files, pending_size = manifest.pending_summary(get_migration_journal(username).path)
+                if pending_files:
+                    logger.info(
+                        f"По манифесту сканирования осталось скопировать {pending_files} файлов, "
+                        f"{pending_size / (1024*1024):.2f} MB"
+                    )
+                    return direct_migrate(source_dir, target_dir, username=username, report_data=report_data,
+                                          resume_manifest=manifest)
+            else:
+                # Сканирование было прервано: какие файлы остались, неизвестно
+                logger.info("Манифест сканирования не завершён, выполняем повторное сканирование")
+                return direct_migrate(source_dir, target_dir, exclude_dirs=config.get("EXCLUDE_DIRS", []),
+                                      exclude_files=config.get("EXCLUDE_FILES", []), username=username,
+                                      report_data=report_data)
+            
             logger.info("Файлы скопированы, но переименование директорий не завершено")
             # Выполняем только переименование
             rename_success = rename_directories(target_dir, folder_mapping, desktop_rename, username)
@@ -0,0 +1,216 @@
+"""
+Модуль агрегации ошибок миграции.
+
+При сбое источника (пропадание сетевого хранилища) тысячи файлов подряд
+завершаются одной и той же ошибкой. Агрегатор группирует ошибки по ключу
+(код, пользователь, тип исключения):
+    - в лог полностью записывается только первая ошибка группы за интервал,
+      повторы - одной сводной строкой при публикации;
+    - traceback форматируется для первой ошибки группы за интервал и далее
+      для каждой traceback_every-й, остальные ошибки хранятся без него;
+    - последние ошибки хранятся в кольцевом буфере ограниченного размера;
+    - состояние обновляется одной публикацией за интервал: последняя ошибка,
+      счётчики по кодам и записи для журнала ошибок (первые ошибки групп и
+      сводки повторов).
+
+Публикация выполняется таймером не чаще одного раза за interval, поэтому
+число обновлений состояния не зависит от частоты ошибок.
+
+Классы:
+    - ErrorAggregator: Дедупликация, выборка traceback и пакетная публикация ошибок.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorAggregator:
+    """Группирует повторяющиеся ошибки и публикует их пакетом раз в интервал"""
+
+    def __init__(self, handler, publish, interval=5.0, recent_limit=1000, traceback_every=100,
+                 clock=time.monotonic):
+        """
+        :param handler: ErrorHandler для формирования информации об ошибке и статистики
+        :param publish: Функция (errors, latest, counts) публикации пакета: записи для журнала,
+                        последняя ошибка и количество ошибок по кодам
+        :param interval: Минимальный интервал между публикациями в секундах
+        :param recent_limit: Размер кольцевого буфера последних ошибок
+        :param traceback_every: Traceback сохраняется для каждой N-й повторной ошибки группы
+        :param clock: Источник времени (для тестов)
+        """
+        self.handler = handler
+        self.publish = publish
+        self.interval = max(0.0, float(interval))
+        self.traceback_every = max(1, int(traceback_every))
+        self.clock = clock
+
+        self.recorded = 0
+        self.suppressed = 0
+        self.publications = 0
+
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=max(1, int(recent_limit)))
+        self._totals = collections.Counter()
+        self._by_code = collections.Counter()
+        # Группы, в которых были ошибки с последней публикации: ключ -> [последняя ошибка, повторов]
+        self._window = {}
+        self._pending = []
+        self._latest = None
+        self._last_publish = None
+        self._timer = None
+        self._closed = False
+        self._subscribers = []
+
+    def record(self, error_code, details="", exception=None, context=None):
+        """
+        Регистрирует ошибку.
+
+        :param error_code: Код ошибки из MigrationErrorCodes
+        :param details: Дополнительные детали ошибки
+        :param exception: Исключение Python (если есть)
+        :param context: Контекст ошибки (пользователь, файл и т.д.)
+        :return: Словарь информации об ошибке (как у ErrorHandler.handle_error)
+        """
+        key = (
+            error_code.code,
+            (context or {}).get("user"),
+            type(exception).__name__ if exception is not None else None,
+        )
+        # Под блокировкой - только счётчики; traceback и запись в лог - без неё
+        with self._lock:
+            count = self._totals[key] + 1
+            self._totals[key] = count
+            self._by_code[error_code.code] += 1
+            group = self._window.get(key)
+            first = group is None
+            if first:
+                group = self._window[key] = [None, 0]
+            else:
+                group[1] += 1
+                self.suppressed += 1
+
+        error_info = self.handler.handle_error(
+            error_code, details, exception, context,
+            with_traceback=first or count % self.traceback_every == 0,
+            log=first
+        )
+        error_info["occurrences"] = count
+
+        with self._lock:
+            self.recorded += 1
+            self._recent.append(error_info)
+            self._latest = error_info
+            group[0] = error_info
+            if first:
+                self._pending.append(error_info)
+            closed = self._closed
+            if not closed:
+                self._schedule()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(error_info)
+            except Exception as e:
+                logger.warning(f"Ошибка подписчика агрегатора ошибок: {e}")
+        if closed:
+            # Таймер уже остановлен (завершение процесса): публикуем сразу
+            self.flush()
+        return error_info
+
+    def subscribe(self, callback):
+        """
+        Подписывает функцию на каждую регистрируемую ошибку (без группировки).
+
+        :param callback: Функция (error_info), вызывается в потоке, зарегистрировавшем ошибку
+        :return: Функция без аргументов, отменяющая подписку
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _schedule(self):
+        if self._timer is not None:
+            return
+        delay = 0.0
+        if self._last_publish is not None:
+            delay = max(0.0, self._last_publish + self.interval - self.clock())
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        """
+        Публикует накопленные с прошлой публикации ошибки.
+
+        :return: True, если публиковать было нечего или публикация удалась
+        """
+        with self._lock:
+            self._timer = None
+            if self._latest is None:
+                return True
+            errors = self._pending
+            # Первая ошибка группы может быть ещё не сформирована - её повторы попадут в сводку позже
+            repeats = [
+                (key, error_info, repeated)
+                for key, (error_info, repeated) in self._window.items()
+                if repeated and error_info is not None
+            ]
+            latest = self._latest
+            counts = dict(self._by_code)
+            self._pending = []
+            self._window = {}
+            self._latest = None
+            self._last_publish = self.clock()
+
+        for (code, user, exception_type), error_info, repeated in repeats:
+            logger.warning(
+                f"[{code}] повторилась ещё {repeated} раз(а) за {self.interval:.0f} с"
+                + (f" | Пользователь: {user}" if user else "")
+                + (f" | Исключение: {exception_type}" if exception_type else "")
+            )
+            errors.append(dict(error_info, repeated=repeated))
+        try:
+            self.publish(errors, latest, counts)
+        except Exception as e:
+            logger.warning(f"Не удалось опубликовать ошибки миграции: {e}")
+            return False
+        with self._lock:
+            self.publications += 1
+        return True
+
+    def recent(self, limit=None):
+        """
+        :param limit: Количество последних ошибок (None - весь буфер)
+        :return: Список последних ошибок, от старых к новым
+        """
+        with self._lock:
+            errors = list(self._recent)
+        return errors[-limit:] if limit else errors
+
+    def summary(self):
+        """
+        :return: Сводка ErrorHandler.get_error_summary с количеством ошибок по кодам и подавленных повторов
+        """
+        summary = self.handler.get_error_summary()
+        with self._lock:
+            summary["by_code"] = dict(self._by_code)
+            summary["suppressed"] = self.suppressed
+        return summary
+
+    def close(self):
+        """Останавливает таймер и публикует накопленные ошибки."""
+        with self._lock:
+            self._closed = True
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush()
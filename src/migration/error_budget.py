@@ -0,0 +1,125 @@
+"""
+Модуль бюджета ошибок копирования.
+
+Когда источник (сетевое хранилище) пропадает во время копирования, каждый
+оставшийся файл завершается той же ошибкой, часто после долгого таймаута.
+Бюджет ошибок следит за исходами копирования во всех рабочих потоках и
+срабатывает, если ошибки одной категории (SOURCE, NETWORK, COPY, ...):
+    - составляют не меньше max_ratio последних sample_size исходов, или
+    - происходят чаще max_rate в секунду в среднем за window секунд,
+и их при этом не меньше min_failures. При срабатывании вызывается on_trip
+(отмена конвейера копирования), а вызывающий код переносит пользователя в
+очередь повтора вместо перебора оставшихся файлов.
+
+Классы:
+    - ErrorBudget: Доля и частота ошибок по категориям с однократным срабатыванием.
+    - ErrorBudgetExceeded: Исключение - копирование прервано по бюджету ошибок.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Категории ошибок, указывающие на недоступность источника, а не на отдельный файл
+DEFAULT_CATEGORIES = ("SOURCE", "NETWORK", "COPY")
+
+
+class ErrorBudgetExceeded(Exception):
+    """Копирование пользователя прервано: превышен бюджет ошибок"""
+
+    def __init__(self, username, category, reason):
+        """
+        :param username: Имя пользователя
+        :param category: Категория ошибок, исчерпавшая бюджет
+        :param reason: Описание превышения (доля или частота ошибок)
+        """
+        super().__init__(f"Бюджет ошибок {category} исчерпан для пользователя {username}: {reason}")
+        self.username = username
+        self.category = category
+        self.reason = reason
+
+
+class ErrorBudget:
+    """Бюджет ошибок одного прогона копирования, общий для всех рабочих потоков"""
+
+    def __init__(self, sample_size=100, min_failures=20, max_ratio=0.5, window=60.0, max_rate=0,
+                 categories=DEFAULT_CATEGORIES, on_trip=None, name="copy", clock=time.monotonic):
+        """
+        :param sample_size: Количество последних исходов, по которым считается доля ошибок
+        :param min_failures: Минимальное количество ошибок категории для срабатывания
+        :param max_ratio: Доля ошибок категории среди последних исходов для срабатывания (0 - не проверять)
+        :param window: Окно в секундах для частоты ошибок
+        :param max_rate: Частота ошибок категории в секунду для срабатывания (0 - не проверять)
+        :param categories: Категории ошибок, учитываемые бюджетом; остальные ошибки считаются
+                           только как исходы
+        :param on_trip: Функция (category, reason), вызываемая один раз при срабатывании
+        :param name: Имя бюджета (для логов)
+        :param clock: Источник времени (для тестов)
+        """
+        self.min_failures = max(1, int(min_failures))
+        self.max_ratio = float(max_ratio or 0)
+        self.window = max(0.001, float(window))
+        self.max_rate = float(max_rate or 0)
+        self.categories = frozenset(categories)
+        self.on_trip = on_trip
+        self.name = name
+        self.clock = clock
+
+        self.successes = 0
+        self.failures = collections.Counter()
+        self.tripped = None
+
+        self._lock = threading.Lock()
+        # Последние исходы: категория ошибки или None для успеха
+        self._outcomes = collections.deque(maxlen=max(1, int(sample_size)))
+        self._recent = collections.Counter()
+        self._times = collections.defaultdict(collections.deque)
+
+    def _append(self, outcome):
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._recent[self._outcomes[0]] -= 1
+        self._outcomes.append(outcome)
+        self._recent[outcome] += 1
+
+    def record_success(self):
+        """Учитывает успешно обработанный файл."""
+        with self._lock:
+            self.successes += 1
+            self._append(None)
+
+    def record_failure(self, category):
+        """
+        Учитывает ошибку и проверяет бюджет.
+
+        :param category: Категория ошибки (ErrorCategory.value)
+        :return: True, если этой ошибкой бюджет исчерпан
+        """
+        with self._lock:
+            self.failures[category] += 1
+            self._append(category)
+            if self.tripped is not None or category not in self.categories:
+                return False
+
+            now = self.clock()
+            times = self._times[category]
+            times.append(now)
+            while times and times[0] <= now - self.window:
+                times.popleft()
+
+            reason = None
+            count = self._recent[category]
+            if self.max_ratio and count >= self.min_failures and count / len(self._outcomes) >= self.max_ratio:
+                reason = f"{count} из последних {len(self._outcomes)} файлов"
+            elif self.max_rate and len(times) >= max(self.min_failures, self.max_rate * self.window):
+                reason = f"{len(times)} ошибок за {self.window:.0f} с"
+            if reason is None:
+                return False
+            self.tripped = (category, reason)
+
+        logger.error(f"Бюджет ошибок {self.name} исчерпан: категория {category}, {reason}")
+        if self.on_trip is not None:
+            self.on_trip(category, reason)
+        return True
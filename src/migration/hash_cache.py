@@ -0,0 +1,164 @@
+"""
+Модуль постоянного кеша хешей файлов.
+
+Вычисленный хеш сохраняется в локальной базе SQLite с ключом (st_dev,
+st_ino, алгоритм) вместе с размером и mtime файла. При следующем запуске
+или повторной проверке хеш файла, у которого не изменились размер и mtime,
+берётся из кеша без чтения файла. Запись с другим размером или mtime
+считается устаревшей и заменяется при следующем вычислении.
+
+Новые записи и отметки использования копятся в памяти и записываются
+пакетами. При превышении max_entries удаляются давно не использованные
+записи (LRU по времени последнего использования).
+
+Классы:
+    - HashCache: Кеш хешей файлов по идентичности stat.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev         INTEGER NOT NULL,
+    inode       INTEGER NOT NULL,
+    algorithm   TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    digest      TEXT NOT NULL,
+    last_used   REAL NOT NULL,
+    PRIMARY KEY (dev, inode, algorithm)
+) WITHOUT ROWID
+"""
+_LAST_USED_INDEX = "CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)"
+
+
+class HashCache:
+    """Кеш хешей файлов в SQLite с ключом (устройство, inode, алгоритм) и проверкой размера и mtime"""
+
+    def __init__(self, path, max_entries=1000000, batch_size=1000):
+        """
+        :param path: Путь к файлу базы кеша
+        :param max_entries: Максимальное количество записей (старые удаляются по времени использования)
+        :param batch_size: Количество отложенных изменений, после которого они записываются в базу
+        """
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.batch_size = max(1, int(batch_size))
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._pending_puts = {}
+        self._pending_touches = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Одно соединение на все потоки: запросы короткие, доступ под self._lock
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Потеря последних записей кеша при сбое приводит только к повторному чтению файлов
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(_SCHEMA)
+            self._conn.execute(_LAST_USED_INDEX)
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def get(self, st, algorithm):
+        """
+        :param st: Результат os.stat файла
+        :param algorithm: Алгоритм хеширования
+        :return: Хеш из кеша, если размер и mtime файла не изменились, иначе None
+        """
+        key = (st.st_dev, st.st_ino, algorithm)
+        size, mtime_ns = st.st_size, st.st_mtime_ns
+        with self._lock:
+            pending = self._pending_puts.get(key)
+            if pending is not None:
+                row = pending[:3]
+            elif self._conn is None:
+                row = None
+            else:
+                try:
+                    row = self._conn.execute(
+                        "SELECT size, mtime_ns, digest FROM hashes WHERE dev = ? AND inode = ? AND algorithm = ?", key
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Ошибка чтения кеша хешей {self.path}: {e}")
+                    row = None
+            if row is None or row[0] != size or row[1] != mtime_ns:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pending_touches[key] = time.time()
+            if len(self._pending_touches) >= self.batch_size:
+                self._flush_locked()
+            return row[2]
+
+    def put(self, st, algorithm, digest):
+        """
+        Сохраняет хеш файла (запись в базу - пакетом).
+
+        :param st: Результат os.stat файла, снятый до вычисления хеша
+        :param algorithm: Алгоритм хеширования
+        :param digest: Хеш в шестнадцатеричном виде
+        """
+        key = (st.st_dev, st.st_ino, algorithm)
+        with self._lock:
+            self._pending_puts[key] = (st.st_size, st.st_mtime_ns, digest, time.time())
+            if len(self._pending_puts) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self):
+        """Записывает отложенные изменения и удаляет лишние записи."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        puts, self._pending_puts = self._pending_puts, {}
+        touches, self._pending_touches = self._pending_touches, {}
+        if (not puts and not touches) or self._conn is None:
+            return
+        try:
+            with self._conn:
+                if puts:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO hashes (dev, inode, algorithm, size, mtime_ns, digest, last_used) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [key + value for key, value in puts.items()]
+                    )
+                    self._entries += len(puts)
+                if touches:
+                    self._conn.executemany(
+                        "UPDATE hashes SET last_used = ? WHERE dev = ? AND inode = ? AND algorithm = ?",
+                        [(last_used,) + key for key, last_used in touches.items()]
+                    )
+                if self._entries > self.max_entries:
+                    self._trim()
+        except sqlite3.Error as e:
+            # Кеш необязателен: ошибка записи означает только повторное вычисление хешей
+            logger.warning(f"Ошибка записи кеша хешей {self.path}: {e}")
+
+    def _trim(self):
+        self._conn.execute(
+            "DELETE FROM hashes WHERE last_used < "
+            "(SELECT last_used FROM hashes ORDER BY last_used DESC LIMIT 1 OFFSET ?)",
+            (self.max_entries - 1,)
+        )
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        logger.debug(f"Кеш хешей {self.path} сокращён до {self._entries} записей")
+
+    def close(self):
+        """Записывает отложенные изменения и закрывает базу."""
+        with self._lock:
+            if self._conn is None:
+                return
+            self._flush_locked()
+            self._conn.close()
+            self._conn = None
+        logger.info(f"Кеш хешей {self.path}: попаданий {self.hits}, промахов {self.misses}")
+
@@ -0,0 +1,334 @@
+"""
+Модуль вычисления хешей файлов.
+
+Файл читается через readinto в крупный буфер, выделенный один раз на поток
+(по умолчанию 4 МБ), поэтому накладные расходы Python приходятся на один
+вызов на мегабайты данных, а не на каждые 4 КБ. И чтение, и обновление
+хеш-функций hashlib отпускают GIL, так что несколько рабочих потоков хешируют
+файлы параллельно. За одно чтение файла можно вычислить несколько хешей.
+
+Для файлов на локальных файловых системах доступно хеширование через mmap
+(без копирования данных в буфер). На сетевых файловых системах mmap не
+используется: при обрыве соединения или усечении файла обращение к
+отображённой памяти завершает процесс сигналом SIGBUS.
+
+Для проверки записанных данных (чтение с диска, а не из кеша страниц)
+файл читается с O_DIRECT в выровненный буфер или, если файловая система
+O_DIRECT не поддерживает, с posix_fadvise(DONTNEED): страницы файла
+сбрасываются на диск и вытесняются перед чтением и по мере чтения. В обоих
+режимах проверка не заполняет кеш страниц и не вытесняет из него данные
+других процессов.
+
+Для выборочной проверки крупных файлов хешируются только отдельные блоки:
+начало, конец и несколько внутренних блоков, выбранных детерминированно по
+зерну (одинаково для исходного и целевого файла).
+
+Функции:
+    - hash_file: Вычисляет один или несколько хешей файла.
+    - is_network_path: Находится ли файл на сетевой файловой системе.
+    - sample_offsets: Смещения блоков для выборочного хеширования.
+    - hash_sampled: Хеш выбранных блоков файла.
+"""
+
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Размер буфера хеширования по умолчанию (4 МБ)
+DEFAULT_HASH_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Файлы меньше этого размера хешируются чтением даже в режиме mmap
+DEFAULT_MMAP_MIN_SIZE = 16 * 1024 * 1024
+
+# Режимы чтения: через кеш страниц, с вытеснением страниц (fadvise), в обход кеша (O_DIRECT)
+READ_CACHED = "cache"
+READ_DONTNEED = "dontneed"
+READ_DIRECT = "direct"
+
+# Выравнивание смещения, длины и адреса буфера для O_DIRECT
+_DIRECT_ALIGNMENT = 4096
+
+# Типы сетевых файловых систем (для них mmap не используется)
+_NETWORK_FS_TYPES = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "fuse.sshfs", "9p", "ceph", "glusterfs", "afs"}
+
+# Буферы хеширования рабочих потоков (отдельно от буферов копирования: размеры разные)
+_thread_buffers = threading.local()
+
+# {st_dev: тип файловой системы} из /proc/self/mountinfo
+_fs_types = {}
+_fs_types_lock = threading.Lock()
+
+
+def _get_buffer(size):
+    buffer = getattr(_thread_buffers, "view", None)
+    if buffer is None or len(buffer) != size:
+        _thread_buffers.view = buffer = memoryview(bytearray(size))
+    return buffer
+
+
+def _get_aligned_buffer(size):
+    # Анонимный mmap выровнен по границе страницы, как требует O_DIRECT
+    buffer = getattr(_thread_buffers, "aligned", None)
+    if buffer is None or len(buffer) != size:
+        if buffer is not None:
+            buffer.close()
+        _thread_buffers.aligned = buffer = mmap.mmap(-1, size)
+    return buffer
+
+
+def _load_fs_types():
+    fs_types = {}
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields, _, rest = line.partition(" - ")
+                fields, rest = fields.split(), rest.split()
+                if len(fields) < 3 or not rest:
+                    continue
+                major, _, minor = fields[2].partition(":")
+                fs_types[os.makedev(int(major), int(minor))] = rest[0]
+    except (OSError, ValueError) as e:
+        logger.debug(f"Не удалось прочитать /proc/self/mountinfo: {e}")
+    return fs_types
+
+
+def is_network_path(path, st_dev=None):
+    """
+    :param path: Путь к файлу
+    :param st_dev: st_dev файла, если уже известен
+    :return: True, если файл на сетевой файловой системе или тип ФС определить не удалось
+    """
+    if st_dev is None:
+        st_dev = os.stat(path).st_dev
+    with _fs_types_lock:
+        if st_dev not in _fs_types:
+            # Новое устройство (смонтировано после предыдущего чтения): перечитываем таблицу
+            _fs_types.update(_load_fs_types())
+        fs_type = _fs_types.get(st_dev)
+    return fs_type is None or fs_type in _NETWORK_FS_TYPES
+
+
+def _new_hashes(algorithms):
+    return [hashlib.new(algorithm) for algorithm in algorithms]
+
+
+def _hash_read(f, hashes, buffer_size):
+    view = _get_buffer(buffer_size)
+    while True:
+        read = f.readinto(view)
+        if not read:
+            break
+        chunk = view[:read]
+        for hash_func in hashes:
+            hash_func.update(chunk)
+
+
+def _hash_mmap(f, size, hashes, buffer_size):
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mapped)
+        try:
+            # Блоками по buffer_size: обновление хеша отпускает GIL на каждом блоке
+            for offset in range(0, size, buffer_size):
+                chunk = view[offset:offset + buffer_size]
+                for hash_func in hashes:
+                    hash_func.update(chunk)
+                chunk.release()
+        finally:
+            view.release()
+
+
+def _hash_dontneed(f, hashes, buffer_size):
+    fd = f.fileno()
+    # Грязные страницы не вытесняются: сначала записываем их на диск
+    os.fdatasync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    view = _get_buffer(buffer_size)
+    offset = 0
+    while True:
+        read = f.readinto(view)
+        if not read:
+            break
+        chunk = view[:read]
+        for hash_func in hashes:
+            hash_func.update(chunk)
+        # Прочитанный блок сразу вытесняется: кеш страниц не растёт с размером файла
+        os.posix_fadvise(fd, offset, read, os.POSIX_FADV_DONTNEED)
+        offset += read
+
+
+def _hash_direct(file_path, hashes, buffer_size):
+    fd = os.open(file_path, os.O_RDONLY | os.O_DIRECT | getattr(os, "O_CLOEXEC", 0))
+    try:
+        with memoryview(_get_aligned_buffer(buffer_size)) as view:
+            offset = 0
+            while True:
+                read = os.preadv(fd, [view], offset)
+                if not read:
+                    break
+                with view[:read] as chunk:
+                    for hash_func in hashes:
+                        hash_func.update(chunk)
+                offset += read
+                if offset % _DIRECT_ALIGNMENT:
+                    # Невыровненный хвост файла: дальше только конец файла
+                    break
+    finally:
+        os.close(fd)
+
+
+def hash_file(file_path, algorithms=("sha256",), buffer_size=DEFAULT_HASH_BUFFER_SIZE,
+              use_mmap=False, mmap_min_size=DEFAULT_MMAP_MIN_SIZE, read_mode=READ_CACHED):
+    """
+    Вычисляет хеши файла за одно чтение.
+
+    :param file_path: Путь к файлу
+    :param algorithms: Алгоритм или последовательность алгоритмов ('sha256', 'md5', ...)
+    :param buffer_size: Размер буфера чтения в байтах
+    :param use_mmap: Хешировать через mmap файлы не меньше mmap_min_size на локальных ФС
+    :param mmap_min_size: Минимальный размер файла для mmap
+    :param read_mode: READ_CACHED, READ_DONTNEED (вытеснение страниц) или READ_DIRECT (O_DIRECT;
+                      если ФС его не поддерживает - READ_DONTNEED). В двух последних mmap не используется
+    :return: {алгоритм: hexdigest}
+    :raises OSError: Ошибки открытия и чтения файла
+    :raises ValueError: Неподдерживаемый алгоритм хеширования или режим чтения
+    """
+    if isinstance(algorithms, str):
+        algorithms = (algorithms,)
+    if read_mode not in (READ_CACHED, READ_DONTNEED, READ_DIRECT):
+        raise ValueError(f"Неизвестный режим чтения: {read_mode}")
+    hashes = _new_hashes(algorithms)
+    buffer_size = max(64 * 1024, int(buffer_size))
+
+    if read_mode == READ_DIRECT and hasattr(os, "O_DIRECT"):
+        aligned_size = -(-buffer_size // _DIRECT_ALIGNMENT) * _DIRECT_ALIGNMENT
+        try:
+            _hash_direct(file_path, hashes, aligned_size)
+            return {algorithm: hash_func.hexdigest() for algorithm, hash_func in zip(algorithms, hashes)}
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            # tmpfs, часть FUSE и сетевых ФС не поддерживают O_DIRECT
+            logger.debug(f"O_DIRECT недоступен для {file_path}, чтение с вытеснением страниц")
+            hashes = _new_hashes(algorithms)
+        read_mode = READ_DONTNEED
+    if read_mode != READ_CACHED and not hasattr(os, "posix_fadvise"):
+        read_mode = READ_CACHED
+
+    with open(file_path, "rb", buffering=0) as f:
+        st = os.fstat(f.fileno()) if use_mmap and read_mode == READ_CACHED else None
+        if read_mode == READ_DONTNEED:
+            _hash_dontneed(f, hashes, buffer_size)
+        elif st is not None and st.st_size >= max(1, mmap_min_size) and not is_network_path(file_path, st.st_dev):
+            _hash_mmap(f, st.st_size, hashes, buffer_size)
+        else:
+            _hash_read(f, hashes, buffer_size)
+
+    return {algorithm: hash_func.hexdigest() for algorithm, hash_func in zip(algorithms, hashes)}
+
+
+def sample_offsets(size, block_size, samples, seed):
+    """
+    Выбирает блоки для выборочного хеширования: первый, последний и samples
+    внутренних блоков (по границам block_size), одинаковые для одного зерна.
+
+    :param size: Размер файла в байтах
+    :param block_size: Размер блока в байтах
+    :param samples: Количество внутренних блоков
+    :param seed: Зерно выбора (например, относительный путь и размер файла)
+    :return: Отсортированный список смещений или None, если выборка не короче файла
+    """
+    block_size = max(1, int(block_size))
+    last = size - block_size
+    interior = last // block_size - 1 if last > 0 else 0
+    if interior <= samples:
+        return None
+    rng = random.Random(seed)
+    chosen = rng.sample(range(1, interior + 1), samples)
+    return [0] + sorted(index * block_size for index in chosen) + [last]
+
+
+def _hash_sampled_direct(file_path, offsets, block_size, hash_func):
+    # O_DIRECT требует выровненных смещения и длины: читается выровненный диапазон, покрывающий блок
+    span = -(-(block_size + _DIRECT_ALIGNMENT) // _DIRECT_ALIGNMENT) * _DIRECT_ALIGNMENT
+    fd = os.open(file_path, os.O_RDONLY | os.O_DIRECT | getattr(os, "O_CLOEXEC", 0))
+    try:
+        with memoryview(_get_aligned_buffer(span)) as view:
+            for offset in offsets:
+                start = offset - offset % _DIRECT_ALIGNMENT
+                skip = offset - start
+                need = -(-(skip + block_size) // _DIRECT_ALIGNMENT) * _DIRECT_ALIGNMENT
+                read = 0
+                while read < need:
+                    chunk = os.preadv(fd, [view[read:need]], start + read)
+                    if not chunk or chunk % _DIRECT_ALIGNMENT:
+                        # Конец файла
+                        read += chunk
+                        break
+                    read += chunk
+                if read < skip + block_size:
+                    raise EOFError(f"Файл {file_path} короче ожидаемого: смещение {start + read}")
+                hash_func.update(offset.to_bytes(8, "little"))
+                hash_func.update(view[skip:skip + block_size])
+    finally:
+        os.close(fd)
+
+
+def hash_sampled(file_path, offsets, block_size, algorithm="sha256", read_mode=READ_CACHED):
+    """
+    Хеширует блоки файла по смещениям (смещение каждого блока входит в хеш).
+
+    :param file_path: Путь к файлу
+    :param offsets: Смещения блоков (sample_offsets)
+    :param block_size: Размер блока в байтах
+    :param algorithm: Алгоритм хеширования
+    :param read_mode: READ_CACHED, READ_DONTNEED или READ_DIRECT (как у hash_file)
+    :return: hexdigest
+    :raises OSError: Ошибки чтения; EOFError, если файл короче последнего блока
+    :raises ValueError: Неподдерживаемый алгоритм хеширования или режим чтения
+    """
+    if read_mode not in (READ_CACHED, READ_DONTNEED, READ_DIRECT):
+        raise ValueError(f"Неизвестный режим чтения: {read_mode}")
+    block_size = int(block_size)
+
+    if read_mode == READ_DIRECT and hasattr(os, "O_DIRECT"):
+        hash_func = hashlib.new(algorithm)
+        try:
+            _hash_sampled_direct(file_path, offsets, block_size, hash_func)
+            return hash_func.hexdigest()
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            logger.debug(f"O_DIRECT недоступен для {file_path}, чтение с вытеснением страниц")
+        read_mode = READ_DONTNEED
+    if read_mode != READ_CACHED and not hasattr(os, "posix_fadvise"):
+        read_mode = READ_CACHED
+
+    hash_func = hashlib.new(algorithm)
+    view = _get_buffer(max(64 * 1024, block_size))[:block_size]
+    with open(file_path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        if read_mode == READ_DONTNEED:
+            # Как в _hash_dontneed: блоки читаются с диска, а не из кеша страниц
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        for offset in offsets:
+            read = 0
+            while read < block_size:
+                chunk = os.preadv(fd, [view[read:]], offset + read)
+                if not chunk:
+                    raise EOFError(f"Файл {file_path} короче ожидаемого: смещение {offset + read}")
+                read += chunk
+            hash_func.update(offset.to_bytes(8, "little"))
+            hash_func.update(view)
+            if read_mode == READ_DONTNEED:
+                os.posix_fadvise(fd, offset, block_size, os.POSIX_FADV_DONTNEED)
+    return hash_func.hexdigest()
@@ -0,0 +1,361 @@
+"""
+Модуль индексированного поиска ожидаемых хешей файлов пользователя.
+
+База хешей (file_hashes.db) общая для всех пользователей ресурса. Вместо
+загрузки всех её строк в словарь с несколькими вариантами пути на строку
+строится локальный индекс-спутник: каждая строка базы записывается один раз
+под каноническим ключом пути, и по ключу создаётся индекс. Индекс строится
+потоковым чтением базы один раз и перестраивается только при изменении файла
+базы.
+
+Для миграции пользователя из индекса одним диапазонным запросом читаются
+только строки с префиксом его имени, поэтому расход памяти определяется
+количеством файлов одного пользователя, а не всего ресурса.
+
+Канонический ключ: разделители '/', без префикса сетевого пути, без пустых
+сегментов и '.', в нижнем регистре (пути на ресурсе Windows не различают
+регистр), первый сегмент - имя пользователя. Тот же ключ используется при
+проверке целостности, поэтому поиск хеша файла - одно обращение к словарю.
+
+База хешей может быть однократно приведена к каноническому виду
+(migrate_hash_db): в таблицу file_hashes добавляется столбец path_key с
+индексом. Для такой базы индекс-спутник не строится, хеши пользователя
+читаются из неё напрямую.
+
+Классы:
+    - HashIndex: Индекс-спутник базы хешей с выборкой по пользователю.
+    - UserHashes: Ожидаемые хеши файлов одного пользователя.
+
+Функции:
+    - canonical_key: Канонический ключ пути для поиска хеша.
+    - user_prefix: Префикс канонических ключей файлов пользователя.
+    - hash_column: Имя столбца хеша в таблице file_hashes.
+    - migrate_hash_db: Однократное приведение базы хешей к каноническим ключам.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+from src.migration.digest_store import DigestStore, path_key64
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы индекса: при несовпадении индекс строится заново
+_SCHEMA_VERSION = 1
+
+# Построение индекса одной базы не выполняется параллельно в нескольких потоках
+_build_lock = threading.Lock()
+
+# Параметры канонических ключей, записанных в саму базу хешей
+_DB_META_TABLE = "CREATE TABLE IF NOT EXISTS hash_db_meta (key TEXT PRIMARY KEY, value TEXT)"
+
+
+def canonical_key(path, network_prefix=None):
+    """
+    Приводит путь файла к каноническому ключу.
+
+    :param path: Путь из базы хешей или относительный путь файла
+    :param network_prefix: Префикс сетевого пути, отрезаемый перед именем пользователя
+                           (например, //192.168.81.54/share/EXTNAME). Если не указан,
+                           у UNC-пути отрезается //сервер/ресурс.
+    :return: Канонический ключ (например, "vasya/документы/file1.txt")
+    """
+    path = path.replace('\\', '/')
+    if network_prefix:
+        prefix = network_prefix.replace('\\', '/').rstrip('/')
+        if path.casefold().startswith(prefix.casefold() + '/'):
+            path = path[len(prefix):]
+    elif path.startswith('//'):
+        # //сервер/ресурс/... -> ...
+        parts = path[2:].split('/', 2)
+        path = parts[2] if len(parts) == 3 else ''
+    segments = [segment for segment in path.split('/') if segment and segment != '.']
+    return '/'.join(segments).casefold()
+
+
+def user_prefix(username):
+    """
+    :param username: Имя пользователя (доменная часть после '@' отбрасывается)
+    :return: Префикс канонических ключей файлов пользователя ("vasya/")
+    """
+    clean_username = username.split('@')[0] if '@' in username else username
+    return canonical_key(clean_username) + '/'
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def hash_column(conn):
+    """
+    Определяет столбец хеша таблицы file_hashes (в разных версиях базы - hash или current_hash).
+
+    :param conn: Соединение с базой хешей
+    :return: Имя столбца
+    :raises sqlite3.Error: Если таблица отсутствует или в ней нет столбца хеша
+    """
+    columns = _columns(conn, "file_hashes")
+    for column in ("hash", "current_hash"):
+        if column in columns:
+            return column
+    raise sqlite3.OperationalError(f"В таблице file_hashes нет столбца хеша (столбцы: {sorted(columns)})")
+
+
+def migrate_hash_db(db_path, network_prefix=None, batch_size=10000):
+    """
+    Приводит базу хешей к каноническому виду: добавляет в file_hashes столбец
+    path_key с каноническим ключом пути и индекс по нему. Исходный столбец path
+    не изменяется. Повторный запуск заполняет ключи только у новых строк
+    (или у всех, если изменился префикс сетевого пути).
+
+    :param db_path: Путь к базе хешей
+    :param network_prefix: Префикс сетевого пути в базе хешей (см. canonical_key)
+    :param batch_size: Количество строк в одной транзакции
+    :return: Количество строк, у которых записан ключ
+    :raises sqlite3.Error: Таблица file_hashes отсутствует или база недоступна для записи
+    """
+    network_prefix = network_prefix or ""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        hash_column(conn)
+        with conn:
+            if "path_key" not in _columns(conn, "file_hashes"):
+                conn.execute("ALTER TABLE file_hashes ADD COLUMN path_key TEXT")
+            conn.execute(_DB_META_TABLE)
+            stored = dict(conn.execute("SELECT key, value FROM hash_db_meta")).get("network_prefix")
+            # Префикс изменился: ключи всех строк вычисляются заново
+            if stored is not None and stored != network_prefix:
+                conn.execute("UPDATE file_hashes SET path_key = NULL")
+            conn.execute(
+                "INSERT OR REPLACE INTO hash_db_meta (key, value) VALUES ('network_prefix', ?)", (network_prefix,)
+            )
+
+        updated = 0
+        last_rowid = -1
+        while True:
+            # Пакеты по rowid: каждый пакет фиксируется отдельно, прерванную миграцию можно повторить
+            rows = conn.execute(
+                "SELECT rowid, path FROM file_hashes WHERE rowid > ? AND path_key IS NULL ORDER BY rowid LIMIT ?",
+                (last_rowid, max(1, int(batch_size)))
+            ).fetchall()
+            if not rows:
+                break
+            with conn:
+                conn.executemany(
+                    "UPDATE file_hashes SET path_key = ? WHERE rowid = ?",
+                    [(canonical_key(path or "", network_prefix), rowid) for rowid, path in rows]
+                )
+            updated += len(rows)
+            last_rowid = rows[-1][0]
+
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS file_hashes_path_key ON file_hashes (path_key)")
+    finally:
+        conn.close()
+    logger.info(f"База хешей {db_path} приведена к каноническим ключам: обновлено {updated} записей")
+    return updated
+
+
+class UserHashes:
+    """Ожидаемые хеши файлов одного пользователя по каноническим относительным ключам"""
+
+    def __init__(self, username, store=None):
+        """
+        :param username: Имя пользователя
+        :param store: DigestStore с ключами путей относительно профиля
+        """
+        self.username = username
+        self._store = store if store is not None else DigestStore()
+
+    def lookup(self, rel_path):
+        """
+        :param rel_path: Путь файла относительно директории пользователя
+        :return: Ожидаемый хеш или None
+        """
+        return self._store.get(canonical_key(rel_path))
+
+    @property
+    def nbytes(self):
+        """Объём памяти хранилища хешей в байтах."""
+        return self._store.nbytes
+
+    def __len__(self):
+        return len(self._store)
+
+    def __bool__(self):
+        return len(self._store) > 0
+
+
+class HashIndex:
+    """Локальный индекс-спутник базы хешей с каноническими ключами путей"""
+
+    def __init__(self, db_path, index_path, network_prefix=None, batch_size=10000):
+        """
+        :param db_path: Путь к базе хешей (file_hashes.db)
+        :param index_path: Путь к локальному файлу индекса
+        :param network_prefix: Префикс сетевого пути в базе хешей (см. canonical_key)
+        :param batch_size: Количество строк в одной вставке при построении индекса
+        """
+        self.db_path = db_path
+        self.index_path = index_path
+        self.network_prefix = network_prefix or ""
+        self.batch_size = max(1, int(batch_size))
+
+    @classmethod
+    def for_database(cls, db_path, directory, network_prefix=None):
+        """
+        :param db_path: Путь к базе хешей
+        :param directory: Локальная директория для файлов индекса
+        :param network_prefix: Префикс сетевого пути в базе хешей
+        :return: HashIndex базы
+        """
+        key = hashlib.sha1(os.path.abspath(db_path).encode("utf-8", "surrogateescape")).hexdigest()[:16]
+        return cls(db_path, os.path.join(directory, f"hash_index_{key}.db"), network_prefix)
+
+    def _source_meta(self):
+        st = os.stat(self.db_path)
+        return {
+            "db_path": os.path.abspath(self.db_path),
+            "db_size": str(st.st_size),
+            "db_mtime_ns": str(st.st_mtime_ns),
+            "network_prefix": self.network_prefix,
+        }
+
+    def _is_current(self, source_meta):
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            conn = sqlite3.connect(self.index_path, timeout=30)
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                    return False
+                meta = dict(conn.execute("SELECT key, value FROM meta"))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+        return all(meta.get(key) == value for key, value in source_meta.items())
+
+    def ensure(self):
+        """
+        Строит индекс, если его нет или база хешей изменилась после построения.
+
+        :return: True, если индекс был построен заново
+        :raises OSError, sqlite3.Error: База хешей недоступна или повреждена
+        """
+        with _build_lock:
+            source_meta = self._source_meta()
+            if self._is_current(source_meta):
+                return False
+            self._build(source_meta)
+            return True
+
+    def _build(self, source_meta):
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        rows = 0
+        source = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30)
+        index = sqlite3.connect(tmp_path)
+        try:
+            column = hash_column(source)
+            # Файл индекса временный до os.replace, поэтому журнал и сброс на диск не нужны
+            index.execute("PRAGMA journal_mode=OFF")
+            index.execute("PRAGMA synchronous=OFF")
+            index.execute("CREATE TABLE hashes (key TEXT NOT NULL, hash TEXT NOT NULL)")
+            index.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+
+            batch = []
+            # Строки читаются курсором по мере вставки, без fetchall
+            for path, hash_value in source.execute(f"SELECT path, {column} FROM file_hashes"):
+                if not path or not hash_value:
+                    continue
+                key = canonical_key(path, self.network_prefix)
+                if not key:
+                    continue
+                batch.append((key, hash_value))
+                if len(batch) >= self.batch_size:
+                    index.executemany("INSERT INTO hashes (key, hash) VALUES (?, ?)", batch)
+                    rows += len(batch)
+                    batch = []
+            if batch:
+                index.executemany("INSERT INTO hashes (key, hash) VALUES (?, ?)", batch)
+                rows += len(batch)
+
+            # Индекс по ключу создаётся после вставки: одна сортировка вместо вставок в B-дерево
+            index.execute("CREATE INDEX hashes_key ON hashes (key)")
+            index.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", source_meta.items())
+            index.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            index.commit()
+        except BaseException:
+            index.close()
+            os.remove(tmp_path)
+            raise
+        finally:
+            source.close()
+        index.close()
+        os.replace(tmp_path, self.index_path)
+        logger.info(f"Построен индекс хешей {self.index_path}: {rows} записей из {self.db_path}")
+
+    def _canonical_columns(self):
+        """
+        :return: Столбцы (ключ, хеш) самой базы хешей, если она приведена к каноническим
+                 ключам с тем же префиксом (migrate_hash_db), иначе None
+        """
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30)
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "hash_db_meta" not in tables or "path_key" not in _columns(conn, "file_hashes"):
+                return None
+            meta = dict(conn.execute("SELECT key, value FROM hash_db_meta"))
+            if meta.get("network_prefix") != self.network_prefix:
+                return None
+            # Строки, добавленные после приведения, без ключа: такой базе индекс-спутник нужен
+            if conn.execute("SELECT 1 FROM file_hashes WHERE path_key IS NULL LIMIT 1").fetchone():
+                return None
+            return "path_key", hash_column(conn)
+        finally:
+            conn.close()
+
+    def for_user(self, username):
+        """
+        Загружает хеши файлов пользователя (только строки с префиксом его имени)
+        в компактное хранилище DigestStore.
+
+        :param username: Имя пользователя
+        :return: UserHashes
+        """
+        columns = self._canonical_columns()
+        if columns is not None:
+            path, table = self.db_path, "file_hashes"
+        else:
+            self.ensure()
+            path, table, columns = self.index_path, "hashes", ("key", "hash")
+
+        prefix = user_prefix(username)
+        # Диапазон [prefix, prefix с последним '/' -> '0'): все ключи, начинающиеся с prefix
+        upper = prefix[:-1] + chr(ord('/') + 1)
+        key, hash_value = columns
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+        try:
+            conn.create_function("path_key64", 1, path_key64, deterministic=True)
+            # Сортировку по 64-битному ключу выполняет SQLite, строки сразу дописываются
+            # в DigestStore; при одинаковых ключах остаётся последняя строка базы
+            store = DigestStore.from_sorted(conn.execute(
+                f"SELECT path_key64(substr({key}, ?)), {hash_value} FROM {table} "
+                f"WHERE {key} >= ? AND {key} < ? AND {hash_value} IS NOT NULL ORDER BY 1, rowid",
+                (len(prefix) + 1, prefix, upper)
+            ))
+        finally:
+            conn.close()
+        hashes = UserHashes(username, store)
+        logger.info(
+            f"Загружено {len(hashes)} хешей пользователя {username} из {path} "
+            f"({hashes.nbytes / (1024 * 1024):.2f} MB)"
+        )
+        return hashes
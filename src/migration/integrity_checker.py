@@ -4,14 +4,13 @@
 Функции:
     - calculate_file_hash: Вычисление хеша файла с использованием указанного алгоритма.
     - check_integrity: Проверка целостности данных между исходной и целевой директориями.
-    - load_hashes_from_db: Чтение хешей из базы данных и возвращает словарь с различными вариантами путей.
+    - load_hashes_from_db: Чтение хешей из базы данных в словарь с каноническими ключами путей.
     - verify_hash_with_retry: Повторное вычисление хеша с использованием повторных попыток.
     - compare_file_sizes: Сравнение размеров файлов.
     - compare_file_metadata: Сравнение метаданных файлов.
     - check_file_readability: Проверка доступности чтения файлов.
     - retry_copy_file: Повторное копирование файла.
 """
-import hashlib
 import os
 import glob
 import logging
@@ -19,10 +18,22 @@ import shutil
 import time
 import sqlite3
 import fnmatch
+import threading
+import atexit
+import random
 from datetime import datetime
 from src.logging.logger import setup_logger
 from src.config.config_loader import load_config
 from src.notify.notify import send_status
+from src.migration.tree_walker import record_from_stat, stat_record, walk_tree
+from src.migration.scan_manifest import ScanManifest
+from src.migration.hash_index import HashIndex, canonical_key, hash_column
+from src.migration.copy_pipeline import CopyPipeline
+from src.migration.concurrency_controller import DeviceLimiter
+from src.migration.hash_engine import (
+    DEFAULT_HASH_BUFFER_SIZE, READ_CACHED, hash_file, hash_sampled, is_network_path, sample_offsets
+)
+from src.migration.hash_cache import HashCache
 
 # Настройка логгера
 setup_logger()
@@ -30,6 +41,10 @@ logger = logging.getLogger(__name__)
 # Получение конфигурации
 config = load_config()
 
+# Постоянный кеш хешей (создаётся при первом вычислении хеша; False - кеш недоступен)
+_hash_cache = None
+_hash_cache_lock = threading.Lock()
+
 def convert_win_path_to_linux(
     win_path: str,
     network_path: str = None,
@@ -105,88 +120,25 @@ def convert_win_path_to_linux(
     return final_path
 
 
-def generate_path_variants(file_path, username=None):
-    """
-    Генерирует различные варианты путей для поиска хешей.
-    
-    :param file_path: Исходный путь к файлу
-    :param username: Имя пользователя (опционально)
-    :return: Список возможных вариантов путей
+def load_hashes_from_db(db_path, base_path="", network_path_or_username=None, network_path=None):
     """
-    variants = []
-    
-    # Нормализуем путь (заменяем обратные слеши на прямые)
-    normalized_path = file_path.replace('\\', '/')
-    variants.append(normalized_path)
-    
-    # Добавляем вариант с обратными слешами
-    if '/' in normalized_path:
-        variants.append(normalized_path.replace('/', '\\'))
-    
-    # Получаем относительные части пути
-    path_parts = normalized_path.split('/')
-    file_name = path_parts[-1] if path_parts else ""
-    
-    # Очищаем имя пользователя от доменной части, если она есть
-    clean_username = username.split('@')[0] if username and '@' in username else username
-    
-    # Если путь содержит Desktop, добавляем специальные варианты
-    if 'Desktop' in path_parts:
-        try:
-            desktop_index = path_parts.index('Desktop')
-            # Получаем путь относительно Desktop
-            rel_desktop_path = '/'.join(path_parts[desktop_index+1:])
-            
-            if clean_username:
-                variants.append(clean_username + "/Desktop/" + rel_desktop_path)
-                variants.append(clean_username + "\\Desktop\\" + rel_desktop_path.replace('/', '\\'))
-            
-            variants.append("Desktop/" + rel_desktop_path)
-            variants.append("Desktop\\" + rel_desktop_path.replace('/', '\\'))
-        except ValueError:
-            pass  # Desktop не найден в пути или другая ошибка
-    
-    # Если указано имя пользователя, добавляем варианты с ним
-    if clean_username:
-        # Удаляем имя пользователя из пути, если оно уже есть в начале
-        if path_parts and path_parts[0] == clean_username:
-            rel_user_path = '/'.join(path_parts[1:])
-        else:
-            rel_user_path = normalized_path
-        
-        variants.append(clean_username + "/" + rel_user_path)
-        variants.append(clean_username + "\\" + rel_user_path.replace('/', '\\'))
-    
-    # Добавляем вариант с только именем файла 
-    # ВНИМАНИЕ: Этот вариант имеет самый низкий приоритет 
-    # из-за высокого риска коллизий
-    if file_name:
-        # Добавляем имя файла только если оно уникально по некоторым критериям
-        # Например, если длина больше определенного значения или содержит специфические символы
-        if len(file_name) > 10 or '_' in file_name or '-' in file_name:
-            variants.append(file_name)
-    
-    # Удаляем дубликаты, сохраняя порядок
-    unique_variants = []
-    for v in variants:
-        if v and v not in unique_variants:
-            unique_variants.append(v)
-    
-    return unique_variants
-
-
-def load_hashes_from_db(db_path, base_path, network_path_or_username):
-    """
-    Читает хеши из базы данных SQLite и возвращает словарь, где ключи —
-    различные варианты путей к файлам, а значение — хеш.
+    Читает хеши из базы данных SQLite и возвращает словарь с одним ключом на запись:
+    каноническим ключом пути (canonical_key) или, если указан base_path, Linux-путём
+    внутри base_path. Читается вся база; для проверки файлов одного пользователя
+    используется HashIndex.for_user.
     
     :param db_path: Путь к файлу базы SQLite.
     :param base_path: К какому пути в Linux приклеивать результат (или пустая строка).
     :param network_path_or_username: Префикс для отрезания (e.g. //192.168.81.54/share/EXTNAME) 
-                                    или имя пользователя.
-    :return: dict: {"/path/to/file.txt": "hash123", "user/path/to/file.txt": "hash123", ...}
+                                    или имя пользователя (для совместимости, не используется).
+    :param network_path: Префикс сетевого пути для отрезания.
+    :return: dict: {"vasya/документы/file.txt": "hash123", ...}
     """
     hashes = {}
+    if network_path is None and network_path_or_username and \
+            network_path_or_username.replace('\\', '/').startswith('//'):
+        network_path = network_path_or_username
+    
     try:
         logger.info(f"Подключение к базе данных хешей: {db_path}")
         
@@ -197,14 +149,6 @@ def load_hashes_from_db(db_path, base_path, network_path_or_username):
         with sqlite3.connect(db_path) as conn:
             cursor = conn.cursor()
             
-            # Получаем информацию о структуре таблицы
-            try:
-                cursor.execute("PRAGMA table_info(file_hashes)")
-                columns = cursor.fetchall()
-                logger.debug(f"Структура таблицы file_hashes: {columns}")
-            except sqlite3.Error as e:
-                logger.warning(f"Не удалось получить структуру таблицы: {e}")
-            
             # Получаем количество записей
             try:
                 cursor.execute("SELECT COUNT(*) FROM file_hashes")
@@ -214,54 +158,31 @@ def load_hashes_from_db(db_path, base_path, network_path_or_username):
                 logger.warning(f"Не удалось получить количество записей: {e}")
                 return hashes
             
-            # Получаем данные о хешах
-            cursor.execute("SELECT path, hash FROM file_hashes")
-            rows = cursor.fetchall()
+            # Получаем данные о хешах (строки читаются курсором, без fetchall)
+            rows = cursor.execute(f"SELECT path, {hash_column(conn)} FROM file_hashes")
             
-        logger.info(f"Загружено {len(rows)} записей с хешами из базы данных")
-        
-        # Обрабатываем хеши файлов, создавая различные варианты путей для каждого
-        for file_path, hash_value in rows:
-            if not file_path or not hash_value:
-                continue
+            for file_path, hash_value in rows:
+                if not file_path or not hash_value:
+                    continue
                 
-            # Определяем, является ли параметр именем пользователя или сетевым путем
-            username = None
-            if not file_path.startswith('//') and not file_path.startswith('\\\\'):
-                username = network_path_or_username
-                
-            # Генерируем различные варианты путей для поиска
-            path_variants = generate_path_variants(file_path, username)
-            
-            # Добавляем варианты с базовым путем, если он указан
-            if base_path:
-                folder_mapping = {'Documents': 'Документы', 'Downloads': 'Загрузки', 'Pictures': 'Изображения'}
-                desktop_rename = {'Desktop': 'Desktops/Desktop1'}
-                
-                # Преобразованный путь с применением маппингов
-                converted_path = convert_win_path_to_linux(
-                    win_path=file_path,
-                    network_path=network_path_or_username if not username else None,
-                    base_path=base_path,
-                    folder_mapping=folder_mapping,
-                    desktop_rename=desktop_rename,
-                    remove_network_path=True,
-                    apply_base_path=True
-                )
+                if base_path:
+                    # Путь в целевой структуре с применением маппингов папок
+                    key = convert_win_path_to_linux(
+                        win_path=file_path,
+                        network_path=network_path,
+                        base_path=base_path,
+                        folder_mapping={'Documents': 'Документы', 'Downloads': 'Загрузки', 'Pictures': 'Изображения'},
+                        desktop_rename={'Desktop': 'Desktops/Desktop1'},
+                        remove_network_path=True,
+                        apply_base_path=True
+                    )
+                else:
+                    key = canonical_key(file_path, network_path)
                 
-                if converted_path:
-                    path_variants.append(converted_path)
-            
-            # Сохраняем хеш для всех вариантов путей
-            for path in path_variants:
-                hashes[path] = hash_value
-        
-        logger.info(f"Сформировано {len(hashes)} вариантов путей с хешами")
+                if key:
+                    hashes[key] = hash_value
         
-        # Выводим примеры первых нескольких записей для отладки
-        for i, (path, hash_val) in enumerate(list(hashes.items())[:5]):
-            logger.debug(f"Пример {i+1}: Путь: {path}, Хеш: {hash_val}")
-            
+        logger.info(f"Загружено {len(hashes)} записей с хешами из базы данных")
         return hashes
         
     except sqlite3.Error as e:
@@ -274,24 +195,103 @@ def load_hashes_from_db(db_path, base_path, network_path_or_username):
     return hashes
 
 
+def get_hash_cache():
+    """
+    :return: HashCache из директории журналов или None, если кеш отключён или недоступен
+    """
+    global _hash_cache
+    if not config.get("HASH_CACHE_ENABLED", True):
+        return None
+    with _hash_cache_lock:
+        if _hash_cache is None:
+            try:
+                _hash_cache = HashCache(
+                    os.path.join(config.get("JOURNAL_DIRECTORY", "/var/lib/migration-service/journal"), "hash_cache.db"),
+                    max_entries=config.get("HASH_CACHE_MAX_ENTRIES", 2000000)
+                )
+                atexit.register(_hash_cache.close)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Кеш хешей недоступен, хеши будут вычисляться заново: {e}")
+                _hash_cache = False
+        return _hash_cache or None
+
+
 def calculate_file_hash(file_path, algorithm='sha256'):
     """
     Вычисление хеша файла с использованием указанного алгоритма.
+    Чтение крупными блоками в буфер потока (HASH_BUFFER_SIZE), для локальных
+    файлов - при HASH_USE_MMAP через mmap. Хеш файла, размер и mtime которого
+    не изменились с прошлого вычисления, берётся из кеша хешей.
 
     :param file_path: Путь к файлу.
     :param algorithm: Алгоритм хеширования ('sha256', 'md5', и т.д.).
     :return: Хеш файла или None в случае ошибки.
     """
     try:
-        hash_func = hashlib.new(algorithm)
+        cache = get_hash_cache()
+        st = None
+        if cache is not None:
+            st = os.stat(file_path)
+            # Идентичность файлов сетевых ФС (inode) не всегда стабильна, по умолчанию они не кешируются
+            if not config.get("HASH_CACHE_NETWORK", False) and is_network_path(file_path, st.st_dev):
+                st = None
+            else:
+                cached = cache.get(st, algorithm)
+                if cached is not None:
+                    return cached
+
+        digest = hash_file(
+            file_path,
+            (algorithm,),
+            buffer_size=config.get("HASH_BUFFER_SIZE", DEFAULT_HASH_BUFFER_SIZE),
+            use_mmap=config.get("HASH_USE_MMAP", False)
+        )[algorithm]
+
+        if st is not None:
+            # Файл, изменившийся во время чтения, в кеш не попадает
+            after = os.stat(file_path)
+            if (after.st_ino, after.st_size, after.st_mtime_ns) == (st.st_ino, st.st_size, st.st_mtime_ns):
+                cache.put(st, algorithm, digest)
+        return digest
     except ValueError:
         logger.error(f"Неподдерживаемый алгоритм хеширования: {algorithm}")
         return None
+    except FileNotFoundError:
+        logger.error(f"Файл {file_path} не найден.")
+        return None
+    except PermissionError:
+        logger.error(f"Недостаточно прав для доступа к файлу {file_path}.")
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка при вычислении хеша файла {file_path}: {e}")
+        return None
+
 
+def calculate_target_hash(file_path, algorithm='sha256'):
+    """
+    Вычисление хеша только что записанного целевого файла при проверке.
+    Файл читается в режиме VERIFY_READBACK_MODE: 'direct' (O_DIRECT) и 'dontneed'
+    (posix_fadvise) читают данные с диска, а не из кеша страниц, и не вытесняют
+    из кеша данные других процессов; кеш хешей при этом не используется.
+    В режиме 'cache' - то же, что calculate_file_hash.
+
+    :param file_path: Путь к файлу.
+    :param algorithm: Алгоритм хеширования ('sha256', 'md5', и т.д.).
+    :return: Хеш файла или None в случае ошибки.
+    """
+    read_mode = config.get("VERIFY_READBACK_MODE", "direct")
+    if read_mode == READ_CACHED:
+        return calculate_file_hash(file_path, algorithm=algorithm)
     try:
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_func.update(chunk)
+        return hash_file(
+            file_path,
+            (algorithm,),
+            buffer_size=config.get("HASH_BUFFER_SIZE", DEFAULT_HASH_BUFFER_SIZE),
+            read_mode=read_mode
+        )[algorithm]
+    except ValueError as e:
+        logger.error(f"Ошибка параметров проверки файла {file_path}: {e}")
+        return None
     except FileNotFoundError:
         logger.error(f"Файл {file_path} не найден.")
         return None
@@ -301,47 +301,117 @@ def calculate_file_hash(file_path, algorithm='sha256'):
     except Exception as e:
         logger.error(f"Ошибка при вычислении хеша файла {file_path}: {e}")
         return None
-    return hash_func.hexdigest()
 
 
-def compare_file_sizes(source_file, target_file):
+def compare_file_sizes(source_file, target_file, source_record=None, target_record=None):
     """
     Сравнение размера файлов
 
     :param source_file: Исходный файл
     :param target_file: Целевой файл
+    :param source_record: FileRecord исходного файла (если уже известен, stat не выполняется)
+    :param target_record: FileRecord целевого файла (если уже известен, stat не выполняется)
     :return: True, если размер совпадает, иначе False
     """
     try:
-        source_size = os.path.getsize(source_file)
-        target_size = os.path.getsize(target_file)
+        source_size = source_record.size if source_record is not None else os.path.getsize(source_file)
+        target_size = target_record.size if target_record is not None else os.path.getsize(target_file)
         return source_size == target_size
     except Exception as e:
         logger.error(f"Ошибка при сравнении размеров файлов {source_file} и {target_file}: {e}")
         return False
 
 
-def compare_file_metadata(source_file, target_file):
+def compare_file_metadata(source_file, target_file, source_record=None, target_record=None):
     """
     Сравнение метаданных файла
 
     :param source_file: Исходный файл
     :param target_file: Целевой файл
+    :param source_record: FileRecord исходного файла (если уже известен, stat не выполняется)
+    :param target_record: FileRecord целевого файла (если уже известен, stat не выполняется)
     :return: True, если метаданные совпадают, иначе False
     """
     try:
-        source_stat = os.stat(source_file)
-        target_stat = os.stat(target_file)
-        # Сравниваем размер и время модификации
+        if source_record is None:
+            source_record = record_from_stat(source_file, os.path.basename(source_file), os.stat(source_file))
+        if target_record is None:
+            target_record = record_from_stat(target_file, os.path.basename(target_file), os.stat(target_file))
+        # Сравниваем размер и время модификации (с точностью до секунды)
         return (
-            source_stat.st_size == target_stat.st_size and
-            int(source_stat.st_mtime) == int(target_stat.st_mtime)
+            source_record.size == target_record.size and
+            source_record.mtime_ns // 1_000_000_000 == target_record.mtime_ns // 1_000_000_000
         )
     except Exception as e:
         logger.error(f"Ошибка при сравнении метаданных файлов {source_file} и {target_file}: {e}")
         return False
 
 
+def tiered_check(source_file, target_file, source_record=None, target_record=None, expected_hash=None, seed=None,
+                 reference_hash=None, readback=False):
+    """
+    Многоуровневая проверка файла (INTEGRITY_CHECK_METHOD: 'tiered'):
+      1) всегда сравниваются размер и время модификации;
+      2) файлы меньше TIERED_FULL_HASH_THRESHOLD хешируются целиком;
+      3) у крупных файлов сравниваются хеши выбранных блоков: начало, конец и
+         TIERED_SAMPLE_BLOCKS внутренних блоков, выбранных по зерну;
+      4) TIERED_FULL_HASH_PERCENT процентов крупных файлов (случайно) хешируются целиком.
+    Усечение файла обнаруживается на шаге 1, порча данных - на шагах 2-4.
+
+    :param source_file: Исходный файл
+    :param target_file: Целевой файл
+    :param source_record: FileRecord исходного файла (если уже известен)
+    :param target_record: FileRecord целевого файла (если уже известен)
+    :param expected_hash: Хеш из базы данных (используется вместо чтения источника при полном хешировании)
+    :param seed: Зерно выбора блоков (по умолчанию имя и размер файла)
+    :param reference_hash: Хеш данных, вычисленный при копировании (источник повторно не читается)
+    :param readback: Проверка сразу после копирования: целевой файл читается в режиме
+                     VERIFY_READBACK_MODE (с диска, а не из кеша страниц и кеша хешей)
+    :return: (bool, str) - (успех проверки, сообщение об ошибке)
+    """
+    if reference_hash and expected_hash and reference_hash.lower() != expected_hash.lower():
+        return False, f"Хеш скопированных данных не совпадает с базой: ожидается {expected_hash}, получено {reference_hash}"
+    if source_record is None:
+        source_record = record_from_stat(source_file, os.path.basename(source_file), os.stat(source_file))
+    if not compare_file_metadata(source_file, target_file, source_record, target_record):
+        return False, "Несовпадение размера или времени модификации"
+
+    algorithm = config.get("HASH_ALGORITHM", "sha256")
+    size = source_record.size
+    block_size = config.get("TIERED_SAMPLE_BLOCK_SIZE", 1024 * 1024)
+    offsets = None
+    if size >= config.get("TIERED_FULL_HASH_THRESHOLD", 64 * 1024 * 1024) and \
+            random.random() * 100 >= config.get("TIERED_FULL_HASH_PERCENT", 1):
+        if seed is None:
+            seed = os.path.basename(source_file)
+        offsets = sample_offsets(size, block_size, config.get("TIERED_SAMPLE_BLOCKS", 16), f"{seed}:{size}")
+
+    if offsets is None:
+        # Полное хеширование
+        if readback:
+            target_hash = calculate_target_hash(target_file, algorithm=algorithm)
+        else:
+            target_hash = calculate_file_hash(target_file, algorithm=algorithm)
+        reference_hash = reference_hash or expected_hash or calculate_file_hash(source_file, algorithm=algorithm)
+        if target_hash is None or reference_hash is None:
+            return False, "Не удалось вычислить хеш одного из файлов"
+        if target_hash.lower() != reference_hash.lower():
+            return False, f"Несовпадение хешей: ожидается {reference_hash}, получено {target_hash}"
+        return True, None
+
+    try:
+        source_hash = hash_sampled(source_file, offsets, block_size, algorithm)
+        target_hash = hash_sampled(
+            target_file, offsets, block_size, algorithm,
+            read_mode=config.get("VERIFY_READBACK_MODE", "direct") if readback else READ_CACHED
+        )
+    except (OSError, EOFError, ValueError) as e:
+        return False, f"Ошибка чтения выборочных блоков: {e}"
+    if source_hash != target_hash:
+        return False, f"Несовпадение выборочных блоков ({len(offsets)} блоков по {block_size} байт)"
+    return True, None
+
+
 def check_file_readability(file_path):
     """
     Проверяет возможность чтения файла
@@ -438,14 +508,16 @@ def should_exclude_file(file_path, exclude_patterns):
     return False
 
 
-def check_file_integrity(source_file, target_file, expected_hashes=None, file_confidence=None):
+def check_file_integrity(source_file, target_file, expected_hashes=None, relative_path=None, source_record=None, target_record=None):
     """
     Проверяет целостность файла, используя выбранный метод проверки.
     
     :param source_file: Исходный файл
     :param target_file: Целевой файл
-    :param expected_hashes: Словарь с хешами из базы данных (опционально)
-    :param file_confidence: Уровень доверия при поиске по имени файла
+    :param expected_hashes: UserHashes с хешами пользователя из базы данных (опционально)
+    :param relative_path: Путь файла относительно директории пользователя (ключ поиска хеша)
+    :param source_record: FileRecord исходного файла (если уже известен)
+    :param target_record: FileRecord целевого файла (если уже известен)
     :return: (bool, str) - (успех проверки, сообщение об ошибке)
     """
     integrity_check_method = config.get("INTEGRITY_CHECK_METHOD", "size")
@@ -454,33 +526,11 @@ def check_file_integrity(source_file, target_file, expected_hashes=None, file_co
     try:
         # Проверка хешей
         if integrity_check_method == 'hash':
-            # Если предоставлены ожидаемые хеши и пути
-            if expected_hashes:
-                # Получаем варианты путей для поиска в словаре хешей
-                source_filename = os.path.basename(source_file)
-                username = os.path.basename(os.path.dirname(os.path.dirname(source_file)))
-                
-                path_variants = generate_path_variants(source_file, username)
-                
-                # Пытаемся найти хеш в словаре
-                expected_hash = None
-                matched_path = None
-                
-                for path in path_variants:
-                    if path in expected_hashes:
-                        expected_hash = expected_hashes[path]
-                        matched_path = path
-                        break
-                
-                # Если найден хеш по имени файла, проверяем уровень доверия
-                if expected_hash and matched_path == source_filename and (file_confidence or 'low') == 'low':
-                    # Дополнительная проверка: сравниваем размеры файлов
-                    source_size = os.path.getsize(source_file)
-                    target_size = os.path.getsize(target_file)
-                    
-                    if source_size != target_size:
-                        logger.warning(f"Хеш найден только по имени файла, но размеры не совпадают: {source_file} ({source_size} байт) и {target_file} ({target_size} байт)")
-                        return False, "Несовпадение размеров при поиске хеша по имени файла"
+            # Если предоставлены ожидаемые хеши и путь файла
+            if expected_hashes and relative_path:
+                # Один поиск по каноническому ключу пути
+                matched_path = relative_path
+                expected_hash = expected_hashes.lookup(relative_path)
                 
                 if expected_hash:
                     # Вычисляем хеш целевого файла и сравниваем с ожидаемым
@@ -512,9 +562,20 @@ def check_file_integrity(source_file, target_file, expected_hashes=None, file_co
                 logger.error(f"{error_msg} для файла {target_file}")
                 return False, error_msg
                 
+        # Многоуровневая проверка: метаданные, полный или выборочный хеш
+        elif integrity_check_method == 'tiered':
+            expected_hash = expected_hashes.lookup(relative_path) if expected_hashes and relative_path else None
+            ok, error_msg = tiered_check(
+                source_file, target_file, source_record, target_record,
+                expected_hash=expected_hash, seed=relative_path
+            )
+            if not ok:
+                logger.error(f"{error_msg}: {source_file} и {target_file}")
+            return ok, error_msg
+        
         # Проверка по размеру
         elif integrity_check_method == 'size':
-            if compare_file_sizes(source_file, target_file):
+            if compare_file_sizes(source_file, target_file, source_record, target_record):
                 return True, None
             else:
                 error_msg = "Несовпадение размеров файлов"
@@ -523,7 +584,7 @@ def check_file_integrity(source_file, target_file, expected_hashes=None, file_co
         
         # Проверка по метаданным
         elif integrity_check_method == 'metadata':
-            if compare_file_metadata(source_file, target_file):
+            if compare_file_metadata(source_file, target_file, source_record, target_record):
                 return True, None
             else:
                 error_msg = "Несовпадение метаданных файлов"
@@ -545,6 +606,8 @@ def check_integrity(source_dir, target_dir, discrepancies_file='/var/log/discrep
     """
     Проверка целостности файлов путем сравнения хешей из базы данных 
     или непосредственного сравнения хешей исходных и целевых файлов.
+    Файлы проверяются пулом потоков по мере обхода исходной директории,
+    с ограничением числа одновременных проверок на каждом устройстве.
     
     :param source_dir: Исходная директория
     :param target_dir: Целевая директория
@@ -565,57 +628,53 @@ def check_integrity(source_dir, target_dir, discrepancies_file='/var/log/discrep
     logger.info(f"Определено имя пользователя: {username}")
     
     # Загружаем хеши из базы данных, если указан соответствующий метод
-    expected_hashes = {}
-    if integrity_check_method == 'hash' and config.get("DATABASE_PATH"):
+    expected_hashes = None
+    if integrity_check_method in ('hash', 'tiered') and config.get("DATABASE_PATH"):
         db_path = config["DATABASE_PATH"]
         if os.path.exists(db_path):
-            expected_hashes = load_hashes_from_db(db_path, "", username)
+            # Только хеши текущего пользователя, через локальный индекс базы
+            try:
+                expected_hashes = HashIndex.for_database(
+                    db_path,
+                    config.get("JOURNAL_DIRECTORY", "/var/lib/migration-service/journal"),
+                    network_prefix=config.get("HASH_DB_NETWORK_PREFIX")
+                ).for_user(username)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Ошибка при чтении хешей из базы данных {db_path}: {e}")
             
             if expected_hashes:
                 logger.info(f"Успешно загружено {len(expected_hashes)} хешей из базы данных")
             else:
                 logger.warning("Не удалось загрузить хеши из базы данных или она пуста")
     
-    # Формируем список файлов для проверки
-    files_to_check = []
     exclude_dirs, exclude_files = get_exclude_patterns()
     
-    for root, dirs, files in os.walk(source_dir, topdown=True):
-        # Исключаем директории
-        dirs[:] = [d for d in dirs if d not in exclude_dirs]
-        
-        for file in files:
-            # Проверяем, нужно ли исключить файл
-            if should_exclude_file(file, exclude_files):
-                continue
-                
-            # Получаем полный и относительный пути
-            source_file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(source_file_path, source_dir)
-            
-            # Определяем целевой путь (сохраняем оригинальную структуру)
-            target_file_path = os.path.join(target_dir, relative_path)
-            
-            try:
-                file_size = os.path.getsize(source_file_path)
-                files_to_check.append({
-                    'source_path': source_file_path,
-                    'target_path': target_file_path,
-                    'relative_path': relative_path,
-                    'size': file_size
-                })
-            except Exception as e:
-                logger.error(f"Ошибка при получении информации о файле {source_file_path}: {e}")
-    
-    # Обновляем отчет
-    total_files = len(files_to_check)
-    total_size = sum(item['size'] for item in files_to_check)
-    
-    if report_data is not None:
-        report_data['total_files'] = total_files
-        report_data['total_size'] = total_size
-    
-    logger.info(f"Найдено {total_files} файлов для проверки, общий размер: {total_size / (1024*1024):.2f} MB")
+    # Обход через scandir: один stat на файл, результат сохраняется в FileRecord.
+    # Директории, не изменившиеся после копирования, берутся из манифеста сканирования.
+    walk_kwargs = dict(
+        skip_dir=lambda rel_dir, name: name in exclude_dirs,
+        skip_file=lambda rel_dir, name: should_exclude_file(name, exclude_files),
+        on_error=lambda path, e: logger.error(f"Ошибка при получении информации о файле {path}: {e}")
+    )
+    expected_files, expected_size = 0, 0
+    # Манифест только читается: проверка не создаёт манифест, если копирование его не построило
+    manifest = None
+    try:
+        manifest = ScanManifest.existing_for_user(
+            config.get("JOURNAL_DIRECTORY", "/var/lib/migration-service/journal"), username
+        )
+        if manifest is not None and manifest.is_complete(source_dir):
+            # Объём для расчёта прогресса - по последнему полному сканированию (файлы проверяются во время обхода)
+            expected_files, expected_size = manifest.summary()
+        else:
+            manifest = None
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Манифест сканирования недоступен, выполняется полный обход: {e}")
+        manifest = None
+    if manifest is not None:
+        source_records = manifest.cached_walk(source_dir, **walk_kwargs)
+    else:
+        source_records = walk_tree(source_dir, **walk_kwargs)
     
     # Начинаем проверку
     send_status(
@@ -623,80 +682,114 @@ def check_integrity(source_dir, target_dir, discrepancies_file='/var/log/discrep
         status="Начало проверки целостности данных",
         user=report_data.get('username') if report_data else None,
         stage="Проверка целостности",
-        data_volume=f"{total_size / (1024*1024):.2f} MB",
+        data_volume=f"{expected_size / (1024*1024):.2f} MB" if expected_size else "Не определено",
         eta="Рассчитывается..."
     )
     
     # Параметры для расчета прогресса
     verify_start_time = time.time()
-    files_checked = 0
-    verified_size = 0
-    
-    # Проверяем каждый файл
-    for idx, item in enumerate(files_to_check):
-        source_path = item['source_path']
-        target_path = item['target_path']
-        file_size = item['size']
+    progress_interval = config.get("INTEGRITY_PROGRESS_INTERVAL", 5)
+    progress_lock = threading.Lock()
+    counters = {'files_checked': 0, 'verified_size': 0, 'last_status': 0.0}
+    device_limiter = DeviceLimiter(config.get("INTEGRITY_CHECK_PER_DEVICE", 4))
+    
+    def report_progress(file_size, discrepancy=None):
+        """Учитывает проверенный файл; статус отправляется не чаще progress_interval секунд."""
+        with progress_lock:
+            if discrepancy is not None:
+                discrepancies.append(discrepancy)
+            elif report_data is not None:
+                report_data['files_verified'] += 1
+            counters['files_checked'] += 1
+            counters['verified_size'] += file_size
+            now = time.time()
+            if now - counters['last_status'] < progress_interval:
+                return
+            counters['last_status'] = now
+            files_checked = counters['files_checked']
+            verified_size = counters['verified_size']
+        send_progress(files_checked, verified_size, now)
+    
+    def send_progress(files_checked, verified_size, now):
+        """Отправляет статус проверки: количество проверенных файлов, объём и ETA."""
+        total_files = max(expected_files, files_checked)
+        total_size = max(expected_size, verified_size)
+        elapsed_time = now - verify_start_time
+        if elapsed_time > 0 and verified_size > 0:
+            speed = verified_size / elapsed_time
+            eta_seconds = (total_size - verified_size) / speed
+            eta_formatted = time.strftime('%H:%M:%S', time.gmtime(eta_seconds))
+        else:
+            eta_formatted = "Рассчитывается..."
         
-        # Логируем для отладки (только для первых 5 файлов и каждого 100-го)
-        log_detail = idx < 5 or idx % 100 == 0
-        if log_detail:
-            logger.debug(f"Проверка файла [{idx+1}/{total_files}]: {item['relative_path']}")
-            logger.debug(f"  Исходный путь: {source_path}")
-            logger.debug(f"  Целевой путь: {target_path}")
+        send_status(
+            progress=(verified_size / total_size * 100) if total_size else 0,
+            status=f"Проверка целостности: {files_checked}/{total_files} файлов",
+            user=report_data.get('username') if report_data else None,
+            stage="Проверка целостности",
+            data_volume=f"{verified_size/(1024*1024):.2f} MB / {total_size/(1024*1024):.2f} MB",
+            eta=eta_formatted
+        )
+    
+    def verify_worker(record):
+        target_path = os.path.join(target_dir, record.rel_path)
         
-        # Проверяем существование целевого файла
-        if not os.path.exists(target_path):
+        # Проверяем существование целевого файла (stat сохраняем для проверки)
+        target_record = stat_record(target_path, record.rel_path)
+        if target_record is None:
             logger.error(f"Файл не найден в целевой директории: {target_path}")
-            discrepancies.append(f"Файл отсутствует: {target_path}")
-            files_checked += 1
-            verified_size += file_size
-            continue
+            report_progress(record.size, f"Файл отсутствует: {target_path}")
+            return False
         
-        # Выполняем проверку целостности
-        integrity_ok, error_message = check_file_integrity(
-            source_file=source_path, 
-            target_file=target_path,
-            expected_hashes=expected_hashes,
-            file_confidence='low' if os.path.basename(source_path) == item['relative_path'] else 'high'
-        )
+        # Выполняем проверку целостности (не больше INTEGRITY_CHECK_PER_DEVICE файлов на одном устройстве)
+        with device_limiter.hold(record.dev, target_record.dev):
+            integrity_ok, error_message = check_file_integrity(
+                source_file=record.path, 
+                target_file=target_path,
+                expected_hashes=expected_hashes,
+                relative_path=record.rel_path,
+                source_record=record,
+                target_record=target_record
+            )
         
-        # Обрабатываем результат проверки
         if not integrity_ok:
-            discrepancies.append(f"Несовпадение при проверке целостности: {target_path} - {error_message}")
-        else:
-            if report_data is not None:
-                report_data['files_verified'] += 1
-        
-        # Обновляем счетчики
-        files_checked += 1
-        verified_size += file_size
-        
-        # Обновляем статус и прогресс
-        if idx % 10 == 0 or idx >= total_files - 5:
-            progress = (files_checked / total_files) * 100
-            elapsed_time = time.time() - verify_start_time
-            
-            if elapsed_time > 0 and verified_size > 0:
-                speed = verified_size / elapsed_time
-                remaining_size = total_size - verified_size
-                
-                if speed > 0:
-                    eta_seconds = remaining_size / speed
-                    eta_formatted = time.strftime('%H:%M:%S', time.gmtime(eta_seconds))
-                else:
-                    eta_formatted = "Рассчитывается..."
-            else:
-                eta_formatted = "Рассчитывается..."
-            
-            send_status(
-                progress=progress,
-                status=f"Проверка целостности: {files_checked}/{total_files} файлов",
-                user=report_data.get('username') if report_data else None,
-                stage="Проверка целостности",
-                data_volume=f"{verified_size/(1024*1024):.2f} MB / {total_size/(1024*1024):.2f} MB",
-                eta=eta_formatted
-            )
+            report_progress(record.size, f"Несовпадение при проверке целостности: {target_path} - {error_message}")
+            return False
+        report_progress(record.size)
+        return True
+    
+    # Обход и проверка выполняются конвейером: файлы проверяются параллельно по мере обнаружения
+    pipeline = CopyPipeline(
+        lambda: source_records,
+        verify_worker,
+        max_workers=config.get("INTEGRITY_CHECK_WORKERS", 8),
+        queue_size=config.get("SCAN_QUEUE_SIZE", 1000),
+        name=f"verify-{username}"
+    )
+    try:
+        pipeline.run()
+    except OSError as e:
+        # Недоступный корень источника - несоответствие, а не аварийное завершение проверки
+        logger.error(f"Не удалось прочитать исходную директорию {source_dir}: {e}")
+        discrepancies.append(f"Исходная директория недоступна: {source_dir} - {e}")
+    if _hash_cache:
+        _hash_cache.flush()
+    
+    files_checked = counters['files_checked']
+    verified_size = counters['verified_size']
+    # Статус в report_progress прореживается: итоговые значения отправляются отдельно
+    send_progress(files_checked, verified_size, time.time())
+    if report_data is not None:
+        report_data['total_files'] = files_checked
+        report_data['total_size'] = verified_size
+    
+    elapsed_time = time.time() - verify_start_time
+    logger.info(
+        f"Проверено {files_checked} файлов, {verified_size / (1024*1024):.2f} MB за {elapsed_time:.1f} с "
+        f"({verified_size / (1024*1024) / max(elapsed_time, 0.001):.2f} MB/с)"
+    )
+    # Порядок проверки зависит от рабочих потоков: несоответствия сортируются для стабильного отчёта
+    discrepancies.sort()
     
     # Обрабатываем результаты проверки
     if discrepancies:
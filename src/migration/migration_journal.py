@@ -0,0 +1,211 @@
+"""
+Модуль журнала миграции файлов пользователя.
+
+Каждый скопированный и проверенный файл записывается в журнал сразу после
+проверки, а не одним JSON-файлом после завершения всего копирования: при
+аварийном завершении процесса теряется не больше одного пакета записей.
+
+Журнал - база SQLite в режиме WAL (запись только дописыванием в WAL-файл).
+Записи из рабочих потоков копирования передаются через очередь одному потоку
+записи, который фиксирует их пакетами (по количеству или по времени); каждая
+фиксация сбрасывается на диск (synchronous=FULL). Чтение журнала при
+возобновлении миграции - один индексированный SELECT, без загрузки всех
+записей в словарь.
+
+Классы:
+    - MigrationJournal: Журнал скопированных файлов пользователя с пакетной записью.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source      TEXT PRIMARY KEY,
+    target      TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER,
+    verified    INTEGER NOT NULL,
+    timestamp   REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+# Маркеры управления потоком записи
+_FLUSH = object()
+_CLOSE = object()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+
+class MigrationJournal:
+    """Журнал скопированных файлов (SQLite WAL) с пакетной записью в отдельном потоке"""
+
+    def __init__(self, path, batch_size=500, flush_interval=1.0, queue_size=10000):
+        """
+        :param path: Путь к файлу базы журнала
+        :param batch_size: Максимальное количество записей в одной транзакции
+        :param flush_interval: Максимальное время (с) между поступлением записи и её фиксацией
+        :param queue_size: Максимальное количество записей, ожидающих фиксации
+        """
+        self.path = path
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._closed = False
+        self.error = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _connect(path) as conn:
+            conn.execute(_SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name="migration-journal", daemon=True)
+        self._writer.start()
+
+    def record(self, source, target, size, mtime_ns=None, verified=True):
+        """
+        Добавляет запись о файле. Запись фиксируется на диске в течение flush_interval.
+
+        :param source: Исходный файл
+        :param target: Целевой файл
+        :param size: Размер файла в байтах
+        :param mtime_ns: Время модификации исходного файла в наносекундах
+        :param verified: Прошёл ли файл проверку целостности
+        """
+        if self._closed:
+            raise RuntimeError(f"Журнал миграции {self.path} закрыт")
+        self._queue.put((source, target, size, mtime_ns, 1 if verified else 0, time.time()))
+
+    def flush(self, timeout=None):
+        """
+        Ожидает фиксации всех ранее добавленных записей.
+
+        :return: True, если записи зафиксированы без ошибок
+        """
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout) and self.error is None
+
+    def close(self):
+        """Фиксирует оставшиеся записи и останавливает поток записи."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_CLOSE, None))
+        self._writer.join()
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        batch = []
+        waiters = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                stop = False
+                if item is not None:
+                    if item[0] is _FLUSH:
+                        waiters.append(item[1])
+                    elif item[0] is _CLOSE:
+                        stop = True
+                    else:
+                        batch.append(item)
+                        if deadline is None:
+                            deadline = time.monotonic() + self.flush_interval
+
+                if batch and (len(batch) >= self.batch_size or waiters or stop or item is None):
+                    self._commit(conn, batch)
+                    batch = []
+                    deadline = None
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (source, target, size, mtime_ns, verified, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+            logger.debug(f"Журнал миграции {self.path}: зафиксировано {len(batch)} записей")
+        except sqlite3.Error as e:
+            # Поток записи не останавливаем: следующие пакеты могут записаться
+            self.error = e
+            logger.error(f"Ошибка записи журнала миграции {self.path}: {e}")
+
+    def summary(self):
+        """
+        :return: (количество проверенных файлов, их суммарный размер в байтах)
+        """
+        conn = _connect(self.path)
+        try:
+            files, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files WHERE verified = 1"
+            ).fetchone()
+        finally:
+            conn.close()
+        return files, size
+
+    def entries(self, verified_only=False):
+        """
+        Построчно читает записи журнала.
+
+        :param verified_only: Только файлы, прошедшие проверку целостности
+        :return: Генератор кортежей (source, target, size, mtime_ns, verified)
+        """
+        conn = _connect(self.path)
+        try:
+            query = "SELECT source, target, size, mtime_ns, verified FROM files"
+            if verified_only:
+                query += " WHERE verified = 1"
+            for row in conn.execute(query):
+                yield row
+        finally:
+            conn.close()
+
+    def import_entries(self, state):
+        """
+        Переносит записи из словаря прежнего формата {source: {target_file, size, timestamp, verified}}.
+
+        :param state: Словарь состояния миграции
+        :return: Количество перенесённых записей
+        """
+        rows = [
+            (source, info.get('target_file', ''), info.get('size', 0), None,
+             1 if info.get('verified', False) else 0, info.get('timestamp', time.time()))
+            for source, info in state.items()
+        ]
+        conn = _connect(self.path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO files (source, target, size, mtime_ns, verified, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+        finally:
+            conn.close()
+        return len(rows)
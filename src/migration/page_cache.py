@@ -0,0 +1,91 @@
+"""
+Модуль подсказок ядру о работе с кешем страниц (posix_fadvise).
+
+Данные миграции читаются и записываются один раз, поэтому без подсказок они
+заполняют кеш страниц и вытесняют из него данные других процессов (например,
+сеанса пользователя, работающего параллельно с миграцией). Источник
+читается с SEQUENTIAL (увеличенное упреждающее чтение) и WILLNEED для начала
+файла, проверенные файлы вытесняются из кеша с DONTNEED. Для следующего
+файла в очереди можно заранее запустить упреждающее чтение, пока копируется
+текущий.
+
+Все функции - только подсказки: на системах без posix_fadvise и при ошибках
+они ничего не делают.
+
+Функции:
+    - advise_source: Подсказки для файла, который будет прочитан последовательно.
+    - prefetch_file: Запускает упреждающее чтение начала файла.
+    - drop_file_cache: Вытесняет страницы файла из кеша.
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+_HAS_FADVISE = hasattr(os, "posix_fadvise")
+
+
+def advise_source(fd, readahead=0, offset=0):
+    """
+    Сообщает ядру, что файл будет прочитан последовательно начиная с offset.
+
+    :param fd: Дескриптор открытого файла
+    :param readahead: Объём в байтах от offset для немедленного упреждающего чтения (WILLNEED)
+    :param offset: Смещение, с которого начнётся чтение
+    """
+    if not _HAS_FADVISE:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if readahead > 0:
+            os.posix_fadvise(fd, offset, readahead, os.POSIX_FADV_WILLNEED)
+    except OSError as e:
+        logger.debug(f"posix_fadvise для дескриптора {fd} не выполнен: {e}")
+
+
+def prefetch_file(path, readahead):
+    """
+    Запускает упреждающее чтение начала файла (WILLNEED выполняется ядром асинхронно).
+
+    :param path: Путь к файлу
+    :param readahead: Объём начала файла в байтах
+    """
+    if not _HAS_FADVISE or readahead <= 0:
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    except OSError as e:
+        logger.debug(f"Упреждающее чтение {path} не выполнено: {e}")
+        return
+    try:
+        os.posix_fadvise(fd, 0, readahead, os.POSIX_FADV_WILLNEED)
+    except OSError as e:
+        logger.debug(f"Упреждающее чтение {path} не выполнено: {e}")
+    finally:
+        os.close(fd)
+
+
+def drop_file_cache(path, sync=False):
+    """
+    Вытесняет страницы файла из кеша. Грязные (ещё не записанные) страницы
+    ядро не вытесняет, поэтому при sync=True данные сначала записываются на диск.
+
+    :param path: Путь к файлу
+    :param sync: Выполнить fdatasync перед вытеснением
+    """
+    if not _HAS_FADVISE:
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_CLOEXEC", 0))
+    except OSError as e:
+        logger.debug(f"Вытеснение {path} из кеша страниц не выполнено: {e}")
+        return
+    try:
+        if sync:
+            os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        logger.debug(f"Вытеснение {path} из кеша страниц не выполнено: {e}")
+    finally:
+        os.close(fd)
@@ -0,0 +1,178 @@
+"""
+Модуль продолжения прерванного копирования крупных файлов.
+
+Для каждого крупного файла, копирование которого ещё не завершено, ведётся
+журнал: параметры источника (размер, mtime), размер блока, смещение, до
+которого начало целевого файла записано, сброшено на диск и хешировано, и хеш
+этого начала (контрольная точка). После перезапуска миграции начало целевого
+файла заново хешируется локально, и если хеш совпал с контрольной точкой,
+копирование продолжается со смещения контрольной точки, а не с нуля.
+
+Состояние хеш-функции нельзя сохранить в файл, поэтому при продолжении оно
+восстанавливается чтением локального начала файла: это на порядок быстрее,
+чем повторное чтение тех же данных по сети.
+
+Классы:
+    - PartialCopyJournal: Журнал незавершённых копирований (JSON-файл на каждый целевой файл).
+
+Функции:
+    - resumable_copy: Параллельное копирование крупного файла с контрольными точками и продолжением.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+
+from src.migration.copy_engine import get_thread_buffer, parallel_copy
+from src.migration.state_tracker import safe_read_json, safe_write_json
+
+logger = logging.getLogger(__name__)
+
+
+class PartialCopyJournal:
+    """Журнал незавершённых копирований крупных файлов"""
+
+    def __init__(self, directory):
+        """
+        :param directory: Локальная директория для файлов журнала
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, target_file):
+        key = hashlib.sha1(os.path.abspath(target_file).encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def exists(self, target_file):
+        """Есть ли незавершённое копирование в target_file."""
+        return os.path.exists(self._path(target_file))
+
+    def load(self, target_file):
+        """
+        :return: Запись журнала для target_file или None
+        """
+        try:
+            entry = safe_read_json(self._path(target_file))
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать журнал копирования {target_file}: {e}")
+            return None
+        if not entry or entry.get("target") != os.path.abspath(target_file):
+            return None
+        return entry
+
+    def save(self, entry):
+        """Сохраняет запись журнала; более старая контрольная точка не перезаписывает новую."""
+        path = self._path(entry["target"])
+        with self._lock:
+            current = safe_read_json(path)
+            if current and current.get("started") == entry.get("started") and \
+                    current.get("offset", 0) > entry.get("offset", 0):
+                return True
+            return safe_write_json(path, entry, use_lock=False)
+
+    def remove(self, target_file):
+        """Удаляет запись журнала после успешного копирования."""
+        try:
+            os.remove(self._path(target_file))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Не удалось удалить журнал копирования {target_file}: {e}")
+
+
+def _hash_prefix(path, length, algorithm, buffer_size=1024 * 1024):
+    """Хеширует первые length байт локального файла. None, если файл короче."""
+    hash_func = hashlib.new(algorithm)
+    view = get_thread_buffer(buffer_size)
+    remaining = length
+    with open(path, "rb", buffering=0) as f:
+        while remaining > 0:
+            read = f.readinto(view[:min(len(view), remaining)])
+            if not read:
+                return None
+            hash_func.update(view[:read])
+            remaining -= read
+    return hash_func
+
+
+def resumable_copy(source_file, target_file, source_record, journal, algorithm="sha256", streams=4,
+                   chunk_size=8 * 1024 * 1024, checkpoint_interval=256 * 1024 * 1024, readahead=None,
+                   budget=None):
+    """
+    Копирует крупный файл через parallel_copy, сохраняя контрольные точки в журнал,
+    и продолжает ранее прерванное копирование того же файла.
+
+    :param source_file: Исходный файл
+    :param target_file: Целевой файл
+    :param source_record: FileRecord исходного файла
+    :param journal: PartialCopyJournal
+    :param algorithm: Алгоритм хеширования (хеш ведётся всегда: он нужен для контрольных точек)
+    :param streams: Количество потоков чтения
+    :param chunk_size: Размер блока в байтах
+    :param checkpoint_interval: Интервал контрольных точек в байтах
+    :param readahead: Подсказки ядру для источника (см. parallel_copy)
+    :param budget: Общий лимит потоков и памяти блоков (см. parallel_copy)
+    :return: (hexdigest всего файла, количество скопированных байт, смещение продолжения)
+    :raises OSError: Ошибки чтения источника или записи в целевой файл
+    """
+    target_file = os.path.abspath(target_file)
+    start_offset = 0
+    hash_func = None
+
+    entry = journal.load(target_file)
+    if entry is not None:
+        offset = entry.get("offset", 0)
+        same_source = (
+            entry.get("source") == source_file
+            and entry.get("size") == source_record.size
+            and entry.get("mtime_ns") == source_record.mtime_ns
+            and entry.get("chunk_size") == chunk_size
+            and entry.get("algorithm") == algorithm
+        )
+        if same_source and offset > 0 and os.path.exists(target_file):
+            prefix_hash = _hash_prefix(target_file, offset, algorithm)
+            if prefix_hash is not None and prefix_hash.hexdigest() == entry.get("checkpoint_hash"):
+                start_offset, hash_func = offset, prefix_hash
+                logger.info(
+                    f"Продолжение копирования {source_file} со смещения "
+                    f"{offset / (1024 * 1024):.2f} MB из {source_record.size / (1024 * 1024):.2f} MB"
+                )
+            else:
+                logger.warning(f"Контрольная точка {target_file} не совпала, копирование начинается заново")
+        elif not same_source:
+            logger.info(f"Исходный файл {source_file} изменился после прерывания, копирование начинается заново")
+
+    if hash_func is None:
+        hash_func = hashlib.new(algorithm)
+
+    base_entry = {
+        "source": source_file,
+        "target": target_file,
+        "size": source_record.size,
+        "mtime_ns": source_record.mtime_ns,
+        "chunk_size": chunk_size,
+        "algorithm": algorithm,
+        # Идентификатор попытки: контрольные точки прошлых попыток не смешиваются с текущими
+        "started": entry["started"] if start_offset else os.urandom(8).hex(),
+    }
+
+    def checkpoint(offset, hash_copy):
+        journal.save(dict(base_entry, offset=offset, checkpoint_hash=hash_copy.hexdigest()))
+
+    # Запись до начала копирования: прерванный файл будет опознан даже без контрольных точек
+    checkpoint(start_offset, hash_func.copy())
+
+    digest, copied = parallel_copy(
+        source_file, target_file,
+        streams=streams,
+        chunk_size=chunk_size,
+        start_offset=start_offset,
+        hash_func=hash_func,
+        on_checkpoint=checkpoint,
+        checkpoint_interval=checkpoint_interval,
+        readahead=readahead,
+        budget=budget
+    )
+    journal.remove(target_file)
+    return digest, copied, start_offset
@@ -0,0 +1,375 @@
+"""
+Модуль манифеста сканирования исходной директории.
+
+Во время сканирования каждый найденный файл (FileRecord и путь назначения) и
+каждая директория (mtime и список поддиректорий) записываются в локальную базу
+SQLite. После полного обхода манифест помечается завершённым.
+
+Манифест используется повторно:
+    - при возобновлении прерванной миграции манифест сравнивается с журналом
+      миграции одним SQL-запросом, и копируются только файлы, которых нет в
+      журнале или которые не прошли проверку;
+    - при повторном запуске и проверке целостности обход дерева заново читает
+      только директории, mtime которых изменился; для остальных список файлов
+      берётся из манифеста. Изменение содержимого файла «на месте» mtime
+      директории не меняет, поэтому каждый файл из манифеста всё равно
+      проверяется stat: экономится только чтение директорий.
+
+Классы:
+    - ScanManifest: Манифест сканирования пользователя.
+    - ManifestScan: Запись нового манифеста во время сканирования с использованием предыдущего.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import stat
+import time
+
+from src.migration.tree_walker import FileRecord, record_from_stat, walk_tree
+
+logger = logging.getLogger(__name__)
+
+# Версия схемы: при несовпадении манифест строится заново
+_SCHEMA_VERSION = 2
+
+_FILES_TABLE = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        source      TEXT PRIMARY KEY,
+        rel_dir     TEXT NOT NULL,
+        rel_path    TEXT NOT NULL,
+        dest        TEXT NOT NULL,
+        size        INTEGER NOT NULL,
+        mtime_ns    INTEGER NOT NULL,
+        mode        INTEGER NOT NULL,
+        inode       INTEGER NOT NULL,
+        dev         INTEGER NOT NULL
+    ) WITHOUT ROWID
+"""
+_FILES_INDEX = "CREATE INDEX IF NOT EXISTS {name}_rel_dir ON {name} (rel_dir)"
+_DIRS_TABLE = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        rel_dir     TEXT PRIMARY KEY,
+        mtime_ns    INTEGER NOT NULL,
+        subdirs     TEXT NOT NULL
+    ) WITHOUT ROWID
+"""
+_META_TABLE = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+
+# Файлы манифеста, которых нет в журнале, не прошедшие проверку или изменившиеся
+# (записи журнала без mtime перенесены из прежнего формата и считаются актуальными)
+_PENDING_WHERE = """
+    FROM files AS m LEFT JOIN journal.files AS j ON j.source = m.source
+    WHERE j.source IS NULL OR j.verified = 0 OR (j.mtime_ns IS NOT NULL AND j.mtime_ns != m.mtime_ns)
+"""
+
+
+def _create_tables(conn, files="files", dirs="dirs"):
+    conn.execute(_FILES_TABLE.format(name=files))
+    conn.execute(_FILES_INDEX.format(name=files))
+    conn.execute(_DIRS_TABLE.format(name=dirs))
+
+
+class _DirCache:
+    """Кеш директорий для walk_tree поверх таблиц манифеста"""
+
+    def __init__(self, conn, files_table, dirs_table):
+        self.conn = conn
+        self.files_table = files_table
+        self.dirs_table = dirs_table
+        self.reused = 0
+        self.rescanned = 0
+
+    def lookup(self, rel_dir, mtime_ns, on_error=None):
+        try:
+            row = self.conn.execute(
+                f"SELECT mtime_ns, subdirs FROM {self.dirs_table} WHERE rel_dir = ?", (rel_dir,)
+            ).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                rows = self.conn.execute(
+                    f"SELECT source, rel_path FROM {self.files_table} WHERE rel_dir = ?", (rel_dir,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            # Манифест недоступен: директория читается заново
+            logger.warning(f"Ошибка чтения манифеста сканирования для {rel_dir or '.'}: {e}")
+            row = None
+        if row is None or row[0] != mtime_ns:
+            self.rescanned += 1
+            return None
+
+        records = []
+        for source, rel_path in rows:
+            # Файлы меняются на месте, не меняя mtime директории: размер и mtime только из stat
+            try:
+                st = os.stat(source)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                # Как при чтении директории: ошибка файла передаётся обходу, файл пропускается
+                if on_error is not None:
+                    on_error(source, e)
+                else:
+                    logger.warning(f"Ошибка при обходе {source}: {e}")
+                continue
+            if stat.S_ISREG(st.st_mode):
+                records.append(record_from_stat(source, rel_path, st))
+        self.reused += 1
+        return json.loads(row[1]), records
+
+    def store(self, rel_dir, mtime_ns, subdirs):
+        # Кеш только для чтения: манифест при обходе не изменяется
+        pass
+
+
+class ScanManifest:
+    """Манифест сканирования: список файлов и директорий источника с результатами stat"""
+
+    def __init__(self, path):
+        """
+        :param path: Путь к файлу базы манифеста
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                    for table in ("files", "dirs", "prev_files", "prev_dirs", "meta"):
+                        conn.execute(f"DROP TABLE IF EXISTS {table}")
+                    conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+                _create_tables(conn)
+                conn.execute(_META_TABLE)
+        finally:
+            conn.close()
+
+    @classmethod
+    def for_user(cls, directory, username):
+        """
+        :param directory: Директория журналов миграции
+        :param username: Имя пользователя
+        :return: ScanManifest пользователя
+        """
+        return cls(os.path.join(directory, f"scan_manifest_{username}.db"))
+
+    @classmethod
+    def existing_for_user(cls, directory, username):
+        """
+        :param directory: Директория журналов миграции
+        :param username: Имя пользователя
+        :return: ScanManifest пользователя или None, если манифест ещё не создавался
+        """
+        path = os.path.join(directory, f"scan_manifest_{username}.db")
+        return cls(path) if os.path.exists(path) else None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Манифест можно построить заново, поэтому сброс на диск при каждой фиксации не нужен
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _meta(self, conn):
+        return dict(conn.execute("SELECT key, value FROM meta"))
+
+    @staticmethod
+    def _meta_matches(meta, source_dir, target_dir=None, filters=None, max_age=None):
+        if meta.get("source_dir") != source_dir or "completed" not in meta:
+            return False
+        if target_dir is not None and meta.get("target_dir") != target_dir:
+            return False
+        if filters is not None and meta.get("filters", "") != filters:
+            return False
+        if max_age is not None and time.time() - float(meta["completed"]) > max_age:
+            return False
+        return True
+
+    def begin_scan(self, source_dir, target_dir, filters="", reuse=True):
+        """
+        Подготавливает запись нового манифеста.
+
+        :param source_dir: Исходная директория
+        :param target_dir: Целевая директория
+        :param filters: Строка с параметрами исключений: манифест с другими исключениями не используется
+        :param reuse: Использовать предыдущий завершённый манифест для неизменённых директорий
+        :return: ManifestScan
+        """
+        return ManifestScan(self, source_dir, target_dir, filters, reuse)
+
+    def is_complete(self, source_dir, target_dir=None, max_age=None, filters=None):
+        """
+        Проверяет, что манифест построен полным обходом тех же директорий.
+
+        :param source_dir: Исходная директория
+        :param target_dir: Целевая директория (None - не проверяется)
+        :param max_age: Максимальный возраст манифеста в секундах (None - без ограничения)
+        :param filters: Параметры исключений (None - не проверяются)
+        :return: True, если манифест можно использовать вместо повторного сканирования
+        """
+        conn = self._connect()
+        try:
+            meta = self._meta(conn)
+        finally:
+            conn.close()
+        return self._meta_matches(meta, source_dir, target_dir, filters, max_age)
+
+    def cached_walk(self, source_dir, **walk_kwargs):
+        """
+        Обходит source_dir через walk_tree, используя манифест для неизменённых директорий.
+        Если манифест построен не для source_dir, не завершён или не читается, выполняется
+        обычный обход. Манифест при этом не изменяется.
+
+        :param source_dir: Исходная директория
+        :param walk_kwargs: skip_dir, skip_file, on_error для walk_tree
+        :return: Генератор FileRecord
+        """
+        conn = dir_cache = None
+        try:
+            conn = self._connect()
+            if self._meta_matches(self._meta(conn), source_dir):
+                dir_cache = _DirCache(conn, "files", "dirs")
+        except sqlite3.Error as e:
+            logger.warning(f"Манифест сканирования {self.path} недоступен, выполняется полный обход: {e}")
+        try:
+            yield from walk_tree(source_dir, dir_cache=dir_cache, **walk_kwargs)
+            if dir_cache is not None:
+                logger.info(
+                    f"Обход {source_dir} по манифесту: из манифеста {dir_cache.reused} директорий, "
+                    f"прочитано заново {dir_cache.rescanned}"
+                )
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def summary(self):
+        """
+        :return: (количество файлов, суммарный размер в байтах)
+        """
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+        finally:
+            conn.close()
+
+    def pending_summary(self, journal_path):
+        """
+        :param journal_path: Путь к базе журнала миграции
+        :return: (количество файлов, которые ещё нужно скопировать, их суммарный размер)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("ATTACH DATABASE ? AS journal", (journal_path,))
+            return conn.execute(f"SELECT COUNT(*), COALESCE(SUM(m.size), 0) {_PENDING_WHERE}").fetchone()
+        finally:
+            conn.close()
+
+    def pending(self, journal_path):
+        """
+        Построчно выдаёт файлы манифеста, которые ещё нужно скопировать.
+
+        :param journal_path: Путь к базе журнала миграции
+        :return: Генератор кортежей (FileRecord, dest_file)
+        """
+        conn = self._connect()
+        try:
+            conn.execute("ATTACH DATABASE ? AS journal", (journal_path,))
+            rows = conn.execute(
+                "SELECT m.source, m.rel_path, m.size, m.mtime_ns, m.mode, m.inode, m.dev, m.dest "
+                f"{_PENDING_WHERE}"
+            )
+            for source, rel_path, size, mtime_ns, mode, inode, dev, dest in rows:
+                yield FileRecord(source, rel_path, size, mtime_ns, mode, inode, dev), dest
+        finally:
+            conn.close()
+
+
+class ManifestScan:
+    """Запись манифеста во время сканирования; предыдущий манифест служит кешем директорий"""
+
+    def __init__(self, manifest, source_dir, target_dir, filters="", reuse=True):
+        self.manifest = manifest
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.filters = filters
+        self.reuse = reuse
+        self._cache = None
+        self._dirs_batch = []
+
+    def lookup(self, rel_dir, mtime_ns, on_error=None):
+        """Кеш директорий для walk_tree (доступен только внутри record)."""
+        return self._cache.lookup(rel_dir, mtime_ns, on_error) if self._cache is not None else None
+
+    def store(self, rel_dir, mtime_ns, subdirs):
+        self._dirs_batch.append((rel_dir, mtime_ns, json.dumps(subdirs, ensure_ascii=False)))
+
+    def record(self, items, batch_size=1000):
+        """
+        Пропускает через себя поток (FileRecord, dest_file) от сканера и записывает его
+        в манифест пакетами. Манифест помечается завершённым, только если поток
+        исчерпан полностью. Вызывается в потоке сканера: в нём же выполняются lookup/store.
+
+        :param items: Итератор кортежей (FileRecord, dest_file), построенный walk_tree(dir_cache=self)
+        :param batch_size: Количество записей в одной транзакции
+        :return: Генератор тех же кортежей
+        """
+        conn = self.manifest._connect()
+        batch = []
+
+        def commit():
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+                conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", self._dirs_batch)
+            batch.clear()
+            self._dirs_batch.clear()
+
+        try:
+            previous = self.manifest._meta(conn)
+            reuse = self.reuse and self.manifest._meta_matches(
+                previous, self.source_dir, self.target_dir, self.filters
+            )
+
+            # Текущий манифест становится предыдущим (кешем), новый пишется с нуля
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS prev_files")
+                conn.execute("DROP TABLE IF EXISTS prev_dirs")
+                if reuse:
+                    conn.execute("DROP INDEX IF EXISTS files_rel_dir")
+                    conn.execute("ALTER TABLE files RENAME TO prev_files")
+                    conn.execute("ALTER TABLE dirs RENAME TO prev_dirs")
+                    conn.execute(_FILES_INDEX.format(name="prev_files"))
+                else:
+                    conn.execute("DELETE FROM files")
+                    conn.execute("DELETE FROM dirs")
+                _create_tables(conn)
+                conn.execute("DELETE FROM meta")
+                conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                    ("source_dir", self.source_dir),
+                    ("target_dir", self.target_dir),
+                    ("filters", self.filters),
+                    ("started", str(time.time())),
+                ])
+            if reuse:
+                self._cache = _DirCache(conn, "prev_files", "prev_dirs")
+
+            for record, dest_file in items:
+                batch.append((record.path, os.path.dirname(record.rel_path), record.rel_path, dest_file,
+                              record.size, record.mtime_ns, record.mode, record.inode, record.dev))
+                if len(batch) >= batch_size:
+                    commit()
+                yield record, dest_file
+
+            commit()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('completed', ?)", (str(time.time()),))
+                conn.execute("DROP TABLE IF EXISTS prev_files")
+                conn.execute("DROP TABLE IF EXISTS prev_dirs")
+
+            if self._cache is not None:
+                logger.info(
+                    f"Сканирование {self.source_dir}: из манифеста {self._cache.reused} директорий, "
+                    f"прочитано заново {self._cache.rescanned}"
+                )
+            logger.info(f"Манифест сканирования {self.source_dir} сохранён в {self.manifest.path}")
+        finally:
+            self._cache = None
+            conn.close()
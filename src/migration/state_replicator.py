@@ -0,0 +1,202 @@
+"""
+Модуль асинхронной репликации состояния миграции на сетевое хранилище.
+
+Состояние сначала сохраняется локально, затем снимок передаётся репликатору.
+Репликатор хранит только последний снимок (более ранние, ещё не отправленные,
+заменяются) и записывает его на сетевое хранилище в своём потоке. При ошибке
+запись повторяется с экспоненциально растущей паузой, поэтому медленное или
+временно недоступное хранилище не задерживает ни рабочие потоки, ни
+локальное сохранение.
+
+Перед отмонтированием сетевого хранилища отправка приостанавливается (pause):
+после этого репликатор не пишет на хранилище, даже при закрытии, иначе
+запись попала бы в пустую точку монтирования на локальном диске.
+
+Каждый снимок содержит номер версии ("version"): по нему читатель выбирает
+более свежую из локальной и сетевой копий, а репликатор не отправляет
+снимок старше уже отправленного.
+
+Классы:
+    - StateReplicator: Фоновая отправка последнего снимка состояния с повторами.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StateReplicator:
+    """Поток, отправляющий последнюю версию состояния на сетевое хранилище"""
+
+    def __init__(self, save, min_backoff=1.0, max_backoff=60.0, name="state-replicator", clock=time.monotonic):
+        """
+        :param save: Функция (state) записи снимка на сетевое хранилище, возвращает True при успехе
+        :param min_backoff: Пауза после первой неудачной записи в секундах
+        :param max_backoff: Максимальная пауза между повторами в секундах
+        :param name: Имя репликатора (для логов и имени потока)
+        :param clock: Источник времени (для тестов)
+        """
+        self.save = save
+        self.min_backoff = max(0.0, float(min_backoff))
+        self.max_backoff = max(self.min_backoff, float(max_backoff))
+        self.name = name
+        self.clock = clock
+
+        self.pushed = 0
+        self.failures = 0
+        self.replaced = 0
+        self.pushed_version = None
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._backoff = 0.0
+        self._retry_at = None
+        self._closed = False
+        self._paused = False
+        self._pushing = False
+        self._thread = None
+
+    def submit(self, snapshot):
+        """
+        Передаёт снимок для отправки (не ждёт записи).
+
+        :param snapshot: Словарь состояния с ключом "version"; не изменяется после передачи
+        """
+        version = snapshot.get("version", 0)
+        with self._cond:
+            if self.pushed_version is not None and version <= self.pushed_version:
+                return
+            if self._pending is not None:
+                if version <= self._pending.get("version", 0):
+                    return
+                self.replaced += 1
+            self._pending = snapshot
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    @property
+    def pending_version(self):
+        """Версия снимка, ожидающего отправки, или None"""
+        with self._cond:
+            return self._pending.get("version", 0) if self._pending is not None else None
+
+    def wait_pushed(self, version, timeout=None):
+        """
+        Ожидает отправки снимка версии не ниже version.
+
+        :param version: Номер версии
+        :param timeout: Максимальное время ожидания в секундах (None - без ограничения)
+        :return: True, если версия отправлена
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.pushed_version is not None and self.pushed_version >= version, timeout
+            )
+
+    def retry_now(self):
+        """Отменяет паузу после неудачной записи: ожидающий снимок отправляется сразу."""
+        with self._cond:
+            self._retry_at = None
+            self._cond.notify_all()
+
+    def pause(self, timeout=None):
+        """
+        Приостанавливает отправку и дожидается завершения текущей записи
+        (перед отмонтированием сетевого хранилища).
+
+        :param timeout: Максимальное время ожидания текущей записи в секундах (None - без ограничения)
+        :return: True, если запись на хранилище больше не выполняется
+        """
+        with self._cond:
+            self._paused = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pushing, timeout)
+
+    def resume(self):
+        """Возобновляет отправку (после повторного монтирования хранилища)."""
+        with self._cond:
+            self._paused = False
+            self._retry_at = None
+            self._cond.notify_all()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if self._pending is None or self._paused:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    continue
+                if self._retry_at is not None and not self._closed:
+                    wait = self._retry_at - self.clock()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                snapshot = self._pending
+                self._pending = None
+                self._pushing = True
+
+                self._cond.release()
+                try:
+                    ok = self._push(snapshot)
+                finally:
+                    self._cond.acquire()
+                    self._pushing = False
+                    self._cond.notify_all()
+
+                if ok:
+                    self._backoff = 0.0
+                    self._retry_at = None
+                    continue
+                if self._pending is None:
+                    # Новее снимка не пришло: повторяем отправку этого же
+                    self._pending = snapshot
+                if self._closed:
+                    return
+                self._backoff = min(self.max_backoff, max(self.min_backoff, self._backoff * 2))
+                self._retry_at = self.clock() + self._backoff
+                logger.warning(
+                    f"Репликация состояния версии {snapshot.get('version')} не удалась, "
+                    f"повтор через {self._backoff:.1f} с"
+                )
+
+    def _push(self, snapshot):
+        try:
+            ok = self.save(snapshot)
+        except Exception as e:
+            logger.warning(f"Ошибка репликации состояния: {e}")
+            ok = False
+        with self._cond:
+            if ok:
+                self.pushed += 1
+                self.pushed_version = snapshot.get("version", 0)
+                self._cond.notify_all()
+            else:
+                self.failures += 1
+        return ok
+
+    def close(self, timeout=None):
+        """
+        Отправляет последний снимок (одна попытка без паузы; после pause - без отправки)
+        и останавливает поток.
+
+        :param timeout: Максимальное время ожидания в секундах (None - без ограничения)
+        :return: True, если неотправленных снимков не осталось
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logger.warning(f"Репликация состояния не завершилась за {timeout} с")
+                return False
+        pending_version = self.pending_version
+        if pending_version is not None:
+            logger.warning(f"Версия состояния {pending_version} не отправлена на сетевое хранилище")
+        return pending_version is None
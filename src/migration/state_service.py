@@ -0,0 +1,178 @@
+"""
+Модуль владельца состояния миграции в памяти процесса.
+
+Состояние загружается из файлов один раз, после чего все обновления
+применяются к копии в памяти и помечают её изменённой. Сохранение выполняет
+отдельный поток: обычные обновления (heartbeat, последняя ошибка) копятся и
+записываются не чаще одного раза за flush_interval, важные переходы (смена
+статуса миграции или пользователя) - без ожидания интервала, но не чаще
+одного раза за min_interval. Поэтому количество записей ограничено
+независимо от частоты обновлений, а вызывающие потоки не ждут записи файлов.
+
+Каждый сохраняемый снимок получает следующий номер версии (ключ "version"),
+продолжающий версию загруженного состояния.
+
+Если сохранение не удалось, состояние остаётся изменённым и записывается
+при следующей попытке. При завершении процесса (close) несохранённые
+изменения записываются.
+
+Классы:
+    - StateService: Состояние в памяти с объединением записей по таймеру.
+"""
+
+import copy
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StateService:
+    """Единственный владелец состояния миграции в процессе с отложенным сохранением"""
+
+    def __init__(self, load, save, flush_interval=5.0, min_interval=0.5, name="state", clock=time.monotonic):
+        """
+        :param load: Функция без аргументов, возвращающая словарь состояния
+        :param save: Функция (state) сохранения снимка состояния, возвращает True при успехе
+        :param flush_interval: Максимальная задержка сохранения обычных обновлений в секундах
+        :param min_interval: Минимальный интервал между сохранениями в секундах
+        :param name: Имя сервиса (для логов и имени потока)
+        :param clock: Источник времени (для тестов)
+        """
+        self.load = load
+        self.save = save
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.min_interval = max(0.0, min(float(min_interval), self.flush_interval))
+        self.name = name
+        self.clock = clock
+
+        self.updates = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.saved_version = None
+
+        # RLock: обновление из обработчика сигнала не должно блокироваться на прерванном обновлении
+        self._cond = threading.Condition(threading.RLock())
+        self._flush_lock = threading.Lock()
+        self._state = None
+        self._dirty = False
+        self._urgent = False
+        self._last_flush = None
+        self._closed = False
+        self._thread = None
+
+    def _ensure_loaded(self):
+        if self._state is None:
+            state = self.load() or {}
+            state.setdefault("global", {})
+            state.setdefault("users", {})
+            state.setdefault("version", 0)
+            self._state = state
+
+    def update(self, mutator):
+        """
+        Применяет изменение к состоянию в памяти и планирует сохранение.
+
+        :param mutator: Функция (state), изменяющая словарь состояния на месте; возвращает True,
+                        если изменение важное и должно быть сохранено без ожидания интервала
+        """
+        with self._cond:
+            self._ensure_loaded()
+            urgent = bool(mutator(self._state))
+            self.updates += 1
+            self._dirty = True
+            self._urgent = self._urgent or urgent
+            closed = self._closed
+            if not closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=f"{self.name}-flusher", daemon=True)
+                    self._thread.start()
+                self._cond.notify_all()
+        if closed:
+            # Поток сохранения уже остановлен (завершение процесса): сохраняем сразу
+            self.flush()
+
+    def get(self, section, key, default=None):
+        """
+        :param section: Раздел состояния ('global' или 'users')
+        :param key: Ключ в разделе
+        :param default: Значение по умолчанию
+        :return: Значение из состояния в памяти
+        """
+        with self._cond:
+            self._ensure_loaded()
+            return self._state.get(section, {}).get(key, default)
+
+    def snapshot(self):
+        """
+        :return: Копия текущего состояния (с ещё не сохранёнными изменениями)
+        """
+        with self._cond:
+            self._ensure_loaded()
+            return copy.deepcopy(self._state)
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if not self._dirty:
+                    self._cond.wait()
+                    continue
+                delay = self.min_interval if self._urgent else self.flush_interval
+                wait = 0 if self._last_flush is None else self._last_flush + delay - self.clock()
+                if wait > 0:
+                    # Важное обновление во время ожидания сокращает задержку
+                    self._cond.wait(wait)
+                    continue
+                self._cond.release()
+                try:
+                    self.flush()
+                finally:
+                    self._cond.acquire()
+
+    def flush(self):
+        """
+        Сохраняет состояние, если оно изменилось с последнего сохранения.
+
+        :return: True, если сохранять было нечего или сохранение удалось
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._dirty:
+                    return True
+                self._state["version"] = self._state.get("version", 0) + 1
+                snapshot = copy.deepcopy(self._state)
+                self._dirty = self._urgent = False
+                self._last_flush = self.clock()
+
+            try:
+                ok = self.save(snapshot)
+            except Exception as e:
+                logger.warning(f"Ошибка сохранения состояния {self.name}: {e}")
+                ok = False
+
+            with self._cond:
+                if ok:
+                    self.flushes += 1
+                    self.saved_version = snapshot["version"]
+                else:
+                    # Повторная попытка - через flush_interval вместе со следующими изменениями
+                    self.failed_flushes += 1
+                    self._dirty = True
+            return ok
+
+    def close(self):
+        """Останавливает поток сохранения и записывает несохранённые изменения."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+        logger.debug(
+            f"Состояние {self.name}: обновлений {self.updates}, сохранений {self.flushes}, "
+            f"неудачных {self.failed_flushes}"
+        )
@@ -0,0 +1,267 @@
+"""
+Модуль локального хранилища состояния миграции в SQLite.
+
+Состояние хранится в базе SQLite в режиме WAL по таблицам: глобальные поля
+(global_state), статусы пользователей (users), ошибки (errors) и прогресс
+копирования пользователей (progress). Сохранение снимка состояния - одна
+транзакция, в которой записываются только изменившиеся с прошлого сохранения
+поля и пользователи, поэтому объём записи не зависит от количества
+пользователей. Читатели (управляющий сервис, супервизор) открывают базу
+только для чтения и получают сводку индексированными запросами, не мешая
+записи (WAL) и не разбирая JSON целиком.
+
+Значения глобальных полей и подробности ошибок хранятся как JSON.
+
+Классы:
+    - StateStore: Запись и загрузка состояния миграции.
+
+Функции:
+    - read_summary: Сводка состояния для управляющего сервиса и супервизора (только чтение).
+"""
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS global_state (
+        key         TEXT PRIMARY KEY,
+        value       TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        username    TEXT PRIMARY KEY,
+        status      TEXT NOT NULL,
+        updated_at  TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS users_status ON users (status)",
+    """
+    CREATE TABLE IF NOT EXISTS errors (
+        id          INTEGER PRIMARY KEY,
+        timestamp   TEXT NOT NULL,
+        code        TEXT,
+        username    TEXT,
+        message     TEXT,
+        details     TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS errors_code ON errors (code)",
+    """
+    CREATE TABLE IF NOT EXISTS progress (
+        username    TEXT PRIMARY KEY,
+        data        TEXT NOT NULL,
+        updated_at  TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        key         TEXT PRIMARY KEY,
+        value       INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+)
+
+# Статусы завершённых пользователей (как в prepare_minimal_state)
+_COMPLETED_STATUSES = ("success", "completed_with_error")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class StateStore:
+    """Состояние миграции в SQLite (WAL) с инкрементальной записью снимков"""
+
+    def __init__(self, path, max_errors=10000):
+        """
+        :param path: Путь к файлу базы состояния
+        :param max_errors: Количество хранимых последних ошибок
+        """
+        self.path = path
+        self.max_errors = max(1, int(max_errors))
+        self._lock = threading.Lock()
+        self._pending_errors = []
+        # Последнее записанное состояние: для записи только изменений
+        self._written = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Фиксация переживает аварийное завершение процесса; при сбое питания теряется только хвост WAL
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def load(self):
+        """
+        :return: Словарь состояния {"global", "users", "progress", "version"} или None, если база пуста
+        """
+        with self._lock:
+            conn = self._conn
+            if conn is None:
+                return None
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if version is None:
+                return None
+            state = {
+                "global": {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM global_state")},
+                "users": dict(conn.execute("SELECT username, status FROM users")),
+                "progress": {user: json.loads(data) for user, data in conn.execute("SELECT username, data FROM progress")},
+                "version": version[0],
+            }
+            self._written = _flatten(state)
+            return state
+
+    def add_error(self, error_info, username=None):
+        """
+        Добавляет ошибку; запись - вместе со следующим снимком состояния.
+
+        :param error_info: Словарь ошибки (ErrorHandler.handle_error)
+        :param username: Пользователь, при обработке которого произошла ошибка
+        """
+        row = (
+            error_info.get("timestamp") or datetime.datetime.now().isoformat(),
+            error_info.get("code"),
+            username,
+            error_info.get("details") or error_info.get("description"),
+            _dumps(error_info),
+        )
+        with self._lock:
+            self._pending_errors.append(row)
+            if len(self._pending_errors) > self.max_errors:
+                del self._pending_errors[:-self.max_errors]
+
+    def save(self, state):
+        """
+        Сохраняет снимок состояния одной транзакцией (только изменения с прошлого сохранения).
+
+        :param state: Словарь состояния {"global", "users", "progress", "version"}
+        :return: True при успехе
+        """
+        now = datetime.datetime.now().isoformat()
+        current = _flatten(state)
+        with self._lock:
+            if self._conn is None:
+                logger.warning(f"База состояния {self.path} закрыта, снимок версии {state.get('version')} не сохранён")
+                return False
+            written = self._written or ({}, {}, {})
+            errors, self._pending_errors = self._pending_errors, []
+            try:
+                with self._conn:
+                    self._write_section(
+                        "global_state", "key", written[0], current[0],
+                        lambda key, value: (key, value),
+                        "INSERT OR REPLACE INTO global_state (key, value) VALUES (?, ?)"
+                    )
+                    self._write_section(
+                        "users", "username", written[1], current[1],
+                        lambda user, status: (user, status, now),
+                        "INSERT OR REPLACE INTO users (username, status, updated_at) VALUES (?, ?, ?)"
+                    )
+                    self._write_section(
+                        "progress", "username", written[2], current[2],
+                        lambda user, data: (user, data, now),
+                        "INSERT OR REPLACE INTO progress (username, data, updated_at) VALUES (?, ?, ?)"
+                    )
+                    if errors:
+                        self._conn.executemany(
+                            "INSERT INTO errors (timestamp, code, username, message, details) VALUES (?, ?, ?, ?, ?)",
+                            errors
+                        )
+                        self._conn.execute(
+                            "DELETE FROM errors WHERE id <= (SELECT MAX(id) FROM errors) - ?", (self.max_errors,)
+                        )
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (state.get("version", 0),)
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи состояния в {self.path}: {e}")
+                # Ошибки не теряются: будут записаны со следующим снимком
+                self._pending_errors[:0] = errors
+                return False
+            self._written = current
+            return True
+
+    def _write_section(self, table, key_column, written, current, make_row, upsert):
+        changed = [make_row(key, value) for key, value in current.items() if written.get(key) != value]
+        removed = [(key,) for key in written.keys() - current.keys()]
+        if changed:
+            self._conn.executemany(upsert, changed)
+        if removed:
+            self._conn.executemany(f"DELETE FROM {table} WHERE {key_column} = ?", removed)
+
+    def close(self):
+        """Закрывает базу."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _flatten(state):
+    """Разделы состояния в виде, в котором они хранятся в базе (значения - строки JSON)."""
+    return (
+        {key: _dumps(value) for key, value in state.get("global", {}).items()},
+        {user: str(status) for user, status in state.get("users", {}).items()},
+        {user: _dumps(data) for user, data in state.get("progress", {}).items()},
+    )
+
+
+def read_summary(path, timeout=2.0):
+    """
+    Читает сводку состояния из базы только для чтения (не блокирует запись).
+
+    :param path: Путь к файлу базы состояния
+    :param timeout: Время ожидания блокировки базы в секундах
+    :return: Словарь, как у prepare_minimal_state, или None, если база недоступна или пуста
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=timeout)
+    except sqlite3.Error as e:
+        logger.debug(f"Не удалось открыть базу состояния {path}: {e}")
+        return None
+    try:
+        if conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone() is None:
+            return None
+        keys = ("status", "last_update", "last_heartbeat", "last_error", "current_user")
+        global_state = {
+            key: json.loads(value) for key, value in conn.execute(
+                f"SELECT key, value FROM global_state WHERE key IN ({', '.join('?' * len(keys))})", keys
+            )
+        }
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM users GROUP BY status"))
+        current_user = conn.execute(
+            "SELECT username FROM users WHERE status = 'in_progress' ORDER BY updated_at DESC LIMIT 1"
+        ).fetchone()
+    except (sqlite3.Error, ValueError) as e:
+        logger.debug(f"Не удалось прочитать базу состояния {path}: {e}")
+        return None
+    finally:
+        conn.close()
+
+    total_users = sum(counts.values())
+    users_completed = sum(counts.get(status, 0) for status in _COMPLETED_STATUSES)
+    return {
+        "service_timestamp": datetime.datetime.now().isoformat(),
+        "status": global_state.get("status", "unknown"),
+        "last_update": global_state.get("last_update"),
+        "last_heartbeat": global_state.get("last_heartbeat"),
+        "overall_progress": (users_completed / total_users * 100) if total_users > 0 else 0,
+        "current_user": current_user[0] if current_user else global_state.get("current_user"),
+        "total_users": total_users,
+        "users_completed": users_completed,
+        "users_failed": counts.get("failed", 0),
+        "users_in_progress": counts.get("in_progress", 0),
+        "last_error": global_state.get("last_error"),
+    }
@@ -29,7 +29,16 @@
     save_state_dual(state_dict)  # двойное сохранение
     update_global_state(**kwargs)
     update_user_state(user, status)
+    get_state() -> dict  # текущее состояние в памяти процесса
+    flush_state()  # немедленное сохранение несохранённых изменений
     get_local_state_for_service() -> dict  # для управляющего сервиса
+
+Обновления применяются к состоянию в памяти (StateService) и сохраняются в
+файлы фоновым потоком с объединением записей: не чаще раза в
+STATE_FLUSH_INTERVAL секунд, смена статуса - не чаще раза в
+STATE_FLUSH_MIN_INTERVAL секунд. Сохранение локальное (база SQLite STATE_DB_FILE, запись только изменений); на сетевое
+хранилище снимки с номером версии отправляет StateReplicator в своём потоке
+с повторами, поэтому недоступное хранилище не задерживает миграцию.
 """
 
 """
@@ -51,11 +60,18 @@ import datetime
 import fcntl
 import time
 import errno
+import sqlite3
+import atexit
+import threading
 from pathlib import Path
 from contextlib import contextmanager
 from src.logging.logger import setup_logger
 from src.config.config_loader import load_config
 from src.errors.error_codes import ErrorHandler, MigrationErrorCodes, create_error_handler
+from src.migration.state_service import StateService
+from src.migration.state_replicator import StateReplicator
+from src.migration.state_store import StateStore, read_summary
+from src.migration.error_aggregator import ErrorAggregator
 
 error_handler = None
 
@@ -66,7 +82,10 @@ logger = logging.getLogger(__name__)
 config = load_config()
 network_state_file = config["STATE_FILE"]
 
-# Локальные файлы состояния для управляющего сервиса
+# Локальная база состояния (SQLite WAL): основное локальное хранилище
+STATE_DB_FILE = "/var/lib/migration-service/state.db"
+
+# Локальные JSON-файлы состояния (пишутся только при STATE_LEGACY_JSON_FILES)
 LOCAL_STATE_FILE = "/tmp/migration_state.json"
 SERVICE_STATE_FILE = "/var/lib/migration-service/state.json"
 SERVICE_MINIMAL_FILE = "/var/lib/migration-service/current_state.json"
@@ -82,6 +101,14 @@ LOCK_TIMEOUT = 5.0  # 5 секунд на получение блокировк
 READ_TIMEOUT = 3.0  # 3 секунды на чтение
 WRITE_TIMEOUT = 10.0  # 10 секунд на запись
 
+# Владелец состояния в памяти процесса, локальная база и репликатор на сетевое хранилище
+# (создаются при первом обращении)
+_state_service = None
+_state_replicator = None
+_state_store = None
+_error_aggregator = None
+_state_service_lock = threading.Lock()
+
 @contextmanager
 def file_lock(lock_file_path, timeout=LOCK_TIMEOUT, mode='w'):
     """
@@ -244,31 +271,40 @@ def ensure_local_directories():
 def load_state():
     """
     ИСПРАВЛЕНО: Загружает состояние с учетом блокировок.
+    Из сетевой и локальной копий выбирается копия с большей версией
+    (локальная может быть новее, если репликация не успела завершиться).
     """
-    # Сначала пытаемся загрузить с сетевого хранилища
+    network_data = None
     if os.path.exists(network_state_file):
-        data = safe_read_json(network_state_file)
-        if data is not None:
-            # Убедимся, что в data есть "global" и "users"
-            if "global" not in data:
-                data["global"] = {}
-            if "users" not in data:
-                data["users"] = {}
-            logger.debug("Состояние загружено с сетевого хранилища.")
-            return data
-        else:
+        network_data = safe_read_json(network_state_file)
+        if network_data is None:
             logger.warning("Не удалось прочитать состояние с сетевого хранилища")
     
-    # Если сетевой файл недоступен, пытаемся загрузить локальный
-    if os.path.exists(LOCAL_STATE_FILE):
-        data = safe_read_json(LOCAL_STATE_FILE)
-        if data is not None:
-            if "global" not in data:
-                data["global"] = {}
-            if "users" not in data:
-                data["users"] = {}
-            logger.info("Состояние загружено из локального файла.")
-            return data
+    local_data = None
+    store = get_state_store()
+    if store is not None:
+        try:
+            local_data = store.load()
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать локальную базу состояния: {e}")
+    if local_data is None and os.path.exists(LOCAL_STATE_FILE):
+        local_data = safe_read_json(LOCAL_STATE_FILE)
+    
+    # При равных версиях (в том числе у файлов без версии) приоритет у сетевого хранилища
+    if network_data is not None and (local_data is None or
+                                     network_data.get("version", 0) >= local_data.get("version", 0)):
+        data, source = network_data, "с сетевого хранилища"
+    else:
+        data, source = local_data, "из локального файла"
+    
+    if data is not None:
+        # Убедимся, что в data есть "global" и "users"
+        if "global" not in data:
+            data["global"] = {}
+        if "users" not in data:
+            data["users"] = {}
+        logger.debug(f"Состояние версии {data.get('version', 0)} загружено {source}.")
+        return data
     
     # Если оба файла недоступны
     logger.warning("Файлы состояния не найдены или недоступны. Используется пустой словарь.")
@@ -301,12 +337,41 @@ def save_to_network(state_dict):
         )
         return False
 
+def get_state_store():
+    """
+    :return: StateStore локальной базы состояния или None, если база недоступна
+    """
+    global _state_store
+    with _state_service_lock:
+        if _state_store is None:
+            try:
+                _state_store = StateStore(STATE_DB_FILE, max_errors=config.get("STATE_MAX_ERRORS", 10000))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Локальная база состояния {STATE_DB_FILE} недоступна: {e}")
+                _state_store = False
+        return _state_store or None
+
 def save_to_local(state_dict):
     """
-    ИСПРАВЛЕНО: Локальное сохранение с блокировками и разделением файлов.
+    Локальное сохранение: изменения записываются в базу состояния одной транзакцией.
+    При STATE_LEGACY_JSON_FILES дополнительно пишутся прежние JSON-файлы
+    (для внешних читателей, ещё не перешедших на базу: debug_state.py,
+    file_lock_diagnostic.py).
     """
     ensure_local_directories()
     
+    store = get_state_store()
+    success = store is not None and store.save(state_dict)
+    
+    if config.get("STATE_LEGACY_JSON_FILES", True) or store is None:
+        success = _save_legacy_json(state_dict) or success
+    
+    return success
+
+def _save_legacy_json(state_dict):
+    """
+    Сохранение в прежние локальные JSON-файлы с блокировками.
+    """
     success_count = 0
     total_files = 4
     
@@ -323,12 +388,12 @@ def save_to_local(state_dict):
     if safe_write_json(SERVICE_MINIMAL_FILE, minimal_state, use_lock=True):
         success_count += 1
     
-    # 4. НОВОЕ: Отдельный файл для чтения супервизором
+    # 4. Отдельный файл для чтения супервизором
     supervisor_state = prepare_supervisor_state(state_dict)
     if safe_write_json(SUPERVISOR_READ_FILE, supervisor_state, use_lock=True):
         success_count += 1
     
-    logger.debug(f"Локальное сохранение: {success_count}/{total_files} файлов")
+    logger.debug(f"Локальное сохранение JSON: {success_count}/{total_files} файлов")
     return success_count > 0  # Считаем успехом если хотя бы один файл сохранился
 
 def prepare_minimal_state(state_dict):
@@ -414,80 +479,177 @@ def save_state_dual(state_dict):
     
     return local_success or network_success
 
+def save_state_local_first(state_dict):
+    """
+    Сохраняет состояние локально и передаёт снимок репликатору для отправки
+    на сетевое хранилище (без ожидания сетевой записи).
+    """
+    local_success = save_to_local(state_dict)
+    if not local_success:
+        logger.error("Не удалось сохранить состояние локально!")
+    get_state_replicator().submit(state_dict)
+    return local_success
+
+def get_state_replicator():
+    """
+    :return: StateReplicator процесса (запись через save_to_network)
+    """
+    global _state_replicator
+    with _state_service_lock:
+        if _state_replicator is None:
+            _state_replicator = StateReplicator(
+                save=save_to_network,
+                min_backoff=config.get("STATE_REPLICATION_MIN_BACKOFF", 1.0),
+                max_backoff=config.get("STATE_REPLICATION_MAX_BACKOFF", 60.0)
+            )
+        return _state_replicator
+
+def get_state_service():
+    """
+    :return: StateService процесса; сохранение выполняется через save_state_local_first
+    """
+    global _state_service
+    with _state_service_lock:
+        if _state_service is None:
+            _state_service = StateService(
+                load=load_state,
+                save=save_state_local_first,
+                flush_interval=config.get("STATE_FLUSH_INTERVAL", 5.0),
+                min_interval=config.get("STATE_FLUSH_MIN_INTERVAL", 0.5)
+            )
+            atexit.register(_close_state)
+        return _state_service
+
+def _close_state():
+    """Сохраняет несохранённые изменения и дожидается их отправки на сетевое хранилище."""
+    if _error_aggregator is not None:
+        _error_aggregator.close()
+    if _state_service is not None:
+        _state_service.close()
+    if _state_store:
+        _state_store.close()
+    if _state_replicator is not None:
+        _state_replicator.close(timeout=config.get("STATE_REPLICATION_CLOSE_TIMEOUT", 15.0))
+
+def get_state():
+    """
+    Возвращает текущее состояние миграции из памяти процесса
+    (файлы читаются только при первом обращении).
+    """
+    return get_state_service().snapshot()
+
+def flush_state(network_timeout=None):
+    """
+    Немедленно сохраняет несохранённые изменения состояния локально.
+
+    :param network_timeout: Если задан - ожидать отправки сохранённой версии на сетевое
+                            хранилище не дольше указанного числа секунд
+    :return: True, если состояние сохранено (и, при network_timeout, отправлено)
+    """
+    service = get_state_service()
+    if not service.flush():
+        return False
+    if network_timeout is None:
+        return True
+    version = service.saved_version
+    if version is None:
+        # Процесс ещё ничего не сохранял
+        return True
+    replicator = get_state_replicator()
+    # Отправка не ждёт окончания паузы после неудачной записи
+    replicator.retry_now()
+    if not replicator.wait_pushed(version, network_timeout):
+        logger.warning(f"Версия состояния {version} не отправлена на сетевое хранилище за {network_timeout} с")
+        return False
+    return True
+
+def pause_state_replication(timeout=None):
+    """
+    Останавливает запись состояния на сетевое хранилище перед его отмонтированием
+    (иначе запись попадёт в пустую точку монтирования на локальном диске).
+
+    :param timeout: Максимальное время ожидания текущей записи в секундах
+    """
+    if _state_replicator is not None and not _state_replicator.pause(timeout):
+        logger.warning(f"Запись состояния на сетевое хранилище не завершилась за {timeout} с")
+
+def resume_state_replication():
+    """Возобновляет запись состояния на сетевое хранилище после его монтирования."""
+    if _state_replicator is not None:
+        _state_replicator.resume()
+
 def update_global_state(**kwargs):
     """
-    ИСПРАВЛЕНО: Обновление с защитой от блокировок.
+    Обновление глобального состояния в памяти. Смена статуса сохраняется
+    без ожидания интервала объединения записей.
     """
-    max_retries = 3
-    retry_delay = 0.5
-    
-    for attempt in range(max_retries):
-        try:
-            state = load_state()
-            global_state = state.get("global", {})
-            
-            # Добавляем timestamp обновления
-            kwargs["last_update"] = datetime.datetime.now().isoformat()
-            
-            for k, v in kwargs.items():
-                global_state[k] = v
-            state["global"] = global_state
+    # Добавляем timestamp обновления
+    kwargs["last_update"] = datetime.datetime.now().isoformat()
 
-            # Используем двойное сохранение
-            if save_state_dual(state):
-                return  # Успех
-            
-        except Exception as e:
-            logger.warning(f"Попытка {attempt + 1} обновления состояния не удалась: {e}")
-            
-        if attempt < max_retries - 1:
-            time.sleep(retry_delay * (attempt + 1))
-    
-    logger.error("Не удалось обновить глобальное состояние после всех попыток")
+    def apply(state):
+        global_state = state.setdefault("global", {})
+        status_changed = "status" in kwargs and global_state.get("status") != kwargs["status"]
+        global_state.update(kwargs)
+        return status_changed
+
+    try:
+        get_state_service().update(apply)
+    except Exception as e:
+        logger.error(f"Не удалось обновить глобальное состояние: {e}")
 
 def update_user_state(user, status):
     """
-    ИСПРАВЛЕНО: Обновление состояния пользователя с защитой от блокировок.
+    Обновление состояния пользователя в памяти. Смена статуса пользователя
+    сохраняется без ожидания интервала объединения записей.
     """
-    max_retries = 3
-    retry_delay = 0.5
-    
-    for attempt in range(max_retries):
-        try:
-            state = load_state()
-            users = state.get("users", {})
-            users[user] = status
-            state["users"] = users
-
-            # Обновляем глобальную информацию
-            global_state = state.get("global", {})
-            global_state["last_update"] = datetime.datetime.now().isoformat()
-            
-            # Добавляем информацию о текущем пользователе
-            if status == "in_progress":
-                global_state["current_user"] = user
-            elif global_state.get("current_user") == user and status in ["success", "failed", "completed_with_error"]:
-                global_state["current_user"] = None
-            
-            state["global"] = global_state
+    def apply(state):
+        users = state.setdefault("users", {})
+        status_changed = users.get(user) != status
+        users[user] = status
 
-            # Используем двойное сохранение
-            if save_state_dual(state):
-                return  # Успех
-                
-        except Exception as e:
-            logger.warning(f"Попытка {attempt + 1} обновления состояния пользователя не удалась: {e}")
-            
-        if attempt < max_retries - 1:
-            time.sleep(retry_delay * (attempt + 1))
-    
-    logger.error(f"Не удалось обновить состояние пользователя {user} после всех попыток")
+        # Обновляем глобальную информацию
+        global_state = state.setdefault("global", {})
+        global_state["last_update"] = datetime.datetime.now().isoformat()
+
+        # Добавляем информацию о текущем пользователе
+        if status == "in_progress":
+            global_state["current_user"] = user
+        elif global_state.get("current_user") == user and status in ["success", "failed", "completed_with_error"]:
+            global_state["current_user"] = None
+        return status_changed
+
+    try:
+        get_state_service().update(apply)
+    except Exception as e:
+        logger.error(f"Не удалось обновить состояние пользователя {user}: {e}")
+
+def update_user_progress(user, **values):
+    """
+    Обновление прогресса копирования пользователя (файлы, объём, ETA) в памяти;
+    сохраняется вместе со следующим снимком состояния.
+    """
+    def apply(state):
+        state.setdefault("progress", {}).setdefault(user, {}).update(values)
+        return False
+
+    try:
+        get_state_service().update(apply)
+    except Exception as e:
+        logger.debug(f"Не удалось обновить прогресс пользователя {user}: {e}")
 
 def get_local_state_for_service():
     """
     ИСПРАВЛЕНО: Чтение состояния для управляющего сервиса с защитой от блокировок.
     """
-    # Приоритет файлов для чтения
+    # Основной источник - база состояния (только чтение, индексированные запросы)
+    summary = read_summary(STATE_DB_FILE)
+    if summary is not None:
+        summary["script_version"] = config.get("SCRIPT_VERSION")
+        summary["data_source_type"] = config.get("DATA_SOURCE_TYPE")
+        logger.debug("Состояние прочитано из базы состояния")
+        return summary
+    
+    # Прежние JSON-файлы (база ещё не создана)
     files_to_try = [
         (SERVICE_MINIMAL_FILE, "минимальный файл", lambda x: x),
         (SUPERVISOR_READ_FILE, "файл супервизора", lambda x: x),
@@ -612,22 +774,46 @@ def force_network_sync():
         )
         return False
 
+def get_error_aggregator():
+    """
+    :return: ErrorAggregator процесса (публикация через _publish_errors)
+    """
+    global _error_aggregator
+    with _state_service_lock:
+        if _error_aggregator is None:
+            _error_aggregator = ErrorAggregator(
+                handler=ErrorHandler(update_state_callback=None),
+                publish=_publish_errors,
+                interval=config.get("ERROR_AGGREGATION_INTERVAL", 5.0),
+                recent_limit=config.get("ERROR_RECENT_LIMIT", 1000),
+                traceback_every=config.get("ERROR_TRACEBACK_SAMPLE", 100)
+            )
+        return _error_aggregator
+
+def _publish_errors(errors, latest, counts):
+    """
+    Пакет ошибок агрегатора: записи в журнал ошибок базы состояния и одно обновление состояния.
+    """
+    store = get_state_store()
+    if store is not None:
+        for error_info in errors:
+            store.add_error(error_info, username=error_info.get("context", {}).get("user"))
+    update_global_state(last_error=latest, error_counts=counts)
+
 def get_error_summary():
     """Возвращает сводку по ошибкам миграции"""
-    handler = initialize_error_handler()
-    return handler.get_error_summary()
+    return get_error_aggregator().summary()
 
 def handle_migration_error(error_code, details="", exception=None, context=None):
-    """Обработка ошибок миграции с обновлением состояния"""
-    from src.errors.error_codes import ErrorHandler
-    handler = ErrorHandler(update_state_callback=None)
-    
-    error_info = handler.handle_error(error_code, details, exception, context)
+    """
+    Обработка ошибок миграции. Повторяющиеся ошибки группируются агрегатором,
+    состояние обновляется пакетом раз в интервал; критическая ошибка
+    переводит миграцию в статус failed сразу.
+    """
+    error_info = get_error_aggregator().record(error_code, details, exception, context)
     
-    # Обновляем глобальное состояние (с защитой от блокировок)
     try:
-        current_state = load_state()
-        current_status = current_state.get("global", {}).get("status", "unknown")
+        current_status = get_state_service().get("global", "status", "unknown")
         
         should_fail = False
         critical_categories = ["INIT", "CONFIG", "MOUNT", "SOURCE"]
@@ -640,20 +826,17 @@ def handle_migration_error(error_code, details="", exception=None, context=None)
             should_fail = True
         
         if should_fail:
-            update_global_state(
-                status="failed",
-                last_update=datetime.datetime.now().isoformat(),
-                last_error=error_info
-            )
-            logger.error(f"Миграция остановлена из-за критической ошибки {error_code.code}")
-        else:
-            update_global_state(
-                last_update=datetime.datetime.now().isoformat(),
-                last_error=error_info
-            )
+            if current_status != "failed":
+                update_global_state(
+                    status="failed",
+                    last_update=datetime.datetime.now().isoformat(),
+                    last_error=error_info
+                )
+                logger.error(f"Миграция остановлена из-за критической ошибки {error_code.code}")
+        elif error_info["occurrences"] == 1:
             logger.warning(f"Зафиксирована ошибка {error_code.code}, миграция продолжается")
             
     except Exception as e:
         logger.warning(f"Не удалось обновить состояние при ошибке {error_code.code}: {e}")
     
-    return error_info
\ No newline at end of file
+    return error_info
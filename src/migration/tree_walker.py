@@ -0,0 +1,191 @@
+"""
+Модуль обхода дерева файлов на основе os.scandir.
+
+Для каждого файла выполняется ровно один stat, результат сохраняется в компактной
+записи FileRecord и далее используется копированием и проверкой целостности
+без повторных обращений к файловой системе (на CIFS каждое обращение -
+сетевой запрос).
+
+Функции:
+    - record_from_stat: Формирование FileRecord из результата os.stat.
+    - stat_record: Получение FileRecord для пути (None, если файла нет).
+    - walk_tree: Обход дерева с выдачей FileRecord для каждого файла.
+
+Обход может использовать кеш директорий (манифест сканирования): директория,
+mtime которой не изменился с прошлого обхода, не читается заново - её файлы
+и поддиректории берутся из кеша. Добавление, удаление и переименование
+записей меняют mtime директории, поэтому заново читаются только изменённые.
+"""
+
+import logging
+import os
+import stat
+from typing import Callable, Iterator, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FileRecord(NamedTuple):
+    """Компактная запись о файле: результат одного stat"""
+    path: str       # Полный путь к файлу
+    rel_path: str   # Путь относительно корня обхода
+    size: int       # Размер в байтах
+    mtime_ns: int   # Время модификации в наносекундах
+    mode: int       # st_mode
+    inode: int      # st_ino
+    dev: int        # st_dev
+
+    @property
+    def mtime(self):
+        """Время модификации в секундах (как os.path.getmtime)."""
+        return self.mtime_ns / 1_000_000_000
+
+
+def record_from_stat(path, rel_path, st):
+    """
+    Формирует FileRecord из результата os.stat.
+
+    :param path: Полный путь к файлу
+    :param rel_path: Путь относительно корня обхода
+    :param st: Результат os.stat / DirEntry.stat
+    :return: FileRecord
+    """
+    return FileRecord(path, rel_path, st.st_size, st.st_mtime_ns, st.st_mode, st.st_ino, st.st_dev)
+
+
+def stat_record(path, rel_path=None) -> Optional[FileRecord]:
+    """
+    Выполняет один stat и возвращает FileRecord.
+
+    :param path: Путь к файлу
+    :param rel_path: Относительный путь (по умолчанию - имя файла)
+    :return: FileRecord или None, если файл не существует
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return record_from_stat(path, rel_path if rel_path is not None else os.path.basename(path), st)
+
+
+def walk_tree(
+    root: str,
+    skip_dir: Optional[Callable[[str, str], bool]] = None,
+    skip_file: Optional[Callable[[str, str], bool]] = None,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+    dir_cache=None,
+) -> Iterator[FileRecord]:
+    """
+    Обходит дерево сверху вниз (как os.walk с topdown=True) и выдаёт FileRecord
+    для каждого файла. Символические ссылки на директории не раскрываются.
+
+    :param root: Корень обхода
+    :param skip_dir: Функция (rel_dir, name) -> True, если поддиректорию нужно пропустить
+    :param skip_file: Функция (rel_dir, name) -> True, если файл нужно пропустить (до stat)
+    :param on_error: Функция (path, exception) для ошибок чтения директорий и stat файлов.
+                     Если не задана, ошибки логируются и обход продолжается.
+    :param dir_cache: Кеш директорий с методами lookup(rel_dir, mtime_ns, on_error) -> (subdirs, records)
+                      или None и store(rel_dir, mtime_ns, subdirs); None - без кеша.
+                      Ошибки stat файлов из кеша передаются в on_error, как при чтении директории
+    :return: Генератор FileRecord
+    :raises OSError: Если не удалось прочитать корневую директорию
+    """
+    def report(path, error):
+        if on_error is not None:
+            on_error(path, error)
+        else:
+            logger.warning(f"Ошибка при обходе {path}: {error}")
+
+    # Стек (абсолютный путь, относительный путь, mtime_ns директории или None).
+    # Корень читаем без перехвата ошибок, чтобы недоступный источник не выглядел
+    # как пустая директория.
+    stack = [(root, "", None)]
+    is_root = True
+
+    while stack:
+        dir_path, rel_dir, dir_mtime_ns = stack.pop()
+        subdirs = []
+
+        if dir_cache is not None:
+            if dir_mtime_ns is None:
+                # mtime берём до чтения директории: изменения во время чтения будут замечены в следующий раз
+                try:
+                    dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+                except OSError as e:
+                    if is_root:
+                        raise
+                    report(dir_path, e)
+                    continue
+
+            cached = dir_cache.lookup(rel_dir, dir_mtime_ns, report)
+            if cached is not None:
+                is_root = False
+                cached_subdirs, records = cached
+                dir_cache.store(rel_dir, dir_mtime_ns, cached_subdirs)
+                for record in records:
+                    if skip_file is not None and skip_file(rel_dir, os.path.basename(record.rel_path)):
+                        continue
+                    yield record
+                for name in reversed(cached_subdirs):
+                    if skip_dir is not None and skip_dir(rel_dir, name):
+                        continue
+                    stack.append((os.path.join(dir_path, name), os.path.join(rel_dir, name) if rel_dir else name, None))
+                continue
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError as e:
+            if is_root:
+                raise
+            report(dir_path, e)
+            continue
+        is_root = False
+
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError as e:
+                report(entry.path, e)
+                continue
+
+            if is_dir:
+                # Как os.walk(followlinks=False): ссылку на директорию не обходим
+                try:
+                    if entry.is_symlink():
+                        continue
+                    subdir_mtime_ns = entry.stat().st_mtime_ns if dir_cache is not None else None
+                except OSError:
+                    continue
+                # В кеш попадают все поддиректории, исключения применяются при каждом обходе
+                subdirs.append((name, subdir_mtime_ns))
+                continue
+
+            if skip_file is not None and skip_file(rel_dir, name):
+                continue
+
+            try:
+                st = entry.stat()
+            except OSError as e:
+                report(entry.path, e)
+                continue
+
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            yield record_from_stat(entry.path, rel_path, st)
+
+        if dir_cache is not None:
+            dir_cache.store(rel_dir, dir_mtime_ns, [name for name, _ in subdirs])
+
+        # Поддиректории обходим в порядке появления
+        for name, subdir_mtime_ns in reversed(subdirs):
+            if skip_dir is not None and skip_dir(rel_dir, name):
+                continue
+            stack.append((
+                os.path.join(dir_path, name),
+                os.path.join(rel_dir, name) if rel_dir else name,
+                subdir_mtime_ns
+            ))
@@ -192,21 +192,50 @@ def set_permissions(path, user, group_name='domain users'):
             )
             return False
 
-        # Рекурсивно изменить владельца и группу
+        # Рекурсивно изменить владельца и группу. Обход через scandir; пока встречаются
+        # объекты с нужным владельцем (повторный запуск), chown для них не выполняется.
+        # После первого объекта с другим владельцем дерево считается необработанным,
+        # и дальше chown выполняется без stat - один системный вызов на объект, как раньше.
         files_processed = 0
-        for root, dirs, files in os.walk(path):
+        files_changed = 0
+
+        def chown_entry(target_path, check, get_stat):
+            """Меняет владельца объекта; возвращает, нужно ли проверять владельца следующих."""
+            nonlocal files_changed
+            if check:
+                try:
+                    st = get_stat()
+                except OSError:
+                    # Например, битая ссылка: chown вернёт ту же ошибку, что и раньше
+                    st = None
+                if st is not None and st.st_uid == uid and st.st_gid == gid:
+                    return True
+            os.chown(target_path, uid, gid)
+            files_changed += 1
+            return False
+
+        # Стек (директория, проверять ли владельца перед chown)
+        stack = [(path, True)]
+        while stack:
+            root, check = stack.pop()
             try:
-                os.chown(root, uid, gid)
+                check = chown_entry(root, check, lambda: os.stat(root))
                 files_processed += 1
-                
-                for directory in dirs:
-                    dirpath = os.path.join(root, directory)
-                    os.chown(dirpath, uid, gid)
-                    files_processed += 1
-                    
-                for file in files:
-                    filepath = os.path.join(root, file)
-                    os.chown(filepath, uid, gid)
+
+                try:
+                    with os.scandir(root) as it:
+                        entries = list(it)
+                except OSError as e:
+                    # Как os.walk: нечитаемая директория пропускается
+                    logger.warning(f"Не удалось прочитать директорию {root}: {e}")
+                    continue
+
+                for entry in entries:
+                    if entry.is_dir() and not entry.is_symlink():
+                        # Владелец директории проверяется при её обходе
+                        stack.append((entry.path, check))
+                        continue
+                    check = chown_entry(entry.path, check, entry.stat)
                     files_processed += 1
                     
             except PermissionError as e:
@@ -227,7 +256,10 @@ def set_permissions(path, user, group_name='domain users'):
                 )
                 return False
 
-        logger.info(f'Права доступа для {path} установлены на {user}:{group_name}. Обработано объектов: {files_processed}')
+        logger.info(
+            f'Права доступа для {path} установлены на {user}:{group_name}. '
+            f'Обработано объектов: {files_processed}, изменено: {files_changed}'
+        )
         return True
         
     except Exception as e:
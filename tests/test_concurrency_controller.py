@@ -0,0 +1,110 @@
+import threading
+import unittest
+
+from src.migration.concurrency_controller import ConcurrencyController, DeviceLimiter
+from src.migration.copy_pipeline import CopyPipeline
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.decisions = []
+        self.controller = ConcurrencyController(
+            initial=4, min_limit=1, max_limit=8, interval=1.0, clock=self.clock,
+            on_adjust=lambda name, limit, bps, fps, decision: self.decisions.append((limit, decision))
+        )
+
+    def run_window(self, files, nbytes, busy=True):
+        """Копирует files файлов за одно окно; busy - заняты ли все слоты."""
+        slots = self.controller.limit if busy else 1
+        for _ in range(slots):
+            self.controller.acquire()
+        for i in range(files):
+            if i == files - 1:
+                # Окно закрывается последним файлом, после него предел может уменьшиться
+                self.clock.now += 1.0
+            self.controller.release(nbytes // files)
+            if i < files - 1:
+                self.controller.acquire()
+        for _ in range(slots - 1):
+            self.controller.release(0)
+
+    def test_additive_increase_while_saturated(self):
+        self.run_window(10, 10_000)
+        self.run_window(10, 10_000)
+        self.assertEqual(self.decisions, [(5, 'increase'), (6, 'increase')])
+
+    def test_multiplicative_decrease_on_throughput_drop(self):
+        self.run_window(100, 100_000)
+        self.run_window(10, 10_000)
+        self.assertEqual(self.decisions[-1], (2, 'decrease'))
+
+    def test_hold_when_not_saturated(self):
+        self.run_window(10, 10_000, busy=False)
+        self.assertEqual(self.decisions, [(4, 'hold')])
+
+    def test_limit_clamped(self):
+        for _ in range(10):
+            self.run_window(10, 10_000)
+        self.assertEqual(self.controller.limit, 8)
+
+    def test_pipeline_respects_limit(self):
+        controller = ConcurrencyController(initial=2, max_limit=2, interval=3600)
+        peak = []
+        lock = threading.Lock()
+
+        def worker(item):
+            with lock:
+                peak.append(controller.active)
+            return True
+
+        pipeline = CopyPipeline(
+            lambda: iter(range(200)), worker, max_workers=6, queue_size=10,
+            controller=controller, size_of=lambda item: 1
+        )
+        self.assertTrue(pipeline.run())
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(controller.active, 0)
+
+
+class TestDeviceLimiter(unittest.TestCase):
+
+    def test_per_device_limit(self):
+        limiter = DeviceLimiter(per_device=2)
+        active = {1: 0, 2: 0}
+        peak = {1: 0, 2: 0}
+        lock = threading.Lock()
+
+        def work(devices):
+            with limiter.hold(*devices):
+                with lock:
+                    for dev in set(devices) - {None}:
+                        active[dev] += 1
+                        peak[dev] = max(peak[dev], active[dev])
+                threading.Event().wait(0.005)
+                with lock:
+                    for dev in set(devices) - {None}:
+                        active[dev] -= 1
+
+        threads = [threading.Thread(target=work, args=([(1, 2), (2, 1), (1, 1), (2, None)][i % 4],))
+                   for i in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertLessEqual(max(peak.values()), 2)
+        self.assertEqual(active, {1: 0, 2: 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from src.migration import copy_engine
+from src.migration.copy_engine import BACKENDS, ParallelCopyBudget, copy2_kernel, copy_with_hash, get_backend_for, kernel_copy, parallel_copy
+
+
+class TestCopyEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'source.bin')
+        self.target = os.path.join(self.tmp.name, 'target.bin')
+        self.data = os.urandom(3 * 1024 + 17)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_copy_with_hash(self):
+        digest, copied = copy_with_hash(self.source, self.target, buffer_size=1024)
+        self.assertEqual(copied, len(self.data))
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.stat(self.source).st_mtime_ns, os.stat(self.target).st_mtime_ns)
+
+    def test_readahead_hints(self):
+        _, copied = copy_with_hash(self.source, self.target, readahead=1024 * 1024)
+        self.assertEqual(copied, len(self.data))
+        backend, copied = kernel_copy(self.source, self.target, readahead=0)
+        self.assertEqual(copied, len(self.data))
+        _, copied = parallel_copy(self.source, self.target, chunk_size=1024, readahead=1024 * 1024)
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_empty_file(self):
+        open(self.source, 'wb').close()
+        digest, copied = copy_with_hash(self.source, self.target, algorithm='md5')
+        self.assertEqual(copied, 0)
+        self.assertEqual(digest, hashlib.md5(b'').hexdigest())
+
+    def test_kernel_copy_each_backend(self):
+        for backend in BACKENDS:
+            used, copied = kernel_copy(self.source, self.target, preferred=backend)
+            self.assertIn(used, BACKENDS)
+            self.assertEqual(copied, len(self.data))
+            with open(self.target, 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+
+    def test_backend_cached_per_device_pair(self):
+        used, _ = kernel_copy(self.source, self.target)
+        dev = os.stat(self.source).st_dev
+        self.assertEqual(get_backend_for(dev, os.stat(self.target).st_dev), used)
+
+    def test_backend_downgraded_after_repeated_failures(self):
+        key = (os.stat(self.source).st_dev, os.stat(self.tmp.name).st_dev)
+
+        def unsupported(src_fd, dst_fd, size):
+            raise copy_engine._BackendUnsupported("EPERM")
+
+        with mock.patch.dict(copy_engine._backend_cache, {key: copy_engine.BACKEND_SENDFILE}), \
+                mock.patch.dict(copy_engine._BACKEND_FUNCS, {copy_engine.BACKEND_SENDFILE: unsupported}):
+            for attempt in range(copy_engine.BACKEND_DOWNGRADE_AFTER):
+                # Отдельные отказы не меняют выбор для пары: файл копируется следующим механизмом
+                self.assertEqual(get_backend_for(*key), copy_engine.BACKEND_SENDFILE)
+                used, copied = kernel_copy(self.source, self.target)
+                self.assertEqual(used, copy_engine.BACKEND_USERSPACE)
+                self.assertEqual(copied, len(self.data))
+            self.assertEqual(get_backend_for(*key), copy_engine.BACKEND_USERSPACE)
+
+    def test_forced_backend_not_cached(self):
+        key = (os.stat(self.source).st_dev, os.stat(self.tmp.name).st_dev)
+        with mock.patch.dict(copy_engine._backend_cache, clear=True):
+            used, _ = kernel_copy(self.source, self.target, preferred=copy_engine.BACKEND_USERSPACE)
+            self.assertEqual(used, copy_engine.BACKEND_USERSPACE)
+            self.assertIsNone(get_backend_for(*key))
+
+    def test_first_probe_failure_not_cached(self):
+        key = (os.stat(self.source).st_dev, os.stat(self.tmp.name).st_dev)
+        calls = []
+
+        def unsupported_once(src_fd, dst_fd, size):
+            calls.append(size)
+            if len(calls) == 1:
+                raise copy_engine._BackendUnsupported("EINVAL")
+            return copy_engine._userspace_loop(src_fd, dst_fd, size)
+
+        functions = {backend: unsupported_once for backend in BACKENDS[:-1]}
+        with mock.patch.dict(copy_engine._backend_cache, clear=True), \
+                mock.patch.dict(copy_engine._backend_failures, clear=True), \
+                mock.patch.dict(copy_engine._BACKEND_FUNCS, functions):
+            # Отказ при первой проверке пары из-за самого файла не исключает механизм
+            kernel_copy(self.source, self.target)
+            self.assertIsNone(get_backend_for(*key))
+            used, copied = kernel_copy(self.source, self.target)
+            self.assertEqual(used, BACKENDS[0])
+            self.assertEqual(copied, len(self.data))
+            self.assertEqual(get_backend_for(*key), BACKENDS[0])
+
+    def test_copy2_kernel_into_directory(self):
+        target_dir = os.path.join(self.tmp.name, 'dir')
+        os.mkdir(target_dir)
+        result = copy2_kernel(self.source, target_dir)
+        self.assertEqual(result, os.path.join(target_dir, 'source.bin'))
+        self.assertEqual(os.stat(self.source).st_mtime_ns, os.stat(result).st_mtime_ns)
+
+    def test_parallel_copy_hash_matches_sequential(self):
+        digest, copied = parallel_copy(self.source, self.target, algorithm='sha256', streams=3, chunk_size=256, window=4)
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(copied, len(self.data))
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_parallel_copy_without_hash(self):
+        digest, copied = parallel_copy(self.source, self.target, streams=2, chunk_size=1000)
+        self.assertIsNone(digest)
+        self.assertEqual(os.path.getsize(self.target), len(self.data))
+
+    def test_parallel_copy_shared_budget(self):
+        budget = ParallelCopyBudget(max_bytes=1024, max_streams=3)
+        acquire_bytes = budget.acquire_bytes
+        peak = []
+
+        def tracking_acquire_bytes(size, stop):
+            acquired = acquire_bytes(size, stop)
+            peak.append((budget.bytes_in_use, budget.streams_in_use))
+            return acquired
+
+        budget.acquire_bytes = tracking_acquire_bytes
+        results = []
+
+        def copy(index):
+            target = os.path.join(self.tmp.name, f'target{index}.bin')
+            digest, _ = parallel_copy(self.source, target, algorithm='sha256', streams=4, chunk_size=256,
+                                      budget=budget)
+            results.append(digest)
+
+        threads = [threading.Thread(target=copy, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [hashlib.sha256(self.data).hexdigest()] * 4)
+        self.assertLessEqual(max(used for used, _ in peak), 1024)
+        self.assertLessEqual(max(streams for _, streams in peak), 3)
+        self.assertEqual((budget.bytes_in_use, budget.streams_in_use), (0, 0))
+
+    def test_parallel_copy_budget_released_on_error(self):
+        budget = ParallelCopyBudget(max_bytes=4096, max_streams=4)
+        pread = os.pread
+
+        def failing_pread(fd, length, offset):
+            if offset >= 1024:
+                raise OSError(5, "EIO")
+            return pread(fd, length, offset)
+
+        with mock.patch.object(copy_engine.os, 'pread', failing_pread):
+            with self.assertRaises(OSError):
+                parallel_copy(self.source, self.target, algorithm='sha256', streams=2, chunk_size=256,
+                              budget=budget)
+        self.assertEqual((budget.bytes_in_use, budget.streams_in_use), (0, 0))
+
+    def test_parallel_copy_empty_file(self):
+        empty = os.path.join(self.tmp.name, 'empty')
+        open(empty, 'wb').close()
+        digest, copied = parallel_copy(empty, self.target, algorithm='md5')
+        self.assertEqual((digest, copied), (hashlib.md5(b'').hexdigest(), 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+from src.migration.copy_pipeline import CopyPipeline
+
+
+class TestCopyPipeline(unittest.TestCase):
+
+    def test_all_items_processed(self):
+        processed = []
+        lock = threading.Lock()
+
+        def worker(item):
+            with lock:
+                processed.append(item)
+            return True
+
+        pipeline = CopyPipeline(lambda: iter(range(100)), worker, max_workers=4, queue_size=5)
+        self.assertTrue(pipeline.run())
+        self.assertEqual(sorted(processed), list(range(100)))
+        self.assertEqual(pipeline.produced, 100)
+        self.assertEqual(pipeline.failed, 0)
+
+    def test_worker_starts_before_scan_finishes(self):
+        # Сканер ждёт, пока рабочий поток не обработает первый файл
+        first_done = threading.Event()
+
+        def producer():
+            yield 1
+            self.assertTrue(first_done.wait(timeout=5))
+            yield 2
+
+        def worker(item):
+            first_done.set()
+            return True
+
+        pipeline = CopyPipeline(producer, worker, max_workers=1, queue_size=1)
+        self.assertTrue(pipeline.run())
+        self.assertEqual(pipeline.processed, 2)
+
+    def test_failures_and_exceptions_counted(self):
+        def worker(item):
+            if item == 3:
+                raise RuntimeError("boom")
+            return item % 2 == 0
+
+        pipeline = CopyPipeline(lambda: iter(range(6)), worker, max_workers=2, queue_size=2)
+        self.assertFalse(pipeline.run())
+        self.assertEqual(pipeline.processed, 6)
+        self.assertEqual(pipeline.failed, 3)
+
+    def test_producer_error_is_raised(self):
+        def producer():
+            yield 1
+            raise PermissionError("denied")
+
+        pipeline = CopyPipeline(producer, lambda item: True, max_workers=2)
+        with self.assertRaises(PermissionError):
+            pipeline.run()
+
+    def test_cancel_stops_processing(self):
+        pipeline = None
+
+        def worker(item):
+            if item == 0:
+                pipeline.cancel()
+            return True
+
+        pipeline = CopyPipeline(lambda: iter(range(10000)), worker, max_workers=1, queue_size=10)
+        self.assertFalse(pipeline.run())
+        self.assertTrue(pipeline.cancelled)
+        self.assertLess(pipeline.processed, 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
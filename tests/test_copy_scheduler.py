@@ -0,0 +1,109 @@
+import threading
+import unittest
+
+from src.migration.copy_scheduler import DualLaneScheduler
+
+
+class TestDualLaneScheduler(unittest.TestCase):
+
+    def test_all_items_processed_once(self):
+        processed = []
+        lock = threading.Lock()
+
+        def worker(item):
+            with lock:
+                processed.append(item)
+            return True
+
+        sizes = [1, 500, 2, 1000, 3, 700] * 20
+        scheduler = DualLaneScheduler(
+            lambda: iter(enumerate(sizes)), worker, size_of=lambda item: item[1],
+            large_threshold=100, large_workers=2, small_workers=3, batch_size=4, queue_size=10
+        )
+        self.assertTrue(scheduler.run())
+        self.assertEqual(sorted(processed), list(enumerate(sizes)))
+        self.assertEqual(scheduler.large_files, 60)
+        self.assertEqual(scheduler.small_files, 60)
+        self.assertEqual(scheduler.small_batches, 15)
+
+    def test_large_files_dispatched_longest_first(self):
+        # Первый крупный файл удерживает единственный поток, пока сканер не закончит
+        first_started = threading.Event()
+        scan_done = threading.Event()
+        order = []
+
+        def producer():
+            yield 100
+            self.assertTrue(first_started.wait(timeout=5))
+            for size in (200, 500, 300):
+                yield size
+            scan_done.set()
+
+        def worker(size):
+            if not order:
+                first_started.set()
+                self.assertTrue(scan_done.wait(timeout=5))
+            order.append(size)
+            return True
+
+        scheduler = DualLaneScheduler(
+            producer, worker, size_of=lambda size: size,
+            large_threshold=50, large_workers=1, small_workers=1
+        )
+        self.assertTrue(scheduler.run())
+        self.assertEqual(order, [100, 500, 300, 200])
+
+    def test_small_lane_not_blocked_by_large(self):
+        small_done = threading.Event()
+
+        def worker(size):
+            if size >= 100:
+                # Крупный файл завершится только после мелкого
+                return small_done.wait(timeout=5)
+            small_done.set()
+            return True
+
+        scheduler = DualLaneScheduler(
+            lambda: iter([1000, 1]), worker, size_of=lambda size: size,
+            large_threshold=100, large_workers=1, small_workers=1
+        )
+        self.assertTrue(scheduler.run())
+
+    def test_cancel_stops_both_lanes(self):
+        scheduler = None
+
+        def worker(size):
+            scheduler.cancel()
+            return True
+
+        scheduler = DualLaneScheduler(
+            lambda: iter([1, 1000] * 5000), worker, size_of=lambda size: size,
+            large_threshold=100, large_workers=1, small_workers=1, batch_size=2, queue_size=10
+        )
+        self.assertFalse(scheduler.run())
+        self.assertTrue(scheduler.cancelled)
+        self.assertLess(scheduler.processed, 10000)
+
+    def test_prefetch_next_item(self):
+        events = []
+        lock = threading.Lock()
+
+        def worker(size):
+            with lock:
+                events.append(('copy', size))
+            return True
+
+        def prefetch(size):
+            with lock:
+                events.append(('prefetch', size))
+
+        scheduler = DualLaneScheduler(
+            lambda: iter([1, 2, 3]), worker, size_of=lambda size: size,
+            large_threshold=100, large_workers=1, small_workers=1, batch_size=3, prefetch=prefetch
+        )
+        self.assertTrue(scheduler.run())
+        self.assertEqual(events, [('prefetch', 2), ('copy', 1), ('prefetch', 3), ('copy', 2), ('copy', 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
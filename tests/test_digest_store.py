@@ -0,0 +1,42 @@
+import hashlib
+import unittest
+
+from src.migration.digest_store import DigestStore, path_key64
+
+
+def sorted_rows(items):
+    return sorted((path_key64(key), value) for key, value in items)
+
+
+class TestDigestStore(unittest.TestCase):
+
+    def test_lookup(self):
+        items = {f'vasya/docs/f{i}.txt': hashlib.sha256(str(i).encode()).hexdigest() for i in range(1000)}
+        store = DigestStore.from_sorted(sorted_rows(items.items()))
+        self.assertEqual(len(store), 1000)
+        self.assertEqual(store.digest_size, 32)
+        for key, value in items.items():
+            self.assertEqual(store.get(key), value)
+        self.assertIsNone(store.get('vasya/docs/missing.txt'))
+        self.assertEqual(store.nbytes, 1000 * (8 + 32))
+
+    def test_duplicate_key_keeps_last(self):
+        key = path_key64('a.txt')
+        store = DigestStore.from_sorted([(key, 'aa' * 32), (key, 'bb' * 32)])
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get('a.txt'), 'bb' * 32)
+
+    def test_uppercase_and_non_hex_values(self):
+        store = DigestStore.from_sorted(sorted_rows([('a.txt', 'AB' * 32), ('b.txt', 'not-a-hash')]))
+        self.assertEqual(store.get('a.txt'), 'ab' * 32)
+        self.assertEqual(store.get('b.txt'), 'not-a-hash')
+
+    def test_unsorted_keys_rejected(self):
+        store = DigestStore()
+        store.append(10, 'aa' * 32)
+        with self.assertRaises(ValueError):
+            store.append(5, 'bb' * 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
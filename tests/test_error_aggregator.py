@@ -0,0 +1,111 @@
+import threading
+import unittest
+
+from src.errors.error_codes import ErrorHandler, MigrationErrorCodes
+from src.migration.error_aggregator import ErrorAggregator
+
+
+class RecordingPublisher:
+
+    def __init__(self):
+        self.batches = []
+        self.event = threading.Event()
+
+    def __call__(self, errors, latest, counts):
+        self.batches.append((errors, latest, counts))
+        self.event.set()
+
+
+def fail(code, user="user1"):
+    try:
+        raise TimeoutError("share unavailable")
+    except TimeoutError as e:
+        return dict(error_code=code, details="file", exception=e, context={"user": user})
+
+
+class TestErrorAggregator(unittest.TestCase):
+
+    def make(self, publisher, published=True, **kwargs):
+        kwargs.setdefault("interval", 60)
+        aggregator = ErrorAggregator(ErrorHandler(), publisher, **kwargs)
+        if published:
+            # Публикация только что была: следующая - через interval
+            aggregator._last_publish = aggregator.clock()
+        return aggregator
+
+    def test_storm_published_as_one_batch(self):
+        publisher = RecordingPublisher()
+        aggregator = self.make(publisher)
+        for _ in range(1000):
+            aggregator.record(**fail(MigrationErrorCodes.COPY_001))
+        aggregator.record(**fail(MigrationErrorCodes.COPY_001, user="user2"))
+        self.assertEqual(publisher.batches, [])
+        aggregator.close()
+
+        self.assertEqual(len(publisher.batches), 1)
+        errors, latest, counts = publisher.batches[0]
+        self.assertEqual(counts, {"COPY_001": 1001})
+        self.assertEqual(latest["context"]["user"], "user2")
+        # Первая ошибка каждой группы и сводка повторов первой группы
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(errors[-1]["repeated"], 999)
+        self.assertEqual(aggregator.suppressed, 999)
+
+    def test_tracebacks_sampled(self):
+        publisher = RecordingPublisher()
+        aggregator = self.make(publisher, traceback_every=10)
+        infos = [aggregator.record(**fail(MigrationErrorCodes.SOURCE_003)) for _ in range(30)]
+        aggregator.close()
+        with_traceback = [i for i, info in enumerate(infos) if "traceback" in info["exception"]]
+        self.assertEqual(with_traceback, [0, 9, 19, 29])
+        self.assertEqual(infos[-1]["occurrences"], 30)
+        self.assertEqual(infos[-1]["exception"]["type"], "TimeoutError")
+
+    def test_recent_bounded(self):
+        aggregator = self.make(RecordingPublisher(), recent_limit=5)
+        for _ in range(20):
+            aggregator.record(**fail(MigrationErrorCodes.COPY_001))
+        aggregator.close()
+        recent = aggregator.recent()
+        self.assertEqual(len(recent), 5)
+        self.assertEqual(recent[-1]["occurrences"], 20)
+        self.assertEqual(len(aggregator.recent(2)), 2)
+
+    def test_first_error_published_by_timer(self):
+        publisher = RecordingPublisher()
+        aggregator = self.make(publisher, published=False)
+        aggregator.record(**fail(MigrationErrorCodes.COPY_001))
+        self.assertTrue(publisher.event.wait(timeout=5))
+        self.assertEqual(publisher.batches[0][1]["code"], "COPY_001")
+        aggregator.close()
+        self.assertEqual(len(publisher.batches), 1)
+
+    def test_summary(self):
+        aggregator = self.make(RecordingPublisher())
+        for _ in range(3):
+            aggregator.record(**fail(MigrationErrorCodes.COPY_001))
+        aggregator.close()
+        summary = aggregator.summary()
+        self.assertEqual(summary["total_errors"], 3)
+        self.assertEqual(summary["by_code"], {"COPY_001": 3})
+        self.assertEqual(summary["suppressed"], 2)
+
+    def test_handler_called_outside_lock(self):
+        aggregator = self.make(RecordingPublisher())
+        handle_error = aggregator.handler.handle_error
+        locked = []
+
+        def checking_handle_error(*args, **kwargs):
+            locked.append(aggregator._lock.locked())
+            return handle_error(*args, **kwargs)
+
+        aggregator.handler.handle_error = checking_handle_error
+        for _ in range(3):
+            aggregator.record(**fail(MigrationErrorCodes.COPY_001))
+        aggregator.close()
+        self.assertEqual(locked, [False, False, False])
+        self.assertEqual(aggregator.recent()[-1]["occurrences"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
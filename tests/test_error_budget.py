@@ -0,0 +1,90 @@
+import unittest
+
+from src.errors.error_codes import ErrorHandler, MigrationErrorCodes
+from src.migration.copy_scheduler import DualLaneScheduler
+from src.migration.error_aggregator import ErrorAggregator
+from src.migration.error_budget import ErrorBudget
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestErrorBudget(unittest.TestCase):
+
+    def test_trips_on_ratio(self):
+        trips = []
+        budget = ErrorBudget(sample_size=20, min_failures=5, max_ratio=0.5,
+                             on_trip=lambda category, reason: trips.append(category))
+        for _ in range(30):
+            budget.record_success()
+        for _ in range(9):
+            self.assertFalse(budget.record_failure("COPY"))
+        # 10 ошибок из последних 20 файлов
+        self.assertTrue(budget.record_failure("COPY"))
+        self.assertFalse(budget.record_failure("COPY"))
+        self.assertEqual(trips, ["COPY"])
+        self.assertEqual(budget.tripped[0], "COPY")
+
+    def test_scattered_failures_do_not_trip(self):
+        budget = ErrorBudget(sample_size=20, min_failures=5, max_ratio=0.5)
+        for _ in range(100):
+            budget.record_failure("COPY")
+            for _ in range(3):
+                budget.record_success()
+        self.assertIsNone(budget.tripped)
+        self.assertEqual(budget.failures["COPY"], 100)
+
+    def test_trips_on_rate(self):
+        clock = FakeClock()
+        budget = ErrorBudget(sample_size=1000, min_failures=5, max_ratio=0, window=10, max_rate=2, clock=clock)
+        # Частота ниже порога: ошибки старше окна не учитываются
+        for _ in range(40):
+            budget.record_success()
+            budget.record_success()
+            budget.record_failure("NETWORK")
+            clock.now += 1
+        self.assertIsNone(budget.tripped)
+        for _ in range(20):
+            budget.record_failure("NETWORK")
+        self.assertEqual(budget.tripped[0], "NETWORK")
+
+    def test_other_categories_ignored(self):
+        budget = ErrorBudget(sample_size=10, min_failures=2, max_ratio=0.5, categories=("SOURCE",))
+        for _ in range(10):
+            budget.record_failure("VERIFY")
+        self.assertIsNone(budget.tripped)
+        for _ in range(5):
+            budget.record_failure("SOURCE")
+        # VERIFY учитывается только как исход: 5 ошибок SOURCE из последних 10 файлов
+        self.assertEqual(budget.tripped[0], "SOURCE")
+
+    def test_trip_cancels_scheduler(self):
+        aggregator = ErrorAggregator(ErrorHandler(), lambda *args: None, interval=60)
+        budget = ErrorBudget(sample_size=20, min_failures=10, max_ratio=0.5,
+                             on_trip=lambda category, reason: scheduler.cancel())
+        unsubscribe = aggregator.subscribe(lambda error_info: budget.record_failure(error_info["category"]))
+
+        def worker(item):
+            aggregator.record(MigrationErrorCodes.COPY_001, context={"user": "user1"})
+            return False
+
+        scheduler = DualLaneScheduler(
+            lambda: iter(range(10000)), worker, size_of=lambda item: 1,
+            large_threshold=100, large_workers=1, small_workers=2, batch_size=4, queue_size=10
+        )
+        self.assertFalse(scheduler.run())
+        unsubscribe()
+        aggregator.close()
+        self.assertTrue(scheduler.cancelled)
+        self.assertEqual(budget.tripped[0], "COPY")
+        self.assertLess(scheduler.processed, 10000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from src.migration.hash_cache import HashCache
+
+
+class TestHashCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'hash_cache.db')
+        self.files = []
+        for i in range(5):
+            path = os.path.join(self.tmp.name, f'f{i}')
+            with open(path, 'wb') as f:
+                f.write(b'x' * (i + 1))
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_persisted_between_instances(self):
+        cache = HashCache(self.db_path, batch_size=2)
+        st = os.stat(self.files[0])
+        cache.put(st, 'sha256', 'aa')
+        self.assertEqual(cache.get(st, 'sha256'), 'aa')
+        self.assertIsNone(cache.get(st, 'md5'))
+        cache.close()
+
+        cache = HashCache(self.db_path)
+        self.assertEqual(cache.get(os.stat(self.files[0]), 'sha256'), 'aa')
+        cache.close()
+
+    def test_invalidated_by_size_or_mtime(self):
+        cache = HashCache(self.db_path)
+        path = self.files[1]
+        cache.put(os.stat(path), 'sha256', 'aa')
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        self.assertIsNone(cache.get(os.stat(path), 'sha256'))
+        cache.close()
+
+    def test_lru_trim(self):
+        cache = HashCache(self.db_path, max_entries=3, batch_size=1)
+        stats = [os.stat(path) for path in self.files]
+        for i, st in enumerate(stats[:3]):
+            cache.put(st, 'sha256', f'h{i}')
+        # Первая запись использована последней и остаётся после сокращения
+        self.assertEqual(cache.get(stats[0], 'sha256'), 'h0')
+        for i, st in enumerate(stats[3:], start=3):
+            cache.put(st, 'sha256', f'h{i}')
+        cache.flush()
+
+        self.assertEqual(cache.get(stats[0], 'sha256'), 'h0')
+        self.assertIsNone(cache.get(stats[1], 'sha256'))
+        self.assertEqual(cache.get(stats[4], 'sha256'), 'h4')
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import errno
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src.migration import hash_engine
+from src.migration.hash_engine import (
+    READ_DIRECT, READ_DONTNEED, hash_file, hash_sampled, is_network_path, sample_offsets
+)
+
+
+class TestHashEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = os.urandom(3 * 1024 * 1024 + 123)
+        self.path = os.path.join(self.tmp.name, 'data.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_matches_hashlib(self):
+        result = hash_file(self.path, 'sha256', buffer_size=1024 * 1024)
+        self.assertEqual(result, {'sha256': hashlib.sha256(self.data).hexdigest()})
+
+    def test_several_algorithms_one_pass(self):
+        result = hash_file(self.path, ('sha256', 'md5', 'sha1'))
+        self.assertEqual(result['md5'], hashlib.md5(self.data).hexdigest())
+        self.assertEqual(result['sha1'], hashlib.sha1(self.data).hexdigest())
+        self.assertEqual(result['sha256'], hashlib.sha256(self.data).hexdigest())
+
+    def test_mmap_matches_read(self):
+        if is_network_path(self.path):
+            self.skipTest('временная директория на сетевой ФС')
+        result = hash_file(self.path, 'sha256', buffer_size=1024 * 1024, use_mmap=True, mmap_min_size=1)
+        self.assertEqual(result['sha256'], hashlib.sha256(self.data).hexdigest())
+
+    def test_empty_file(self):
+        path = os.path.join(self.tmp.name, 'empty')
+        open(path, 'wb').close()
+        self.assertEqual(hash_file(path, 'md5', use_mmap=True, mmap_min_size=0)['md5'], hashlib.md5(b'').hexdigest())
+
+    def test_dontneed_matches_hashlib(self):
+        result = hash_file(self.path, ('sha256', 'md5'), buffer_size=1024 * 1024, read_mode=READ_DONTNEED)
+        self.assertEqual(result['sha256'], hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(result['md5'], hashlib.md5(self.data).hexdigest())
+
+    def test_direct_matches_hashlib(self):
+        # Размер буфера не кратен выравниванию, хвост файла не выровнен
+        result = hash_file(self.path, 'sha256', buffer_size=1024 * 1024 + 1, read_mode=READ_DIRECT)
+        self.assertEqual(result['sha256'], hashlib.sha256(self.data).hexdigest())
+
+    def test_direct_unsupported_falls_back(self):
+        unsupported = OSError(errno.EINVAL, 'Invalid argument')
+        with mock.patch.object(hash_engine, '_hash_direct', side_effect=unsupported), \
+                mock.patch.object(hash_engine, '_hash_dontneed', wraps=hash_engine._hash_dontneed) as dontneed:
+            result = hash_file(self.path, 'sha256', read_mode=READ_DIRECT)
+        dontneed.assert_called_once()
+        self.assertEqual(result['sha256'], hashlib.sha256(self.data).hexdigest())
+
+    def test_unknown_read_mode(self):
+        with self.assertRaises(ValueError):
+            hash_file(self.path, 'sha256', read_mode='no-such-mode')
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            hash_file(self.path, 'no-such-hash')
+
+
+class TestSampledHash(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.block = 64 * 1024
+        self.data = bytearray(os.urandom(self.block * 40 + 77))
+        self.path = os.path.join(self.tmp.name, 'data.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_offsets_deterministic(self):
+        size = len(self.data)
+        offsets = sample_offsets(size, self.block, 8, 'a/b.bin:1')
+        self.assertEqual(offsets, sample_offsets(size, self.block, 8, 'a/b.bin:1'))
+        self.assertEqual(len(offsets), 10)
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(offsets[-1], size - self.block)
+        self.assertTrue(all(offset % self.block == 0 for offset in offsets[:-1]))
+
+    def test_small_file_not_sampled(self):
+        self.assertIsNone(sample_offsets(self.block * 5, self.block, 8, 'x'))
+
+    def test_sampled_block_change_detected(self):
+        offsets = sample_offsets(len(self.data), self.block, 8, 'seed')
+        before = hash_sampled(self.path, offsets, self.block)
+        with open(self.path, 'r+b') as f:
+            f.seek(offsets[3] + 10)
+            f.write(b'X')
+        self.assertNotEqual(hash_sampled(self.path, offsets, self.block), before)
+
+    def test_truncated_file(self):
+        offsets = sample_offsets(len(self.data), self.block, 8, 'seed')
+        os.truncate(self.path, len(self.data) - 100)
+        with self.assertRaises(EOFError):
+            hash_sampled(self.path, offsets, self.block)
+
+    def test_read_modes_agree(self):
+        offsets = sample_offsets(len(self.data), self.block, 8, 'seed')
+        expected = hash_sampled(self.path, offsets, self.block)
+        for read_mode in (READ_DONTNEED, READ_DIRECT):
+            self.assertEqual(hash_sampled(self.path, offsets, self.block, read_mode=read_mode), expected)
+            with self.assertRaises(EOFError):
+                hash_sampled(self.path, offsets + [len(self.data) - 10], self.block, read_mode=read_mode)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.migration.hash_index import HashIndex, canonical_key, migrate_hash_db, user_prefix
+
+
+def make_db(path, rows, column='current_hash'):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(f"CREATE TABLE file_hashes (path TEXT, {column} TEXT)")
+        conn.executemany(f"INSERT INTO file_hashes (path, {column}) VALUES (?, ?)", rows)
+    conn.close()
+
+
+class TestCanonicalKey(unittest.TestCase):
+
+    def test_separators_and_case(self):
+        self.assertEqual(canonical_key('Vasya\\Documents\\File.TXT'), 'vasya/documents/file.txt')
+        self.assertEqual(canonical_key('/vasya//Документы/./a.txt'), 'vasya/документы/a.txt')
+
+    def test_network_prefix(self):
+        path = '//192.168.81.54/share/EXTNAME/vasya/Документы/file1.txt'
+        self.assertEqual(canonical_key(path, '//192.168.81.54/share/EXTNAME'), 'vasya/документы/file1.txt')
+        self.assertEqual(canonical_key('\\\\srv\\share\\vasya\\a.txt'), 'vasya/a.txt')
+
+    def test_user_prefix_strips_domain(self):
+        self.assertEqual(user_prefix('Vasya@corp.local'), 'vasya/')
+
+
+class TestHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'file_hashes.db')
+        make_db(self.db_path, [
+            ('vasya\\Documents\\a.txt', 'aaa'),
+            ('vasya/Desktop/b.txt', 'bbb'),
+            ('vasya2\\c.txt', 'ccc'),
+            ('petya\\Documents\\a.txt', 'ppp'),
+            (None, 'xxx'),
+        ])
+        self.index = HashIndex.for_database(self.db_path, self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_loads_only_user_prefix(self):
+        hashes = self.index.for_user('vasya')
+        self.assertEqual(len(hashes), 2)
+        self.assertEqual(hashes.lookup('Documents/a.txt'), 'aaa')
+        self.assertEqual(hashes.lookup('desktop/b.txt'), 'bbb')
+        self.assertIsNone(hashes.lookup('c.txt'))
+        self.assertEqual(self.index.for_user('petya').lookup('Documents/a.txt'), 'ppp')
+
+    def test_index_rebuilt_only_when_database_changes(self):
+        self.assertTrue(self.index.ensure())
+        self.assertFalse(self.index.ensure())
+
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute("INSERT INTO file_hashes (path, current_hash) VALUES (?, ?)", ('vasya/new.txt', 'nnn'))
+        conn.close()
+        st = os.stat(self.db_path)
+        os.utime(self.db_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+        self.assertTrue(self.index.ensure())
+        self.assertEqual(self.index.for_user('vasya').lookup('new.txt'), 'nnn')
+
+    def test_hash_column_name(self):
+        db_path = os.path.join(self.tmp.name, 'other.db')
+        make_db(db_path, [('vasya/a.txt', 'aaa')], column='hash')
+        index = HashIndex.for_database(db_path, self.tmp.name)
+        self.assertEqual(index.for_user('vasya').lookup('a.txt'), 'aaa')
+
+
+class TestMigrateHashDb(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'file_hashes.db')
+        make_db(self.db_path, [
+            ('//srv/share/EXT/Vasya/Documents/a.txt', 'aaa'),
+            ('//srv/share/EXT/petya/b.txt', 'bbb'),
+        ])
+        self.index = HashIndex.for_database(self.db_path, self.tmp.name, network_prefix='//srv/share/EXT')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_canonical_database_queried_directly(self):
+        self.assertEqual(migrate_hash_db(self.db_path, '//srv/share/EXT'), 2)
+        self.assertEqual(self.index.for_user('vasya').lookup('documents/A.txt'), 'aaa')
+        # Индекс-спутник для приведённой базы не строится
+        self.assertFalse(os.path.exists(self.index.index_path))
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT path FROM file_hashes WHERE path_key = 'petya/b.txt'").fetchone(),
+                         ('//srv/share/EXT/petya/b.txt',))
+        conn.close()
+
+    def test_rows_added_after_migration(self):
+        migrate_hash_db(self.db_path, '//srv/share/EXT')
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute("INSERT INTO file_hashes (path, current_hash) VALUES (?, ?)",
+                         ('//srv/share/EXT/vasya/new.txt', 'nnn'))
+        conn.close()
+
+        # Строка без ключа: используется индекс-спутник
+        self.assertEqual(self.index.for_user('vasya').lookup('new.txt'), 'nnn')
+        self.assertEqual(migrate_hash_db(self.db_path, '//srv/share/EXT'), 1)
+
+    def test_prefix_change_recomputes_keys(self):
+        migrate_hash_db(self.db_path, '//srv/share/EXT')
+        self.assertEqual(migrate_hash_db(self.db_path, '//srv/share'), 2)
+        index = HashIndex.for_database(self.db_path, self.tmp.name, network_prefix='//srv/share')
+        self.assertEqual(index.for_user('ext').lookup('petya/b.txt'), 'bbb')
+
+
+if __name__ == '__main__':
+    unittest.main()
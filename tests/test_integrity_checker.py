@@ -0,0 +1,185 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from src.migration import integrity_checker
+from src.migration.hash_cache import HashCache
+
+
+class TestCheckIntegrity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'src', 'vasya')
+        self.target = os.path.join(self.tmp.name, 'dst')
+        for i in range(50):
+            path = os.path.join(self.source, f'd{i % 5}', f'f{i}.txt')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(1000 + i))
+        shutil.copytree(self.source, self.target)
+        self.config = mock.patch.dict(integrity_checker.config, {
+            'INTEGRITY_CHECK_METHOD': 'hash',
+            'DATABASE_PATH': None,
+            'JOURNAL_DIRECTORY': os.path.join(self.tmp.name, 'journal'),
+            'INTEGRITY_CHECK_WORKERS': 4,
+            'INTEGRITY_CHECK_PER_DEVICE': 2,
+            'HASH_CACHE_ENABLED': False,
+        })
+        self.config.start()
+        self.discrepancies_file = os.path.join(self.tmp.name, 'discrepancies.txt')
+
+    def tearDown(self):
+        self.config.stop()
+        self.tmp.cleanup()
+
+    def test_all_files_verified(self):
+        report = {'username': 'vasya', 'files_verified': 0}
+        self.assertTrue(integrity_checker.check_integrity(self.source, self.target, self.discrepancies_file, report))
+        self.assertEqual(report['files_verified'], 50)
+        self.assertEqual(report['total_files'], 50)
+        self.assertEqual(report['total_size'], sum(1000 + i for i in range(50)))
+
+    def test_unreadable_source_reported(self):
+        report = {'username': 'vasya', 'files_verified': 0}
+        missing = os.path.join(self.tmp.name, 'src', 'missing')
+        self.assertFalse(integrity_checker.check_integrity(missing, self.target, self.discrepancies_file, report))
+        self.assertEqual(len(report['discrepancies']), 1)
+        self.assertIn(missing, report['discrepancies'][0])
+
+    def test_final_progress_sent(self):
+        report = {'username': 'vasya', 'files_verified': 0}
+        with mock.patch.dict(integrity_checker.config, {'INTEGRITY_PROGRESS_INTERVAL': 3600}), \
+                mock.patch.object(integrity_checker, 'send_status') as send_status:
+            self.assertTrue(integrity_checker.check_integrity(self.source, self.target, self.discrepancies_file, report))
+        statuses = [call.kwargs['status'] for call in send_status.call_args_list]
+        self.assertIn("Проверка целостности: 50/50 файлов", statuses)
+
+    def test_discrepancies_collected(self):
+        os.remove(os.path.join(self.target, 'd1', 'f1.txt'))
+        with open(os.path.join(self.target, 'd2', 'f2.txt'), 'r+b') as f:
+            f.write(b'changed')
+
+        report = {'username': 'vasya', 'files_verified': 0}
+        self.assertFalse(integrity_checker.check_integrity(self.source, self.target, self.discrepancies_file, report))
+        self.assertEqual(report['files_verified'], 48)
+        self.assertEqual(len(report['discrepancies']), 2)
+        with open(self.discrepancies_file, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, sorted(lines))
+        self.assertTrue(any('f1.txt' in line and 'отсутствует' in line for line in lines))
+        self.assertTrue(any('f2.txt' in line for line in lines))
+
+
+class TestTieredCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'big.bin')
+        self.target = os.path.join(self.tmp.name, 'big_copy.bin')
+        with open(self.source, 'wb') as f:
+            f.write(os.urandom(64 * 1024 * 50))
+        shutil.copy2(self.source, self.target)
+        self.config = mock.patch.dict(integrity_checker.config, {
+            'HASH_CACHE_ENABLED': False,
+            'TIERED_FULL_HASH_THRESHOLD': 1024 * 1024,
+            'TIERED_SAMPLE_BLOCK_SIZE': 64 * 1024,
+            'TIERED_SAMPLE_BLOCKS': 8,
+            'TIERED_FULL_HASH_PERCENT': 0,
+        })
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        self.tmp.cleanup()
+
+    def _corrupt(self, offset):
+        st = os.stat(self.target)
+        with open(self.target, 'r+b') as f:
+            f.seek(offset)
+            f.write(b'corrupted')
+        os.utime(self.target, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_identical_files(self):
+        with mock.patch.object(integrity_checker, 'calculate_file_hash') as full_hash:
+            ok, _ = integrity_checker.tiered_check(self.source, self.target, seed='big.bin')
+            full_hash.assert_not_called()
+        self.assertTrue(ok)
+
+    def test_sampled_corruption_detected(self):
+        self._corrupt(64 * 1024 * 50 - 100)
+        ok, msg = integrity_checker.tiered_check(self.source, self.target, seed='big.bin')
+        self.assertFalse(ok)
+        self.assertIn('выборочных', msg)
+
+    def test_truncation_detected(self):
+        os.truncate(self.target, 64 * 1024 * 49)
+        ok, _ = integrity_checker.tiered_check(self.source, self.target, seed='big.bin')
+        self.assertFalse(ok)
+
+    def test_full_hash_percent(self):
+        integrity_checker.config['TIERED_FULL_HASH_PERCENT'] = 100
+        integrity_checker.config['TIERED_SAMPLE_BLOCKS'] = 1
+        self._corrupt(64 * 1024 * 50 - 100)
+        ok, msg = integrity_checker.tiered_check(self.source, self.target, seed='big.bin')
+        self.assertFalse(ok)
+        self.assertIn('хешей', msg)
+
+
+    def test_reference_hash_replaces_source_read(self):
+        integrity_checker.config['TIERED_FULL_HASH_THRESHOLD'] = 1024 * 1024 * 1024
+        with open(self.source, 'rb') as f:
+            reference = hashlib.sha256(f.read()).hexdigest()
+        source_record = integrity_checker.record_from_stat(self.source, 'big.bin', os.stat(self.source))
+        # Хеш потока копирования заменяет повторное чтение источника
+        os.remove(self.source)
+        ok, _ = integrity_checker.tiered_check(self.source, self.target, source_record, reference_hash=reference)
+        self.assertTrue(ok)
+        ok, msg = integrity_checker.tiered_check(
+            self.source, self.target, source_record, expected_hash='0' * 64, reference_hash=reference
+        )
+        self.assertFalse(ok)
+        self.assertIn('базой', msg)
+
+class TestHashCacheLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'file.bin')
+        with open(self.path, 'wb') as f:
+            f.write(b'data' * 1000)
+        self.cache = HashCache(os.path.join(self.tmp.name, 'hash_cache.db'))
+        self.patches = [
+            mock.patch.object(integrity_checker, '_hash_cache', self.cache),
+            mock.patch.dict(integrity_checker.config, {'HASH_CACHE_ENABLED': True, 'HASH_CACHE_NETWORK': True}),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_unchanged_file_not_reread(self):
+        expected = hashlib.sha256(b'data' * 1000).hexdigest()
+        self.assertEqual(integrity_checker.calculate_file_hash(self.path), expected)
+        with mock.patch.object(integrity_checker, 'hash_file') as hash_file:
+            self.assertEqual(integrity_checker.calculate_file_hash(self.path), expected)
+            hash_file.assert_not_called()
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_modified_file_rehashed(self):
+        integrity_checker.calculate_file_hash(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        self.assertEqual(integrity_checker.calculate_file_hash(self.path),
+                         hashlib.sha256(b'data' * 1000 + b'more').hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
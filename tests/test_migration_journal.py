@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.migration.migration_journal import MigrationJournal
+
+
+class TestMigrationJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'journal', 'migration_journal_user.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_records_committed_in_batches(self):
+        journal = MigrationJournal(self.path, batch_size=10, flush_interval=60)
+        for i in range(25):
+            journal.record(f'/src/{i}', f'/dst/{i}', 100, mtime_ns=i)
+        self.assertTrue(journal.flush(timeout=5))
+        self.assertEqual(journal.summary(), (25, 2500))
+        journal.close()
+
+    def test_flush_interval_commits_without_explicit_flush(self):
+        journal = MigrationJournal(self.path, batch_size=1000, flush_interval=0.05)
+        journal.record('/src/a', '/dst/a', 1)
+        # Запись видна другому соединению без flush/close
+        for _ in range(100):
+            with sqlite3.connect(self.path) as conn:
+                if conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]:
+                    break
+            journal._writer.join(0.05)
+        self.assertEqual(journal.summary(), (1, 1))
+        journal.close()
+
+    def test_reopen_and_replay(self):
+        journal = MigrationJournal(self.path)
+        journal.record('/src/a', '/dst/a', 10, mtime_ns=1)
+        journal.record('/src/b', '/dst/b', 20, verified=False)
+        journal.record('/src/a', '/dst/a', 30, mtime_ns=2)
+        journal.close()
+
+        reopened = MigrationJournal(self.path)
+        self.assertEqual(reopened.summary(), (1, 30))
+        self.assertEqual(
+            sorted(reopened.entries()),
+            [('/src/a', '/dst/a', 30, 2, 1), ('/src/b', '/dst/b', 20, None, 0)]
+        )
+        self.assertEqual(list(reopened.entries(verified_only=True)), [('/src/a', '/dst/a', 30, 2, 1)])
+        reopened.close()
+
+    def test_import_legacy_state(self):
+        journal = MigrationJournal(self.path)
+        imported = journal.import_entries({
+            '/src/a': {'target_file': '/dst/a', 'size': 5, 'timestamp': 1.0, 'verified': True},
+            '/src/b': {'target_file': '/dst/b', 'size': 7, 'timestamp': 1.0, 'verified': False},
+        })
+        self.assertEqual(imported, 2)
+        self.assertEqual(journal.summary(), (1, 5))
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
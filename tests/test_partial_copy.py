@@ -0,0 +1,79 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from src.migration.partial_copy import PartialCopyJournal, resumable_copy
+from src.migration.tree_walker import stat_record
+
+CHUNK = 1024
+
+
+class TestResumableCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'source.pst')
+        self.target = os.path.join(self.tmp.name, 'target.pst')
+        self.data = os.urandom(20 * CHUNK + 100)
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+        self.record = stat_record(self.source)
+        self.journal = PartialCopyJournal(os.path.join(self.tmp.name, 'journal'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def interrupted_copy(self, offset, prefix=None):
+        """Имитирует копирование, прерванное после контрольной точки offset."""
+        with open(self.target, 'wb') as f:
+            f.write(prefix if prefix is not None else self.data[:offset])
+            f.truncate(len(self.data))
+        self.journal.save({
+            'source': self.source, 'target': os.path.abspath(self.target),
+            'size': self.record.size, 'mtime_ns': self.record.mtime_ns,
+            'chunk_size': CHUNK, 'algorithm': 'sha256', 'started': 'x',
+            'offset': offset, 'checkpoint_hash': hashlib.sha256(self.data[:offset]).hexdigest()
+        })
+
+    def copy(self):
+        return resumable_copy(self.source, self.target, self.record, self.journal,
+                              streams=3, chunk_size=CHUNK, checkpoint_interval=4 * CHUNK)
+
+    def assert_target_complete(self, digest):
+        self.assertEqual(digest, hashlib.sha256(self.data).hexdigest())
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(self.journal.exists(self.target))
+
+    def test_full_copy_clears_journal(self):
+        digest, copied, resumed_from = self.copy()
+        self.assertEqual((copied, resumed_from), (len(self.data), 0))
+        self.assert_target_complete(digest)
+
+    def test_resume_from_checkpoint(self):
+        self.interrupted_copy(8 * CHUNK)
+        self.assertTrue(self.journal.exists(self.target))
+        digest, copied, resumed_from = self.copy()
+        self.assertEqual(resumed_from, 8 * CHUNK)
+        self.assertEqual(copied, len(self.data) - 8 * CHUNK)
+        self.assert_target_complete(digest)
+
+    def test_corrupted_prefix_restarts(self):
+        self.interrupted_copy(8 * CHUNK, prefix=b'\0' * 8 * CHUNK)
+        digest, copied, resumed_from = self.copy()
+        self.assertEqual(resumed_from, 0)
+        self.assert_target_complete(digest)
+
+    def test_changed_source_restarts(self):
+        self.interrupted_copy(8 * CHUNK)
+        os.utime(self.source, ns=(self.record.mtime_ns, self.record.mtime_ns + 10**9))
+        digest, _, resumed_from = resumable_copy(
+            self.source, self.target, stat_record(self.source), self.journal, chunk_size=CHUNK
+        )
+        self.assertEqual(resumed_from, 0)
+        self.assert_target_complete(digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import errno
+import tempfile
+import unittest
+from unittest import mock
+
+from src.migration.migration_journal import MigrationJournal
+from src.migration.scan_manifest import ScanManifest
+from src.migration.tree_walker import FileRecord, walk_tree
+
+
+def make_items(count):
+    return [
+        (FileRecord(f'/src/f{i}', f'f{i}', 10 * i, 1000 + i, 0o100644, i, 1), f'/dst/f{i}')
+        for i in range(count)
+    ]
+
+
+class TestScanManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manifest = ScanManifest(os.path.join(self.tmp.name, 'scan_manifest_user.db'))
+        self.journal = MigrationJournal(os.path.join(self.tmp.name, 'migration_journal_user.db'))
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def test_record_scan_passes_items_and_completes(self):
+        items = make_items(5)
+        scan = self.manifest.begin_scan('/src', '/dst')
+        self.assertEqual(list(scan.record(iter(items), batch_size=2)), items)
+        self.assertTrue(self.manifest.is_complete('/src', '/dst'))
+        self.assertFalse(self.manifest.is_complete('/src', '/other'))
+        self.assertFalse(self.manifest.is_complete('/src', '/dst', max_age=-1))
+        self.assertEqual(self.manifest.summary(), (5, 100))
+
+    def test_interrupted_scan_not_complete(self):
+        scan = self.manifest.begin_scan('/src', '/dst').record(iter(make_items(5)))
+        next(scan)
+        scan.close()
+        self.assertFalse(self.manifest.is_complete('/src', '/dst'))
+
+    def test_pending_excludes_verified_files(self):
+        items = make_items(4)
+        list(self.manifest.begin_scan('/src', '/dst').record(iter(items)))
+        self.journal.record('/src/f0', '/dst/f0', 0, mtime_ns=1000)
+        self.journal.record('/src/f1', '/dst/f1', 10, mtime_ns=1001, verified=False)
+        # Файл изменился после копирования
+        self.journal.record('/src/f2', '/dst/f2', 20, mtime_ns=1)
+        self.journal.flush()
+
+        pending = sorted(self.manifest.pending(self.journal.path))
+        self.assertEqual(pending, items[1:])
+        self.assertEqual(self.manifest.pending_summary(self.journal.path), (3, 60))
+
+
+
+class TestManifestReuse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        for rel in ('a/1.txt', 'a/2.txt', 'b/c/3.txt', 'root.txt'):
+            self.write(rel, b'x')
+        self.manifest = ScanManifest(os.path.join(self.tmp.name, 'manifest.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, rel, data):
+        path = os.path.join(self.src, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def scan(self, **kwargs):
+        scan = self.manifest.begin_scan(self.src, '/dst', **kwargs)
+        items = ((record, '/dst/' + record.rel_path) for record in walk_tree(self.src, dir_cache=scan))
+        return sorted(record.rel_path for record, _ in scan.record(items))
+
+    def keep_dir_mtime(self, rel_dir, change):
+        dir_path = os.path.join(self.src, rel_dir)
+        dir_stat = os.stat(dir_path)
+        change()
+        os.utime(dir_path, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+    def test_unchanged_directories_not_listed(self):
+        first = self.scan()
+        # Директория с прежним mtime не читается: список файлов берётся из манифеста
+        self.keep_dir_mtime('a', lambda: self.write('a/hidden.txt', b'x'))
+        self.assertEqual(self.scan(), first)
+
+    def test_removed_file_dropped_from_unchanged_directory(self):
+        self.scan()
+        self.keep_dir_mtime('a', lambda: os.remove(os.path.join(self.src, 'a', '1.txt')))
+        self.assertNotIn(os.path.join('a', '1.txt'), self.scan())
+
+    def test_changed_directory_rescanned(self):
+        self.scan()
+        self.write('b/c/new.txt', b'y')
+        self.assertIn(os.path.join('b', 'c', 'new.txt'), self.scan())
+
+    def test_files_in_unchanged_directories_restatted(self):
+        self.scan()
+        # Изменение файла на месте не меняет mtime директории
+        self.keep_dir_mtime('a', lambda: self.write('a/2.txt', b'much longer content'))
+        scan = self.manifest.begin_scan(self.src, '/dst')
+        items = ((record, '') for record in walk_tree(self.src, dir_cache=scan))
+        sizes = {record.rel_path: record.size for record, _ in scan.record(items)}
+        self.assertEqual(sizes[os.path.join('a', '2.txt')], len(b'much longer content'))
+        records = {r.rel_path: r.size for r in self.manifest.cached_walk(self.src)}
+        self.assertEqual(records[os.path.join('a', '2.txt')], len(b'much longer content'))
+
+    def test_cached_file_errors_reported(self):
+        self.scan()
+        denied = os.path.join(self.src, 'a', '1.txt')
+        os_stat = os.stat
+
+        def failing_stat(path, *args, **kwargs):
+            if path == denied:
+                raise PermissionError(errno.EACCES, "Permission denied", path)
+            return os_stat(path, *args, **kwargs)
+
+        errors = []
+        with mock.patch('os.stat', failing_stat):
+            records = [record.rel_path for record in
+                       self.manifest.cached_walk(self.src, on_error=lambda path, e: errors.append(path))]
+        # Ошибка stat файла из манифеста не прерывает обход, как и при чтении директории
+        self.assertEqual(errors, [denied])
+        self.assertNotIn(os.path.join('a', '1.txt'), records)
+        self.assertEqual(len(records), 3)
+
+    def test_cached_entry_no_longer_regular_file(self):
+        self.scan()
+
+        def replace_with_fifo():
+            path = os.path.join(self.src, 'a', '1.txt')
+            os.remove(path)
+            os.mkfifo(path)
+
+        self.keep_dir_mtime('a', replace_with_fifo)
+        self.assertNotIn(os.path.join('a', '1.txt'), self.scan())
+
+    def test_cached_walk_without_manifest(self):
+        records = sorted(r.rel_path for r in self.manifest.cached_walk(self.src))
+        self.assertEqual(len(records), 4)
+        self.scan()
+        self.assertEqual(sorted(r.rel_path for r in self.manifest.cached_walk(self.src)), records)
+
+    def test_existing_for_user_does_not_create(self):
+        directory = os.path.join(self.tmp.name, 'journal')
+        self.assertIsNone(ScanManifest.existing_for_user(directory, 'user'))
+        self.assertFalse(os.path.exists(directory))
+        ScanManifest.for_user(directory, 'user')
+        self.assertIsNotNone(ScanManifest.existing_for_user(directory, 'user'))
+
+    def test_cached_walk_survives_unreadable_manifest(self):
+        self.scan()
+        with open(self.manifest.path, 'wb') as f:
+            f.write(b'not a database' * 100)
+        records = sorted(r.rel_path for r in self.manifest.cached_walk(self.src))
+        self.assertEqual(len(records), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+
+from src.migration.state_replicator import StateReplicator
+
+
+class TestStateReplicator(unittest.TestCase):
+
+    def test_latest_snapshot_pushed(self):
+        saved = []
+        release = threading.Event()
+
+        def save(state):
+            # Первая запись "висит", пока не придут более новые снимки
+            release.wait(timeout=5)
+            saved.append(state["version"])
+            return True
+
+        replicator = StateReplicator(save, min_backoff=0.01)
+        for version in range(1, 6):
+            replicator.submit({"version": version})
+        release.set()
+        self.assertTrue(replicator.wait_pushed(5, timeout=5))
+        self.assertTrue(replicator.close(timeout=5))
+        # Промежуточные снимки заменены более новыми и не отправлялись
+        self.assertEqual(saved[-1], 5)
+        self.assertLessEqual(len(saved), 2)
+        self.assertEqual(saved, sorted(saved))
+
+    def test_failed_push_retried_with_backoff(self):
+        attempts = []
+
+        def save(state):
+            attempts.append(time.monotonic())
+            return len(attempts) >= 3
+
+        replicator = StateReplicator(save, min_backoff=0.05, max_backoff=1)
+        replicator.submit({"version": 1})
+        self.assertTrue(replicator.wait_pushed(1, timeout=5))
+        replicator.close(timeout=5)
+        self.assertEqual(replicator.failures, 2)
+        # Пауза удваивается: 0.05, затем 0.1
+        self.assertGreaterEqual(attempts[2] - attempts[1], attempts[1] - attempts[0])
+
+    def test_older_version_ignored(self):
+        saved = []
+        replicator = StateReplicator(lambda state: saved.append(state["version"]) or True)
+        replicator.submit({"version": 2})
+        self.assertTrue(replicator.wait_pushed(2, timeout=5))
+        replicator.submit({"version": 1})
+        replicator.close(timeout=5)
+        self.assertEqual(saved, [2])
+
+    def test_unavailable_share_does_not_block_submit(self):
+        blocked = threading.Event()
+        replicator = StateReplicator(lambda state: blocked.wait(timeout=5) and False, min_backoff=10)
+        start = time.monotonic()
+        for version in range(1, 100):
+            replicator.submit({"version": version})
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertFalse(replicator.wait_pushed(1, timeout=0.1))
+        blocked.set()
+        self.assertFalse(replicator.close(timeout=5))
+
+
+    def test_retry_now_skips_backoff(self):
+        attempts = []
+        replicator = StateReplicator(lambda state: attempts.append(state) or len(attempts) >= 2,
+                                     min_backoff=60, max_backoff=60)
+        replicator.submit({"version": 1})
+        deadline = time.monotonic() + 5
+        while replicator.failures == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(replicator.wait_pushed(1, timeout=0.1))
+        replicator.retry_now()
+        self.assertTrue(replicator.wait_pushed(1, timeout=5))
+        replicator.close(timeout=5)
+
+    def test_paused_replicator_does_not_push(self):
+        saved = []
+        replicator = StateReplicator(lambda state: saved.append(state["version"]) or True)
+        self.assertTrue(replicator.pause(timeout=5))
+        replicator.submit({"version": 1})
+        self.assertFalse(replicator.wait_pushed(1, timeout=0.1))
+        replicator.resume()
+        self.assertTrue(replicator.wait_pushed(1, timeout=5))
+
+        # Хранилище отмонтировано: при закрытии снимок не отправляется
+        self.assertTrue(replicator.pause(timeout=5))
+        replicator.submit({"version": 2})
+        self.assertFalse(replicator.close(timeout=5))
+        self.assertEqual(saved, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
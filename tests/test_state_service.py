@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+
+from src.migration.state_service import StateService
+
+
+class RecordingStore:
+
+    def __init__(self, fail=0):
+        self.saved = []
+        self.fail = fail
+        self.loads = 0
+        self.event = threading.Event()
+
+    def load(self):
+        self.loads += 1
+        return {"global": {"status": "starting"}}
+
+    def save(self, state):
+        if self.fail:
+            self.fail -= 1
+            return False
+        self.saved.append(state)
+        self.event.set()
+        return True
+
+
+def set_global(**values):
+    def apply(state):
+        changed = "status" in values and state["global"].get("status") != values["status"]
+        state["global"].update(values)
+        return changed
+    return apply
+
+
+class TestStateService(unittest.TestCase):
+
+    def test_updates_coalesced(self):
+        store = RecordingStore()
+        service = StateService(store.load, store.save, flush_interval=60, min_interval=60)
+        for i in range(1000):
+            service.update(set_global(last_heartbeat=i))
+        service.close()
+
+        self.assertEqual(store.loads, 1)
+        # Первое обновление записывается сразу, остальные - одной записью при закрытии
+        self.assertLessEqual(len(store.saved), 2)
+        self.assertEqual(store.saved[-1]["global"]["last_heartbeat"], 999)
+        self.assertEqual(service.updates, 1000)
+
+    def test_urgent_update_flushed_without_interval(self):
+        store = RecordingStore()
+        service = StateService(store.load, store.save, flush_interval=60, min_interval=0.05)
+        service.update(set_global(last_heartbeat=1))
+        self.assertTrue(store.event.wait(timeout=5))
+        store.event.clear()
+
+        service.update(set_global(status="in_progress"))
+        self.assertTrue(store.event.wait(timeout=5))
+        self.assertEqual(store.saved[-1]["global"]["status"], "in_progress")
+        service.close()
+
+    def test_writes_bounded_under_frequent_urgent_updates(self):
+        store = RecordingStore()
+        service = StateService(store.load, store.save, flush_interval=1, min_interval=0.2)
+        start = time.monotonic()
+        while time.monotonic() - start < 0.5:
+            service.update(set_global(status=f"s{service.updates}"))
+        service.close()
+        # Не больше одной записи за min_interval, плюс первая и итоговая
+        self.assertLessEqual(len(store.saved), 5)
+        self.assertEqual(store.saved[-1]["global"]["status"], service.get("global", "status"))
+
+    def test_failed_save_retried(self):
+        store = RecordingStore(fail=1)
+        service = StateService(store.load, store.save, flush_interval=60, min_interval=60)
+        service.update(set_global(last_error="x"))
+        # Первое обновление записывается сразу - эта запись не удаётся
+        deadline = time.monotonic() + 5
+        while service.failed_flushes == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(service.failed_flushes, 1)
+        self.assertEqual(store.saved, [])
+        service.close()
+        self.assertEqual(store.saved[-1]["global"]["last_error"], "x")
+
+    def test_versions_continue_loaded_state(self):
+        store = RecordingStore()
+        store.load = lambda: {"global": {}, "users": {}, "version": 7}
+        service = StateService(store.load, store.save, flush_interval=60, min_interval=60)
+        service.update(set_global(status="a"))
+        service.flush()
+        service.update(set_global(status="b"))
+        service.close()
+        self.assertEqual([state["version"] for state in store.saved], [8, 9])
+        self.assertEqual(service.saved_version, 9)
+
+    def test_snapshot_is_copy(self):
+        store = RecordingStore()
+        service = StateService(store.load, store.save)
+        snapshot = service.snapshot()
+        snapshot["global"]["status"] = "changed"
+        self.assertEqual(service.get("global", "status"), "starting")
+        service.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+from src.migration.state_store import StateStore, read_summary
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'state.db')
+        self.store = StateStore(self.path, max_errors=3)
+        self.state = {
+            "global": {"status": "in_progress", "last_heartbeat": "2024-01-01T00:00:00", "last_error": {"code": "COPY_001"}},
+            "users": {f"user{i}": "success" for i in range(100)},
+            "progress": {"user0": {"files_done": 1}},
+            "version": 1,
+        }
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(self.store.load())
+        self.assertTrue(self.store.save(self.state))
+        self.store.close()
+        self.store = StateStore(self.path)
+        self.assertEqual(self.store.load(), self.state)
+
+    def test_only_changes_written(self):
+        self.store.save(self.state)
+        changes_before = self.store._conn.total_changes
+        self.state["users"]["user5"] = "in_progress"
+        self.state["global"]["last_heartbeat"] = "2024-01-01T00:00:30"
+        del self.state["users"]["user7"]
+        self.state["version"] = 2
+        self.store.save(self.state)
+        # Пользователь, глобальное поле, удаление и версия
+        self.assertEqual(self.store._conn.total_changes - changes_before, 4)
+        self.assertNotIn("user7", self.store.load()["users"])
+
+    def test_errors_bounded(self):
+        for i in range(5):
+            self.store.add_error({"code": f"E{i}", "details": "x"}, username="user1")
+        self.store.save(self.state)
+        self.store.add_error({"code": "E5", "details": "x"})
+        self.store.save(self.state)
+        codes = [row[0] for row in self.store._conn.execute("SELECT code FROM errors ORDER BY id")]
+        self.assertEqual(codes, ["E3", "E4", "E5"])
+
+    def test_read_summary(self):
+        self.assertIsNone(read_summary(self.path))
+        self.state["users"]["user1"] = "in_progress"
+        self.state["users"]["user2"] = "failed"
+        self.store.save(self.state)
+        summary = read_summary(self.path)
+        self.assertEqual(summary["status"], "in_progress")
+        self.assertEqual(summary["total_users"], 100)
+        self.assertEqual(summary["users_completed"], 98)
+        self.assertEqual(summary["users_failed"], 1)
+        self.assertEqual(summary["users_in_progress"], 1)
+        self.assertEqual(summary["current_user"], "user1")
+        self.assertEqual(summary["last_error"], {"code": "COPY_001"})
+
+
+if __name__ == '__main__':
+    unittest.main()
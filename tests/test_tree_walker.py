@@ -0,0 +1,55 @@
+import os
+import unittest
+import tempfile
+
+from src.migration.tree_walker import stat_record, walk_tree
+
+
+class TestTreeWalker(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, 'Documents', 'sub'))
+        os.makedirs(os.path.join(self.root, 'extra_files'))
+        for rel, data in [('a.txt', b'a'), ('Documents/b.txt', b'bb'),
+                          ('Documents/sub/c.txt', b'ccc'), ('extra_files/d.txt', b'd'),
+                          ('.hidden', b'h')]:
+            with open(os.path.join(self.root, rel), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_records_match_stat(self):
+        records = {r.rel_path: r for r in walk_tree(self.root)}
+        self.assertEqual(len(records), 5)
+        record = records[os.path.join('Documents', 'sub', 'c.txt')]
+        st = os.stat(record.path)
+        self.assertEqual(record.size, 3)
+        self.assertEqual(record.mtime_ns, st.st_mtime_ns)
+        self.assertEqual(record.inode, st.st_ino)
+        self.assertEqual(record.dev, st.st_dev)
+
+    def test_skip_callbacks(self):
+        records = walk_tree(
+            self.root,
+            skip_dir=lambda rel_dir, name: name == 'extra_files',
+            skip_file=lambda rel_dir, name: name.startswith('.')
+        )
+        self.assertEqual(
+            sorted(r.rel_path for r in records),
+            sorted(['a.txt', os.path.join('Documents', 'b.txt'), os.path.join('Documents', 'sub', 'c.txt')])
+        )
+
+    def test_missing_root_raises(self):
+        with self.assertRaises(OSError):
+            list(walk_tree(os.path.join(self.root, 'missing')))
+
+    def test_stat_record_missing(self):
+        self.assertIsNone(stat_record(os.path.join(self.root, 'missing')))
+        self.assertEqual(stat_record(os.path.join(self.root, 'a.txt')).size, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()